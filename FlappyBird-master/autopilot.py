@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from flappybird import FlappyBird, WALL_UP_SIZE, WALL_DOWN_SIZE
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from course import Course  # noqa: E402
+from envs import FlappyBirdEnv  # noqa: E402
+
+
+class Autopilot:
+    """
+    Plays FlappyBird by searching ahead over jump and no-jump for every tick, with the same rules as updateWalls and
+    birdUpdate and the same wall rectangles.
+
+    The search is a beam search that goes one tick deeper at a time. Sequences that hit a wall or leave the screen
+    are dropped, sequences that end in the same state are merged, and of the rest only the beam_width closest to the
+    gap center are kept. It stops at max_depth ticks, when all kept sequences start with the same action, or when the
+    time budget of the decision is used up, which is checked before expanding every sequence, and picks the first
+    action of the best sequence found so far. A decision can still overrun its budget by the one expansion in
+    progress, and by however long the process is not scheduled, so the budget is a target, not a hard bound.
+
+    :param beam_width:  The number of sequences kept per tick of lookahead.
+    :param max_depth:   The number of ticks to look ahead at most.
+    :param jump_ticks:  The length of a jump the game starts: 15 when playing with run, 17 in training.
+    :param jump_move:   How far a jump moves the bird straight away: 0 in run, Y_CHANGE_FROM_ACTION[1] in training.
+    """
+
+    def __init__(self, beam_width=32, max_depth=60, jump_ticks=15, jump_move=0):
+        self.beam_width = beam_width
+        self.max_depth = max_depth
+        self.jump_ticks = jump_ticks
+        self.jump_move = jump_move
+
+        # Depth reached and time taken by the last decision.
+        self.depth = 0
+        self.latency = 0.0
+
+    def act(self, game, budget=0.005):
+        # 1 to jump now, 0 to wait. budget is the time in seconds the decision may take.
+        start = time.perf_counter()
+        deadline = start + budget
+        root = (game.birdY, game.jump, game.jumpSpeed, game.gravity, game.wallx, game.offset, game.counter)
+
+        # Every node is (state, first action), and every level of the search is sorted by distance to the gap, so the
+        # best node is the first. Waiting is listed first, so it wins ties.
+        frontier = []
+        for action in (0, 1):
+            state = self.step(game, root, action)
+            if state is not None:
+                frontier.append((state, action))
+        if not frontier:
+            self.depth, self.latency = 0, time.perf_counter() - start
+            return 0
+        frontier.sort(key=lambda node: self.distance_to_gap(node[0]))
+
+        # The deadline is checked before expanding every node, as a level of the beam can take longer than the budget.
+        # The search stops when the longest stretch between two checks so far, one node or one node and the sorting of
+        # a level, would not fit in the time left. A level cut short is dropped, and the answer comes from the last
+        # complete one.
+        depth = 1
+        last_check = time.perf_counter()
+        longest = 0.0
+        out_of_time = False
+        while depth < self.max_depth:
+            merged = {}
+            for state, first in frontier:
+                now = time.perf_counter()
+                longest = max(longest, now - last_check)
+                last_check = now
+                if now + longest >= deadline:
+                    out_of_time = True
+                    break
+                for action in (0, 1):
+                    child = self.step(game, state, action)
+                    if child is None:
+                        continue
+                    key = (int(child[0]), child[1], child[2], round(child[3], 1), child[4])
+                    if key not in merged:
+                        merged[key] = (child, first)
+            if out_of_time or not merged:
+                break
+            frontier = sorted(merged.values(), key=lambda node: self.distance_to_gap(node[0]))[:self.beam_width]
+            depth += 1
+            # Once all kept sequences start with the same action, searching deeper cannot change the answer.
+            if all(first == frontier[0][1] for _, first in frontier):
+                break
+
+        self.depth, self.latency = depth, time.perf_counter() - start
+        return frontier[0][1]
+
+    def step(self, game, state, action):
+        # The state after one tick, or None if the bird hits a wall or leaves the screen in it.
+        birdY, jump, jumpSpeed, gravity, wallx, offset, counter = state
+        if action:
+            birdY += self.jump_move
+            jump, gravity, jumpSpeed = self.jump_ticks, 5, 10
+
+        # updateWalls
+        wallx -= 2
+        if wallx < -80:
+            wallx = 400
+            counter += 1
+            offset = game.course.gap(counter) if game.course is not None else 0
+
+        # birdUpdate
+        if jump:
+            jumpSpeed -= 1
+            birdY -= jumpSpeed
+            jump -= 1
+        else:
+            birdY += gravity
+            gravity += 0.2
+
+        y = int(birdY)
+        if not 0 < y < 720:
+            return None
+        bird_x, bird_width, bird_height = game.bird[0], game.bird[2], game.bird[3]
+        if bird_x < wallx + WALL_UP_SIZE[0] - 10 and wallx < bird_x + bird_width:
+            up_y = int(370 + game.gap - offset + 10)
+            if y < up_y + WALL_UP_SIZE[1] and up_y < y + bird_height:
+                return None
+        if bird_x < wallx + WALL_DOWN_SIZE[0] - 10 and wallx < bird_x + bird_width:
+            down_y = int(0 - game.gap - offset - 10)
+            if y < down_y + WALL_DOWN_SIZE[1] and down_y < y + bird_height:
+                return None
+        return birdY, jump, jumpSpeed, gravity, wallx, offset, counter
+
+    @staticmethod
+    def distance_to_gap(state):
+        # How far the middle of the bird is from the middle of the gap.
+        birdY, offset = state[0], state[5]
+        return abs(birdY + 25 - (0 - 130 / 2 + 500 - offset))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Let the autopilot play headless and measure its score and decision '
+                                                 'latency.')
+    parser.add_argument('--ticks', type=int, default=20000)
+    parser.add_argument('--budget', type=float, default=0.005, help='Time per decision in seconds.')
+    parser.add_argument('--beam-width', type=int, default=32)
+    parser.add_argument('--max-depth', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the wall offsets.')
+    args = parser.parse_args()
+
+    game = FlappyBird(max_gens=1000000, headless=True, course=Course(-110, 110, seed=args.seed))
+    env = FlappyBirdEnv(game)
+    autopilot = Autopilot(args.beam_width, args.max_depth, jump_ticks=17, jump_move=-10)
+
+    latencies = np.zeros(args.ticks)
+    depths = np.zeros(args.ticks)
+    deaths = best = 0
+    env.reset()
+    start = time.perf_counter()
+    for tick in range(args.ticks):
+        action = autopilot.act(game, args.budget)
+        latencies[tick], depths[tick] = autopilot.latency, autopilot.depth
+        best = max(best, game.counter)
+        _, _, done = env.step(action)
+        if done:
+            deaths += 1
+            env.reset()
+    wall_time = time.perf_counter() - start
+
+    print('{} ticks in {:.2f}s, {} deaths, best score {}, current score {}'.format(args.ticks, wall_time, deaths,
+                                                                                 best, game.counter))
+    print('decision latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, mean depth {:.1f}'.format(
+        np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 99) * 1e3, latencies.max() * 1e3, depths.mean()))
+
+
+if __name__ == '__main__':
+    main()
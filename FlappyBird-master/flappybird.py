@@ -2,16 +2,56 @@
 
 import pygame
 from pygame.locals import *  # noqa
+import os
 import sys
-import random
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from convergence import ConvergenceTracker  # noqa: E402
+from metrics import MetricsSink  # noqa: E402
+from checkpoint import save_checkpoint, load_checkpoint, load_checkpoint_meta  # noqa: E402
+from dirty_renderer import DirtyRenderer, TextCache  # noqa: E402
+from asset_cache import load_image, load_atlas  # noqa: E402
+from fixed_timestep import FixedTimestep, interpolate  # noqa: E402
+from q_table import QTable  # noqa: E402
+from q_storage import DenseQ, state_features, storage_config, storage_from_config  # noqa: E402
+from replay_buffer import ReplayBuffer  # noqa: E402
+from discretizer import Discretizer  # noqa: E402
+from profiler import PhaseProfiler, SIMULATE, LEARN, RENDER, IO  # noqa: E402
+from course import Course  # noqa: E402
+from bird_physics import simulate, trajectory  # noqa: E402
+from trajectory import FLAP, JUMP_IN_PLACE, NO_ACTION  # noqa: E402
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
 Y_CHANGE_FROM_ACTION = {0: 0,
                         1: -10}
 
+# Sizes of the wall sprites (assets/bottom.png and assets/top.png), so collisions can be checked without loading them.
+WALL_UP_SIZE = (98, 500)
+WALL_DOWN_SIZE = (100, 500)
+
+# Default state grid: 24 bins of 20 pixels for the distance to the wall and 35 for the height above the gap center.
+# The lowest distance is when the wall is drawn at -80, the bird is at 70 and 44 wide. The distance to the wall is
+# always an integer, so its bins are looked up in a table.
+DX_BINS = Discretizer.uniform(-193.9, 20, 24, table_range=(-200, 300))
+DY_BINS = Discretizer.uniform(-264.9, 20, 35)
+
+
+def rects_collide(a, b):
+    # Same test as pygame.Rect.colliderect, but on plain (x, y, width, height) tuples truncated to integers.
+    ax, ay, aw, ah = [int(v) for v in a]
+    bx, by, bw, bh = [int(v) for v in b]
+    if aw <= 0 or ah <= 0 or bw <= 0 or bh <= 0:
+        return False
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
 
 class FlappyBird:
-    def __init__(self, max_gens):
+    def __init__(self, max_gens, gamma=0.5, learning_rate=0.9, random_factor=0.0, headless=False, rng=None,
+                 stop_threshold=None, stop_patience=1, metrics=None, replay_buffer=None, replay_batch_size=64,
+                 replay_every=16, dx_bins=DX_BINS, dy_bins=DY_BINS, profiler=None, course=None, recorder=None,
+                 q_storage=None):
 
         self.norm_diff = 10
         self.previous_norm = 0
@@ -22,18 +62,39 @@ class FlappyBird:
         self.max_gens = max_gens
         self.gen_counter = 0
         self.step_counter = 0
-        self.random_factor = 0.0
-        self.gamma = 0.5
-        self.learning_rate = 0.9
-
-        self.screen = pygame.display.set_mode((400, 700))
-        self.bird = pygame.Rect(65, 50, 50, 50)
-        self.background = pygame.image.load("assets/background.png").convert()
-        self.birdSprites = [pygame.image.load("assets/1.png").convert_alpha(),
-                            pygame.image.load("assets/2.png").convert_alpha(),
-                            pygame.image.load("assets/dead.png")]
-        self.wallUp = pygame.image.load("assets/bottom.png").convert_alpha()
-        self.wallDown = pygame.image.load("assets/top.png").convert_alpha()
+        self.random_factor = random_factor
+        self.gamma = gamma
+        self.learning_rate = learning_rate
+
+        # Generator for all random choices, created from a seed or given directly, so runs can be repeated exactly.
+        self.rng = np.random.default_rng(rng)
+
+        # Step and episode records are buffered here instead of printed.
+        self.metrics = metrics if metrics is not None else MetricsSink()
+
+        # Times the phases of train_run. It is disabled unless a profiler is given, and can be switched on any time.
+        self.profiler = profiler if profiler is not None else PhaseProfiler()
+
+        # Arrays for recording the score and norm diff at the end of each generation.
+        self.performance_array = np.zeros((self.max_gens, 1))
+        self.norm_diff_array = np.zeros((self.max_gens, 1))
+
+        # In headless mode no window is opened and no assets are loaded, so training can run without a display.
+        self.headless = headless
+        if not self.headless:
+            self.screen = pygame.display.set_mode((400, 700))
+            # Images are loaded once per process and converted to the display format, with the sprites sharing an atlas.
+            self.background = load_image(os.path.join(ASSET_DIR, "background.png"), alpha=False)
+            sprites = load_atlas([os.path.join(ASSET_DIR, name)
+                                  for name in ("1.png", "2.png", "dead.png", "bottom.png", "top.png")])
+            self.birdSprites = sprites[:3]
+            self.wallUp, self.wallDown = sprites[3:]
+
+            self.centerdot = pygame.Surface((5, 5))
+            self.centerdot.fill((0, 0, 0))
+
+        # Bird rectangle as [x, y, width, height].
+        self.bird = [65, 50, 50, 50]
         self.gap = 130
         self.wallx = 400
         self.birdY = 350
@@ -44,16 +105,34 @@ class FlappyBird:
         self.dead = False
         self.sprite = 0
         self.counter = 0
-        # self.offset = random.randint(-110, 110)
-        self.offset = 0
-
-        self.centerdot = pygame.Surface((5, 5))
-        self.centerdot.fill((0, 0, 0))
-
-        self.chain = np.zeros((5, 3))
+        # The wall offsets of every generation come from the course, e.g. Course(-110, 110, seed), so every
+        # generation flies the same walls. Without a course the offset is always 0.
+        self.course = course
+        self.offset = self.course_offset()
+
+        # If a TrajectoryRecorder is given, every tick is appended to it, to be replayed with trajectory.replay.
+        self.recorder = recorder
+        if self.recorder is not None:
+            self.recorder.start('flappybird', dict(course=self.course.config() if self.course is not None else None))
+
+        # The last Q matrix entry that was updated, punished when the bird dies.
+        self.last_update = None
+
+        # Transitions are collected in a replay buffer, and every replay_every steps a minibatch of replay_batch_size
+        # of them is applied to the Q matrix. The n-step returns carry the death penalty back over the last moves.
+        # The state, action and reward of the last move wait in pending_transition until its next state is known.
+        self.replay_buffer = replay_buffer if replay_buffer is not None else ReplayBuffer(
+            100000, n_step=5, gamma=gamma, alpha=0.6, rng=self.rng)
+        self.replay_batch_size = replay_batch_size
+        self.replay_every = replay_every
+        self.pending_transition = None
+
+        # Discretizers from the distance to the wall and the height above the gap center to the state indices.
+        self.dx_bins = dx_bins
+        self.dy_bins = dy_bins
 
         # Dim: action, dy, dx
-        self.R = np.zeros((2, 35, 24))
+        self.R = np.zeros((2, self.dy_bins.num_bins, self.dx_bins.num_bins))
 
         # Add reward when bird is in middle of gap and jumps while passing walls
         self.R[1, self.dy_to_index(0), self.dx_to_index(0)] = 100
@@ -71,151 +150,375 @@ class FlappyBird:
         #     self.R[:, self.dy_to_index(65), xindex] = -100
 
         # SECOND EDIT: SHOULD ALSO BE MANUAL
-        for y in range(350, 435):
-            yindex = self.dy_to_index(y)
-
-            self.R[1, yindex, :] = -100
-
-        self.Q = np.zeros((2, 35, 24))
+        self.R[1, self.dy_bins.indices(np.arange(350, 435)), :] = -100
+
+        # The Q values are kept in a QStorage with the dy and dx indices as features, e.g. a TileCodedQ over the
+        # bins, which shares what it learns between neighbouring states. By default it is a DenseQ of a Q matrix
+        # with the dims of R.
+        self.q_storage = q_storage if q_storage is not None else DenseQ.from_array(np.zeros(self.R.shape), 0)
+        if self.q_storage.num_actions != len(self.R):
+            raise ValueError('q_storage has {} actions, expected {}'.format(self.q_storage.num_actions, len(self.R)))
         # self.Q = np.random.rand(2, 35, 24)
         # self.Q[1, :, :] *= 0.05
 
-        # print(self.R[1, 60:70, :5])
+        # Keep track of the norm of Q as single entries change. Training stops early when the norm diff of
+        # stop_patience generations in a row is below stop_threshold.
+        self.tracker = ConvergenceTracker(self.q_storage.weights, stop_threshold, stop_patience)
+        self.q_table = QTable(self.q_storage, self.gamma, self.learning_rate, rng=self.rng,
+                              state_shape=self.R.shape[1:])
 
-    def train_run(self):
+        # print(self.R[1, 60:70, :5])
 
-        pygame.font.init()
-        clock = pygame.time.Clock()
-        font = pygame.font.SysFont("Arial", 50)
-        while self.gen_counter < self.max_gens:
+    @property
+    def Q(self):
+        # The Q matrix, dims action, dy, dx. For a DenseQ this is a view of its array, for other stores a copy of
+        # the values of every state.
+        if isinstance(self.q_storage, DenseQ):
+            return np.moveaxis(self.q_storage.Q, -1, 0)
+        states = state_features(np.arange(self.R[0].size), self.R.shape[1:])
+        return np.moveaxis(self.q_storage.values(states).reshape(self.R.shape[1:] + (-1,)), -1, 0)
+
+    def train_run(self, checkpoint_path=None, checkpoint_every=100):
+        # Train the Q matrix while the bird flies. In headless mode nothing is drawn and the loop is not capped by a
+        # clock, so only the physics and the Q updates are run.
+        # If checkpoint_path is given, a checkpoint is saved there every checkpoint_every generations and at the end.
+        if not self.headless:
+            pygame.font.init()
+            clock = pygame.time.Clock()
+            font = pygame.font.SysFont("Arial", 50)
+        last_checkpoint = self.gen_counter
+
+        while self.gen_counter < self.max_gens and not self.tracker.converged:
             # print('=' * 20)
             if not self.dead:
 
                 self.step_counter += 1
 
-                clock.tick(1000)
-
-                x_index = self.dx_to_index(self.bird_wall_dist())
-                y_index = self.dy_to_index(self.delta_y())
-
-                # print('delta y :', self.delta_y(), 'yindex: ', y_index)
-                # if self.delta_y() < self.gap / 2 and not self.dead:
-
-                # Random chance to pick random move, otherwise pick max Q
-                action = None
-                if random.uniform(0, 1) < self.random_factor:
-                    # Take action
-                    action = random.randint(0, 1)
-                    if self.R[action, y_index, x_index] == -1:
-                        continue
-
-                    else:
-                        action_list = [action]
-                        # print('Random action: ', action_list)
-
-                else:
-                    max_Q = np.max(self.Q[:, y_index, x_index])
-                    action_list = np.argwhere(self.Q[:, y_index, x_index] == max_Q).flatten().tolist()
-
-                    action_list = random.sample(action_list, len(action_list))
-                    # print('non random actions are ', action_list)
-
-                # print('going to state change')
-                state_change = 0
-                for potential_action in action_list:
-                    action = potential_action
-
-                    if self.R[action, y_index, x_index] < 0:
-                        # print('bad move')
-                        # print('*' * 20)
-                        # print('*' * 20)
-                        self.Q[action, y_index, x_index] = -1
-                        continue
-
-                    else:
-                        if not self.chain[0][2] == x_index:
-                            self.chain = np.roll(self.chain, 1, axis=0)
-                            state = [int(action), int(y_index), int(x_index)]
-                            self.chain[0] = state
-                        state_change = Y_CHANGE_FROM_ACTION[action]
-                        break
-
-                if self.R[action, y_index, x_index] == -1:
+                if not self.headless:
+                    clock.tick(1000)
+
+                self.profiler.start(LEARN)
+                birdY = self.birdY
+                moved = self.train_step()
+                self.profiler.stop()
+                if not moved:
                     continue
+                action = self.last_update[0]
+                if action and self.birdY == birdY:
+                    action = JUMP_IN_PLACE
 
-                self.birdY += state_change
-                new_y_index = self.dy_to_index(self.delta_y())
-
-                max_Q = np.max(self.Q[:, new_y_index, x_index])
-
-                if new_y_index < 70:
-                    self.Q[action, new_y_index, x_index] = (1 - self.learning_rate) * self.Q[action, new_y_index, x_index] + \
-                                   self.learning_rate * (self.R[action, new_y_index, x_index] + self.gamma * max_Q)
-                elif new_y_index >= 70:
-                    self.Q[action, new_y_index, x_index] = -100
-                #(self.Q[action, new_y_index, x_index] < 0) or
-
-
-                # if  (self.Q[action, new_y_index, x_index] > 10):
-                print('updating {}, {}, {} to '.format(action, new_y_index, x_index), ' to ',
-                  self.Q[action, new_y_index, x_index])
-                print('='*20)
-
-                print('dy: ', self.delta_y())
-                print('y: ', self.birdY)
-                print('dx: ', self.bird_wall_dist())
-                # print(self.chain)
-
-                if action:
-                    self.jump = 17
-                    self.gravity = 5
-                    self.jumpSpeed = 10
-
-            self.screen.fill((255, 255, 255))
-            self.screen.blit(self.background, (0, 0))
-            self.screen.blit(self.wallUp,
-                             (self.wallx, 360 + self.gap - self.offset))
-            self.screen.blit(self.wallDown,
-                             (self.wallx, 0 - self.gap - self.offset))
-            self.screen.blit(font.render(str(self.counter),
-                                         -1,
-                                         (255, 255, 255)),
-                             (200, 50))
-            if self.dead:
-                print('dead')
-                self.sprite = 2
-                self.Q[action, new_y_index, x_index] = -100
+            else:
+                self.profiler.start(LEARN)
+                self.punish_death()
+                self.profiler.stop()
+                action = NO_ACTION
 
-                for i in range(5):
-                    self.Q[tuple(self.chain[i])] = -100 + 20*i
-                    print('setting Q on ', self.chain[i], ' to ', -100 + 20*i)
-                # print('updating {}, {}, {} to '.format(action, new_y_index, x_index), ' to ',
-                #       self.Q[action, new_y_index, x_index])
+            if self.recorder is not None:
+                self.record_tick(action)
 
-            elif self.jump:
-                self.sprite = 1
-            self.screen.blit(self.birdSprites[self.sprite], (self.birdX, self.birdY))
-            if not self.dead:
-                self.sprite = 0
+            if not self.headless:
+                self.profiler.start(RENDER)
+                self.draw_train(font)
+                self.profiler.stop()
+
+            self.profiler.start(SIMULATE)
             self.updateWalls()
             self.birdUpdate()
+            self.profiler.stop()
+
+            if not self.headless:
+                self.profiler.start(RENDER)
+                # Draw center of gap
+                self.screen.blit(self.centerdot, (self.wallx,
+                                                  0 - self.gap / 2 + 500 - self.offset))
+                # Draw birdY
+                self.screen.blit(self.centerdot, (self.wallx,
+                                                  self.birdY))
+
+                pygame.display.update()
+                self.profiler.stop()
+            # print('=' * 20)
 
-            # Draw center of gap
-            self.screen.blit(self.centerdot, (self.wallx,
-                                              0 - self.gap / 2 + 500 - self.offset))
-            # Draw birdY
-            self.screen.blit(self.centerdot, (self.wallx,
-                                              self.birdY))
+            self.profiler.start(LEARN)
+            self.norm_diff = self.tracker.step()
+            self.previous_norm = self.tracker.previous_norm
+            self.current_norm = self.tracker.current_norm
+            self.profiler.stop()
+
+            if self.metrics.enabled():
+                self.profiler.start(IO)
+                self.metrics.step(step=self.step_counter, generation=self.gen_counter, dead=self.dead,
+                                  update=self.last_update,
+                                  q=self.Q_value(self.last_update) if self.last_update else None,
+                                  dy=self.delta_y(), y=self.birdY, dx=self.bird_wall_dist(),
+                                  norm=self.current_norm, norm_diff=self.norm_diff)
+                self.profiler.stop()
+
+            if checkpoint_path is not None and self.gen_counter >= last_checkpoint + checkpoint_every:
+                self.profiler.start(IO)
+                self.save(checkpoint_path)
+                self.profiler.stop()
+                last_checkpoint = self.gen_counter
+
+        self.profiler.start(IO)
+        self.metrics.flush()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if checkpoint_path is not None:
+            self.save(checkpoint_path)
+        self.profiler.stop()
+
+    def train_step(self):
+        # Pick an action for the current state, update the Q matrix and start a jump if the action says so.
+        # Returns False if no move was made.
+        x_index = self.dx_to_index(self.bird_wall_dist())
+        y_index = self.dy_to_index(self.delta_y())
+
+        # print('delta y :', self.delta_y(), 'yindex: ', y_index)
+        # if self.delta_y() < self.gap / 2 and not self.dead:
+
+        # The move before this one ends in the current state.
+        state = self.state_index(y_index, x_index)
+        if self.pending_transition is not None:
+            self.finish_move(state)
+
+        # Random chance to pick random move, otherwise pick max Q
+        action = None
+        if self.rng.random() < self.random_factor:
+            # Take action
+            action = int(self.rng.integers(0, 2))
+            if self.R[action, y_index, x_index] == -1:
+                return False
+
+            else:
+                action_list = [action]
+                # print('Random action: ', action_list)
 
-            pygame.display.update()
-            # print('=' * 20)
+        else:
+            Q_values = self.q_storage.row((y_index, x_index))
+            max_Q = np.max(Q_values)
+            action_list = np.argwhere(Q_values == max_Q).flatten().tolist()
+
+            action_list = self.rng.permutation(action_list).tolist()
+            # print('non random actions are ', action_list)
+
+        # print('going to state change')
+        state_change = 0
+        for potential_action in action_list:
+            action = potential_action
+
+            if self.R[action, y_index, x_index] < 0:
+                # print('bad move')
+                # print('*' * 20)
+                # print('*' * 20)
+                self.set_Q((action, y_index, x_index), -1)
+                continue
+
+            else:
+                state_change = Y_CHANGE_FROM_ACTION[action]
+                break
+
+        if self.R[action, y_index, x_index] == -1:
+            return False
+
+        # The reward is the one of the state the bird is moved to. The Q value of the move is updated in finish_move,
+        # once the state the move ends in is known.
+        self.birdY += state_change
+        new_y_index = self.dy_to_index(self.delta_y())
+        self.last_update = (action, y_index, x_index)
+        self.pending_transition = (state, action, self.R[action, new_y_index, x_index])
+
+        if self.step_counter % self.replay_every == 0 and len(self.replay_buffer) >= self.replay_batch_size:
+            self.replay()
+
+        if action:
+            self.jump = 17
+            self.gravity = 5
+            self.jumpSpeed = 10
+
+        return True
+
+    def take_action(self, action):
+        # Move the bird for an action: 1 moves it up and starts a jump, 0 does nothing.
+        self.birdY += Y_CHANGE_FROM_ACTION[action]
+        if action:
+            self.jump = 17
+            self.gravity = 5
+            self.jumpSpeed = 10
 
+    def flap(self):
+        # Start the jump of a key press when playing, which is shorter than the one of take_action and does not move
+        # the bird straight away.
+        self.jump = 15
+        self.gravity = 5
+        self.jumpSpeed = 10
 
-            self.previous_norm = self.current_norm
-            self.current_norm = np.linalg.norm(self.Q)
-            self.norm_diff = abs(self.previous_norm - self.current_norm)
-            print('prev norm: ', self.previous_norm, 'cur norm: ', self.current_norm, 'norm diff: ', self.norm_diff)
-            print(np.array_str(self.Q[1, 30:35, :10], precision=1))
+    def record_tick(self, action):
+        # Append the state after the action of this tick to the recorder, before the walls and the bird move.
+        self.recorder.append((self.gen_counter, action, self.dead, self.birdY, self.jump, self.jumpSpeed, self.gravity,
+                              self.wallx, self.offset, self.counter))
+
+    def finish_move(self, next_state):
+        # Apply the Bellman update of the pending move now that the state it ends in is known, and add it to the
+        # replay buffer. All Q updates, online, replayed or offline, are for the state a move starts from.
+        state, action, reward = self.pending_transition
+        self.pending_transition = None
+        y_index, x_index = divmod(state, self.dx_bins.num_bins)
+        max_Q = np.max(self.q_storage.row(divmod(next_state, self.dx_bins.num_bins)))
+        self.set_Q((action, y_index, x_index),
+                   (1 - self.learning_rate) * self.q_storage.row((y_index, x_index))[action] +
+                   self.learning_rate * (reward + self.gamma * max_Q))
+        self.replay_buffer.add(state, action, reward, next_state)
+
+    def punish_death(self):
+        # Punish the last update, and end the episode in the replay buffer with the move that led to the death.
+        # Its n-step returns pass the punishment on to the moves before it.
+        if self.last_update is not None:
+            self.set_Q(self.last_update, -100)
+
+        if self.pending_transition is not None:
+            state, action, _ = self.pending_transition
+            self.replay_buffer.add(state, action, -100, state, True)
+            self.pending_transition = None
+            if self.metrics.enabled():
+                self.metrics.step(event='death', state=state, action=action, replay_size=len(self.replay_buffer))
+
+    def replay(self):
+        # Apply a minibatch from the replay buffer to the Q matrix in one vectorized update. The TD errors set the
+        # priorities the transitions are sampled with next time.
+        slots, batch, weights = self.replay_buffer.sample(self.replay_batch_size)
+        td_errors = self.q_table.td_errors(*batch)
+        self.replay_buffer.update_priorities(slots, td_errors)
+        self.tracker.change(*self.q_table.apply_td_errors(batch[0], batch[1], td_errors * weights))
+
+    def state_index(self, y_index, x_index):
+        # Flat index of a state.
+        return y_index * self.dx_bins.num_bins + x_index
+
+    def Q_value(self, index):
+        # An entry of the Q matrix, with index (action, y_index, x_index).
+        return self.q_storage.row(index[1:])[index[0]]
+
+    def set_Q(self, index, value):
+        # Set an entry of the Q matrix and keep the norm tracker up to date.
+        self.tracker.change(*self.q_storage.set_value(index[1:], index[0], value))
+
+    def save(self, path):
+        # Save the Q matrix, hyperparameters, counters, bird and wall state and random generator state to a
+        # checkpoint directory. A store other than DenseQ is saved as well, and Q is only a copy of its values for
+        # tools that read the matrix.
+        dense = isinstance(self.q_storage, DenseQ)
+        save_checkpoint(path,
+                        dict(Q=self.Q,
+                             performance_array=self.performance_array,
+                             norm_diff_array=self.norm_diff_array,
+                             **{'replay_' + name: array for name, array in self.replay_buffer.arrays().items()},
+                             **({} if dense else {'q_storage_' + name: array
+                                                  for name, array in self.q_storage.arrays().items()})),
+                        dict(max_gens=self.max_gens,
+                             gamma=self.gamma,
+                             learning_rate=self.learning_rate,
+                             random_factor=self.random_factor,
+                             dx_edges=self.dx_bins.edges,
+                             dx_table_range=self.dx_bins.table_range,
+                             dy_edges=self.dy_bins.edges,
+                             dy_table_range=self.dy_bins.table_range,
+                             course=self.course.config() if self.course is not None else None,
+                             stop_threshold=self.tracker.stop_threshold,
+                             stop_patience=self.tracker.stop_patience,
+                             gen_counter=self.gen_counter,
+                             step_counter=self.step_counter,
+                             birdY=self.birdY,
+                             bird=self.bird,
+                             jump=self.jump,
+                             jumpSpeed=self.jumpSpeed,
+                             gravity=self.gravity,
+                             wallx=self.wallx,
+                             offset=self.offset,
+                             dead=self.dead,
+                             counter=self.counter,
+                             last_update=self.last_update,
+                             pending_transition=self.pending_transition,
+                             norm_diff=self.norm_diff,
+                             previous_norm=self.previous_norm,
+                             current_norm=self.current_norm,
+                             squared_norm=self.tracker.squared_norm,
+                             converged_episodes=self.tracker.converged_episodes,
+                             rng_state=self.rng.bit_generator.state,
+                             q_storage=None if dense else storage_config(self.q_storage)))
+
+    def load(self, path, mmap_mode=None):
+        # Resume from a checkpoint saved with save. With mmap_mode='r' the Q matrix of a DenseQ is memory-mapped
+        # read-only, so it opens instantly and can be shared by several processes, but can not be trained further.
+        # Other stores are read into memory.
+        arrays, meta = load_checkpoint(path, mmap_mode)
+        if arrays['Q'].shape != self.R.shape:
+            raise ValueError('Checkpoint Q matrix has shape {}, expected {}'.format(arrays['Q'].shape, self.R.shape))
+
+        if meta.get('q_storage') is None:
+            self.q_storage = DenseQ.from_array(arrays['Q'], 0)
+        else:
+            self.q_storage = storage_from_config(meta['q_storage'])
+            self.q_storage.restore({name[len('q_storage_'):]: np.array(array) for name, array in arrays.items()
+                                    if name.startswith('q_storage_')})
+        # The replay buffer needs the gamma of the checkpoint to tell the step counts of older checkpoints.
+        self.replay_buffer.set_gamma(meta['gamma'])
+        self.replay_buffer.restore({name[len('replay_'):]: np.array(array) for name, array in arrays.items()
+                                    if name.startswith('replay_')})
+        self.max_gens = meta['max_gens']
+        self.performance_array = np.zeros((self.max_gens, 1))
+        self.performance_array[:len(arrays['performance_array'])] = arrays['performance_array']
+        self.norm_diff_array = np.zeros((self.max_gens, 1))
+        self.norm_diff_array[:len(arrays['norm_diff_array'])] = arrays['norm_diff_array']
+
+        for name in ('gamma', 'learning_rate', 'random_factor', 'gen_counter', 'step_counter', 'birdY', 'bird',
+                     'jump', 'jumpSpeed', 'gravity', 'wallx', 'offset', 'dead', 'counter', 'norm_diff',
+                     'previous_norm', 'current_norm'):
+            setattr(self, name, meta[name])
+        # The Q table uses the gamma and learning rate of the checkpoint.
+        self.q_table = QTable(self.q_storage, self.gamma, self.learning_rate, rng=self.rng,
+                              state_shape=self.R.shape[1:])
+        self.last_update = tuple(meta['last_update']) if meta['last_update'] is not None else None
+        self.pending_transition = tuple(meta['pending_transition']) if meta['pending_transition'] is not None else None
+        self.rng.bit_generator.state = meta['rng_state']
+
+        self.tracker.stop_threshold = meta['stop_threshold']
+        self.tracker.stop_patience = meta['stop_patience']
+        self.tracker.squared_norm = meta['squared_norm']
+        self.tracker.previous_norm = self.previous_norm
+        self.tracker.current_norm = self.current_norm
+        self.tracker.converged_episodes = meta['converged_episodes']
+
+    @classmethod
+    def from_checkpoint(cls, path, mmap_mode=None, headless=False, metrics=None):
+        # Create a FlappyBird with the hyperparameters of a checkpoint, and load it.
+        meta = load_checkpoint_meta(path)
+        fb = cls(meta['max_gens'], gamma=meta['gamma'], learning_rate=meta['learning_rate'],
+                 random_factor=meta['random_factor'], headless=headless, metrics=metrics,
+                 dx_bins=Discretizer(meta['dx_edges'], meta['dx_table_range']),
+                 dy_bins=Discretizer(meta['dy_edges'], meta['dy_table_range']),
+                 course=Course(**meta['course']) if meta['course'] is not None else None)
+        fb.load(path, mmap_mode)
+        return fb
+
+    def draw_train(self, font):
+        self.screen.fill((255, 255, 255))
+        self.screen.blit(self.background, (0, 0))
+        self.screen.blit(self.wallUp,
+                         (self.wallx, 360 + self.gap - self.offset))
+        self.screen.blit(self.wallDown,
+                         (self.wallx, 0 - self.gap - self.offset))
+        self.screen.blit(font.render(str(self.counter),
+                                     -1,
+                                     (255, 255, 255)),
+                         (200, 50))
+        if self.dead:
+            self.sprite = 2
+        elif self.jump:
+            self.sprite = 1
+        self.screen.blit(self.birdSprites[self.sprite], (self.birdX, self.birdY))
+        if not self.dead:
+            self.sprite = 0
 
     def bird_wall_dist(self):
         return self.wallx - self.birdX - 44
@@ -224,21 +527,26 @@ class FlappyBird:
         gap_center = 0 - self.gap / 2 + 500 - self.offset
         return gap_center - self.birdY
 
+    def velocity(self):
+        # How far the bird moves down in the next tick, negative while it jumps.
+        return 1 - self.jumpSpeed if self.jump else self.gravity
+
     def dx_to_index(self, dx):
-        xmin = -193.9  # When the wall is drawn at -80, the bird is at 70, bird is 44 wide
-        return int(dx - xmin) // 20
+        return self.dx_bins.index(dx)
 
     def dy_to_index(self, dy):
-        ymin = -264.9
-        return int(dy - ymin) // 20
+        return self.dy_bins.index(dy)
+
+    def course_offset(self):
+        # The offset of the wall the bird is flying towards.
+        return self.course.gap(self.counter) if self.course is not None else 0
 
     def updateWalls(self):
         self.wallx -= 2
         if self.wallx < -80:
             self.wallx = 400
             self.counter += 1
-            # self.offset = random.randint(-110, 110)
-            self.offset = 0
+            self.offset = self.course_offset()
 
     def birdUpdate(self):
         if self.jump:
@@ -248,84 +556,153 @@ class FlappyBird:
         else:
             self.birdY += self.gravity
             self.gravity += 0.2
-        self.bird[1] = self.birdY
-        upRect = pygame.Rect(self.wallx,
-                             370 + self.gap - self.offset + 10,
-                             self.wallUp.get_width() - 10,
-                             self.wallUp.get_height())
-        downRect = pygame.Rect(self.wallx,
-                               0 - self.gap - self.offset - 10,
-                               self.wallDown.get_width() - 10,
-                               self.wallDown.get_height())
-        if upRect.colliderect(self.bird):
+        self.bird[1] = int(self.birdY)
+        upRect = (self.wallx,
+                  370 + self.gap - self.offset + 10,
+                  WALL_UP_SIZE[0] - 10,
+                  WALL_UP_SIZE[1])
+        downRect = (self.wallx,
+                    0 - self.gap - self.offset - 10,
+                    WALL_DOWN_SIZE[0] - 10,
+                    WALL_DOWN_SIZE[1])
+        if rects_collide(upRect, self.bird):
             self.dead = True
-        if downRect.colliderect(self.bird):
+        if rects_collide(downRect, self.bird):
             self.dead = True
         if not 0 < self.bird[1] < 720:
-            self.bird[1] = 50
-            self.birdY = 50
-            self.dead = False
-            self.counter = 0
-            self.wallx = 400
-            # self.offset = random.randint(-110, 110)
-            self.offset = 0
-            self.gravity = 5
+            # The bird left the screen, which ends the generation.
+            self.end_generation()
+
+    def end_generation(self):
+        # Record the score and norm diff of the generation and start the next one with a new bird.
+        if self.gen_counter < self.max_gens:
+            self.performance_array[self.gen_counter] = self.counter
+            self.norm_diff_array[self.gen_counter] = self.norm_diff
+        self.gen_counter += 1
+        self.metrics.episode(generation=self.gen_counter, score=self.counter, steps=self.step_counter,
+                             norm_diff=self.norm_diff, max_delta=self.tracker.max_delta)
+        self.tracker.end_episode(self.norm_diff)
+        if self.pending_transition is not None:
+            # The bird left the screen alive, which is punished like hitting a wall, so flying off the screen is not
+            # learned as a way out.
+            self.punish_death()
+        self.bird[1] = 50
+        self.birdY = 50
+        self.dead = False
+        self.counter = 0
+        self.wallx = 400
+        self.offset = self.course_offset()
+        self.gravity = 5
 
-            # print(self.Q)
+    def predict_birdY(self, ticks):
+        # The height of the bird after each of the next ticks ticks if it does not jump, without simulating them.
+        return trajectory(self.birdY, self.jump, self.jumpSpeed, self.gravity, ticks)
+
+    def skip(self, max_ticks):
+        # Run up to max_ticks ticks without input at once. Stops before the first tick in which the bird would hit a
+        # wall or leave the screen, or the wall would wrap around, so those are still handled by birdUpdate and
+        # updateWalls. The bird positions are added up from a table of per tick displacements in one vectorized
+        # call, and are exactly the ones of stepping tick by tick. Returns the number of ticks skipped.
+        if self.dead or max_ticks <= 0:
+            return 0
+        heights, _ = simulate(self.birdY, self.jump, self.jumpSpeed, self.gravity, max_ticks)
+        birdY = heights.astype(int)
+        wallx = self.wallx - 2 * np.arange(1, max_ticks + 1)
+
+        up_y = int(370 + self.gap - self.offset + 10)
+        down_y = int(0 - self.gap - self.offset - 10)
+        bird_x, bird_width, bird_height = self.bird[0], self.bird[2], self.bird[3]
+        overlap_x_up = (bird_x < wallx + WALL_UP_SIZE[0] - 10) & (wallx < bird_x + bird_width)
+        overlap_x_down = (bird_x < wallx + WALL_DOWN_SIZE[0] - 10) & (wallx < bird_x + bird_width)
+        hit_up = overlap_x_up & (birdY < up_y + WALL_UP_SIZE[1]) & (up_y < birdY + bird_height)
+        hit_down = overlap_x_down & (birdY < down_y + WALL_DOWN_SIZE[1]) & (down_y < birdY + bird_height)
+        stop = hit_up | hit_down | (birdY <= 0) | (birdY >= 720) | (wallx < -80)
+
+        ticks = int(np.argmax(stop)) if stop.any() else max_ticks
+        if ticks:
+            self.birdY, self.jump, self.jumpSpeed, self.gravity = [
+                v.item() for v in simulate(self.birdY, self.jump, self.jumpSpeed, self.gravity, ticks)[1]]
+            self.bird[1] = int(self.birdY)
+            self.wallx -= 2 * ticks
+        return ticks
 
     def state_monitor(self):
         gap_center = 0 - self.gap / 2 + 500 - self.offset
         return [gap_center, self.delta_y(), self.birdY + 15, self.bird_wall_dist()]
 
-    def run(self):
+    def run(self, frame_rate=60, tick_rate=60, speed=1.0, autopilot=None):
+        # Play the game. The physics run at tick_rate ticks per second of game time, speed times faster than real
+        # time, while frames are drawn at most frame_rate times per second. The drawing is interpolated between the
+        # last two ticks, so slow drawing never changes the physics. With an autopilot (autopilot.Autopilot) it
+        # decides every tick whether to jump, in at most half of the time of the frame split over its ticks.
         clock = pygame.time.Clock()
         pygame.font.init()
         font = pygame.font.SysFont("Arial", 50)
+
+        # Only the walls, the score, the bird and the dots are redrawn, and the score is rendered once per value.
+        renderer = DirtyRenderer(self.screen, self.background)
+        score_text = TextCache(font, (255, 255, 255))
+
+        timestep = FixedTimestep(tick_rate, speed)
+        previous_wallx, previous_birdY = self.wallx, self.birdY
+        # Whether the bird jumped since the last tick, for the recorder.
+        flapped = False
         while True:
-            clock.tick(60)
+            clock.tick(frame_rate)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     sys.exit()
                 if (event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN) and not self.dead:
-                    self.jump = 15
-                    self.gravity = 5
-                    self.jumpSpeed = 10
-
-            self.screen.fill((255, 255, 255))
-            self.screen.blit(self.background, (0, 0))
-            self.screen.blit(self.wallDown,
-                             (self.wallx, 0 - self.gap - self.offset))
-            self.screen.blit(self.wallUp,
-                             (self.wallx, 370 + self.gap - self.offset))
-            self.screen.blit(font.render(str(self.counter),
-                                         -1,
-                                         (255, 255, 255)),
-                             (200, 50))
+                    self.flap()
+                    flapped = True
+
+            ticks = timestep.advance()
+            for _ in range(ticks):
+                if autopilot is not None and not self.dead and autopilot.act(self, 0.5 / frame_rate / ticks):
+                    self.flap()
+                    flapped = True
+                if self.recorder is not None:
+                    self.record_tick(FLAP if flapped else NO_ACTION if self.dead else 0)
+                flapped = False
+                previous_wallx, previous_birdY = self.wallx, self.birdY
+                self.updateWalls()
+                self.birdUpdate()
+
+                if not self.dead and self.metrics.enabled():
+                    self.metrics.step(state=self.state_monitor())
+
+            # A wall wrapping around or the bird being reset is not interpolated.
+            wallx = interpolate(previous_wallx, self.wallx, timestep.alpha, max_jump=100)
+            birdY = interpolate(previous_birdY, self.birdY, timestep.alpha, max_jump=100)
+
+            renderer.draw('wallDown', self.wallDown,
+                          (wallx, 0 - self.gap - self.offset))
+            renderer.draw('wallUp', self.wallUp,
+                          (wallx, 370 + self.gap - self.offset))
+            renderer.draw('score', score_text.render(self.counter), (200, 50))
             if self.dead:
                 self.sprite = 2
             elif self.jump:
                 self.sprite = 1
-            self.screen.blit(self.birdSprites[self.sprite], (self.birdX, self.birdY))
+            renderer.draw('bird', self.birdSprites[self.sprite], (self.birdX, birdY))
             if not self.dead:
                 self.sprite = 0
-            self.updateWalls()
-            self.birdUpdate()
-
-            if not self.dead:
-                print(self.state_monitor())
 
             # Draw center of gap
-            self.screen.blit(self.centerdot, (self.wallx,
-                                              0 - self.gap / 2 + 500 - self.offset))
+            renderer.draw('gap center', self.centerdot, (wallx,
+                                                         0 - self.gap / 2 + 500 - self.offset))
             # Draw birdY
-            self.screen.blit(self.centerdot, (self.wallx,
-                                              self.birdY))
+            renderer.draw('birdY', self.centerdot, (wallx,
+                                                    birdY))
 
-            pygame.display.update()
+            renderer.update()
 
 
 if __name__ == "__main__":
-    fb = FlappyBird(max_gens=10)
+    fb = FlappyBird(max_gens=10, headless="--headless" in sys.argv, metrics=MetricsSink(echo=True),
+                    profiler=PhaseProfiler(enabled="--profile" in sys.argv))
 
     # fb.run()
     fb.train_run()
+    if fb.profiler.enabled:
+        print(fb.profiler.report())
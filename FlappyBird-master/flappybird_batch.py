@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+import numpy as np
+
+from flappybird import Y_CHANGE_FROM_ACTION, WALL_UP_SIZE, WALL_DOWN_SIZE, DX_BINS, DY_BINS
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from q_table import QTable  # noqa: E402
+
+BIRD_X = 65
+BIRD_SIZE = 50
+
+
+class FlappyBirdBatch:
+    """
+    Headless simulation of many flappy birds at once. Every bird has its own wall, and the state of all birds is
+    kept in NumPy arrays of length num_birds, so a single call to step advances all of them. The physics are the
+    same as in FlappyBird.train_step, FlappyBird.updateWalls and FlappyBird.birdUpdate, and every bird flies the
+    walls of the same course, starting again at its first wall after leaving the screen.
+
+    :param num_birds:   The number of birds to simulate.
+    :param course:      The Course with the gap of every wall. None keeps every gap in the middle.
+    """
+
+    def __init__(self, num_birds, course=None):
+        self.num_birds = num_birds
+        self.course = course
+        self.gap = 130
+        self.birdX = 70
+
+        self.birdY = np.full(num_birds, 350.0)
+        self.jump = np.zeros(num_birds, dtype=int)
+        self.jumpSpeed = np.full(num_birds, 10)
+        self.gravity = np.full(num_birds, 5.0)
+        self.wallx = np.full(num_birds, 400)
+        self.dead = np.zeros(num_birds, dtype=bool)
+        self.counter = np.zeros(num_birds, dtype=int)
+        self.offset = self.course_offsets(self.counter)
+
+        # Number of finished generations, summed over all birds, and the scores of the birds reset in the last tick.
+        self.gen_counter = 0
+        self.scores = np.zeros(0, dtype=int)
+
+    def course_offsets(self, counters):
+        # The offsets of the walls the birds with these scores are flying towards, as in FlappyBird.course_offset.
+        if self.course is None:
+            return np.zeros(len(counters), dtype=int)
+        return np.array([self.course.gap(counter) for counter in counters.tolist()], dtype=int)
+
+    def bird_wall_dist(self):
+        return self.wallx - self.birdX - 44
+
+    def delta_y(self):
+        gap_center = 0 - self.gap / 2 + 500 - self.offset
+        return gap_center - self.birdY
+
+    def state_indices(self, dy_bins=DY_BINS, dx_bins=DX_BINS):
+        # The (dy, dx) indices of the Q matrix for every bird, as in FlappyBird.dy_to_index and dx_to_index.
+        return dy_bins.indices(self.delta_y()), dx_bins.indices(self.bird_wall_dist())
+
+    def step(self, actions):
+        # Advance all birds one tick. actions holds 1 (jump) or 0 (do nothing) for every bird; dead birds ignore it.
+        # Returns a boolean array which is True for the birds that left the screen and were reset this tick.
+        jumping = (np.asarray(actions) == 1) & ~self.dead
+        self.birdY[jumping] += Y_CHANGE_FROM_ACTION[1]
+        self.jump[jumping] = 17
+        self.gravity[jumping] = 5
+        self.jumpSpeed[jumping] = 10
+
+        self.update_walls()
+        return self.update_birds()
+
+    def update_walls(self):
+        self.wallx -= 2
+        wrapped = self.wallx < -80
+        self.wallx[wrapped] = 400
+        self.counter[wrapped] += 1
+        self.offset[wrapped] = self.course_offsets(self.counter[wrapped])
+
+    def update_birds(self):
+        rising = self.jump > 0
+        self.jumpSpeed[rising] -= 1
+        self.birdY = np.where(rising, self.birdY - self.jumpSpeed, self.birdY + self.gravity)
+        self.gravity[~rising] += 0.2
+        self.jump[rising] -= 1
+
+        # Integer rectangle collision of the bird against wallUp and wallDown, like pygame.Rect.colliderect.
+        bird_top = np.trunc(self.birdY).astype(int)
+        bird_bottom = bird_top + BIRD_SIZE
+        in_wall_columns_up = (self.wallx < BIRD_X + BIRD_SIZE) & (BIRD_X < self.wallx + WALL_UP_SIZE[0] - 10)
+        in_wall_columns_down = (self.wallx < BIRD_X + BIRD_SIZE) & (BIRD_X < self.wallx + WALL_DOWN_SIZE[0] - 10)
+        up_top = 370 + self.gap - self.offset + 10
+        down_top = 0 - self.gap - self.offset - 10
+        hit_up = in_wall_columns_up & (bird_top < up_top + WALL_UP_SIZE[1]) & (up_top < bird_bottom)
+        hit_down = in_wall_columns_down & (bird_top < down_top + WALL_DOWN_SIZE[1]) & (down_top < bird_bottom)
+        self.dead |= hit_up | hit_down
+
+        # Reset the birds that left the screen.
+        done = ~((0 < bird_top) & (bird_top < 720))
+        self.scores = self.counter[done]
+        self.birdY[done] = 50
+        self.dead[done] = False
+        self.counter[done] = 0
+        self.wallx[done] = 400
+        self.offset[done] = self.course_offsets(self.counter[done])
+        self.gravity[done] = 5
+        self.gen_counter += int(np.count_nonzero(done))
+
+        return done
+
+    def train_run(self, fb, ticks=None):
+        # Train the Q matrix of the FlappyBird fb with all birds for the given number of ticks, using the same
+        # gamma, learning rate, random factor and course. Every tick the transitions of all living birds are applied
+        # in one batched update. Hitting a wall or leaving the screen gives a reward of -100 and ends the episode.
+        # Every bird that leaves the screen finishes a generation of fb, recorded like in FlappyBird.end_generation,
+        # and training stops once fb has max_gens generations, has converged or ticks ticks have passed.
+        q_table = QTable(fb.q_storage, fb.gamma, fb.learning_rate, rng=fb.rng, state_shape=fb.R.shape[1:])
+        if self.course is not fb.course:
+            self.course = fb.course
+            self.offset = self.course_offsets(self.counter)
+
+        tick = 0
+        while fb.gen_counter < fb.max_gens and not fb.tracker.converged and (ticks is None or tick < ticks):
+            tick += 1
+            alive = ~self.dead
+            y_index, x_index = self.state_indices(fb.dy_bins, fb.dx_bins)
+            states = q_table.state_index(y_index, x_index)
+            actions = q_table.select_actions(states, fb.random_factor)
+
+            # As in FlappyBird.train_step, the reward is the one of the state the action moves the bird to.
+            moved_y_index = fb.dy_bins.indices(self.delta_y() - np.where(actions == 1, Y_CHANGE_FROM_ACTION[1], 0))
+            rewards = fb.R[actions, moved_y_index, x_index]
+
+            done = self.step(actions)
+            died = self.dead & alive
+            next_states = self.flat_states(fb, q_table)
+
+            # Hitting a wall and leaving the screen are punished alike.
+            rewards = np.where(died | done, -100, rewards)
+            fb.tracker.change(*q_table.update(states[alive], actions[alive], rewards[alive], next_states[alive],
+                                              dones=(died | done)[alive]))
+            fb.norm_diff = fb.tracker.step()
+            fb.step_counter += int(np.count_nonzero(alive))
+
+            for score in self.scores[:fb.max_gens - fb.gen_counter].tolist():
+                fb.performance_array[fb.gen_counter] = score
+                fb.norm_diff_array[fb.gen_counter] = fb.norm_diff
+                fb.gen_counter += 1
+                fb.metrics.episode(generation=fb.gen_counter, score=score, steps=fb.step_counter,
+                                   norm_diff=fb.norm_diff, max_delta=fb.tracker.max_delta)
+                fb.tracker.end_episode(fb.norm_diff)
+
+    def flat_states(self, fb, q_table):
+        # Flat Q matrix states of all birds, on the state grid of the FlappyBird fb.
+        return q_table.state_index(*self.state_indices(fb.dy_bins, fb.dx_bins))
@@ -0,0 +1,281 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from envs import GridMoveEnv, FlappyBirdEnv
+from q_table import QTable
+from q_storage import DenseQ
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'grid_move'))
+sys.path.append(os.path.join(ROOT, 'FlappyBird-master'))
+
+GAMES = ('grid_move', 'flappybird')
+
+# The arrays of a transition queue, in the order they are laid out in shared memory.
+TRANSITION_FIELDS = (('states', np.int64), ('actions', np.int64), ('rewards', np.float64), ('next_states', np.int64),
+                     ('dones', np.bool_))
+
+
+class TransitionQueue:
+    """
+    Queue of transitions from one producer process to one consumer process, in shared memory. The transitions are
+    kept in a ring of preallocated arrays, and the producer and consumer each own one counter: the producer only
+    advances the head after the transitions are written, and the consumer only advances the tail after they are
+    read, so no lock is needed.
+
+    :param capacity:    The number of transitions the queue holds.
+    :param name:        The name of an existing queue to attach to, or None to create a new one.
+    """
+
+    def __init__(self, capacity, name=None):
+        self.capacity = capacity
+        size = 16 + capacity * sum(np.dtype(dtype).itemsize for _, dtype in TRANSITION_FIELDS)
+        self.shm = SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+
+        # Number of transitions ever put and ever taken.
+        self.counters = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        if name is None:
+            self.counters[:] = 0
+        self.arrays = []
+        offset = 16
+        for _, dtype in TRANSITION_FIELDS:
+            self.arrays.append(np.ndarray(capacity, dtype=dtype, buffer=self.shm.buf, offset=offset))
+            offset += capacity * np.dtype(dtype).itemsize
+
+    def __len__(self):
+        return int(self.counters[0] - self.counters[1])
+
+    def put(self, *columns, count=None):
+        # Append the first count transitions of the columns (states, actions, rewards, next_states, dones), as far
+        # as there is room. Returns the number of transitions appended.
+        head, tail = int(self.counters[0]), int(self.counters[1])
+        count = min(len(columns[0]) if count is None else count, self.capacity - (head - tail))
+        index = (head + np.arange(count)) % self.capacity
+        for array, column in zip(self.arrays, columns):
+            array[index] = column[:count]
+        self.counters[0] = head + count
+        return count
+
+    def get(self):
+        # Take all waiting transitions. Returns the columns (states, actions, rewards, next_states, dones).
+        head, tail = int(self.counters[0]), int(self.counters[1])
+        index = (tail + np.arange(head - tail)) % self.capacity
+        columns = [array[index] for array in self.arrays]
+        self.counters[1] = head
+        return columns
+
+    def close(self, unlink=False):
+        self.counters = self.arrays = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SharedQ:
+    """
+    A Q matrix published by one process and read by others through shared memory. A version number is made odd
+    while the matrix is written and even again afterwards, so readers can tell if their copy is complete.
+
+    :param shape:   The shape of the Q matrix.
+    :param dtype:   The dtype of the Q matrix.
+    :param name:    The name of an existing shared Q matrix to attach to, or None to create a new one.
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        size = 8 + int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.shm = SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.version = np.ndarray(1, dtype=np.int64, buffer=self.shm.buf)
+        self.Q = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=8)
+        # Readers copy into this first, so a copy torn by a concurrent publish never reaches their matrix.
+        self.scratch = np.empty(shape, dtype=dtype)
+        if name is None:
+            self.version[0] = 0
+
+    def publish(self, Q):
+        self.version[0] += 1
+        self.Q[...] = Q
+        self.version[0] += 1
+
+    def read(self, out, last_version):
+        # Copy the matrix into out if a newer complete version than last_version was published. Returns the version
+        # of out, which is left untouched if the version changed while copying.
+        version = int(self.version[0])
+        if version == last_version or version % 2:
+            return last_version
+        self.scratch[...] = self.Q
+        if int(self.version[0]) != version:
+            return last_version
+        out[...] = self.scratch
+        return version
+
+    def close(self, unlink=False):
+        self.version = self.Q = self.scratch = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def game_config(learner):
+    # The game name and the constructor arguments of a headless copy of the learner, for the actors.
+    if hasattr(learner, 'goal_mask'):
+        return 'grid_move', dict(obstacle_states=learner.obstacle_states, goal_state=learner.goal_state, max_gens=1,
+                                 gamma=learner.gamma, learning_rate=learner.learning_rate,
+                                 random_factor=learner.random_factor, rows=learner.rows, columns=learner.columns)
+    return 'flappybird', dict(max_gens=1, dx_bins=learner.dx_bins, dy_bins=learner.dy_bins, course=learner.course)
+
+
+def make_env(game, config, seed):
+    if game == 'grid_move':
+        from grid_move import GridMove
+        return GridMoveEnv(GridMove(headless=True, rng=seed, **config), max_steps=1000)
+    from flappybird import FlappyBird
+    return FlappyBirdEnv(FlappyBird(headless=True, rng=seed, **config), max_steps=100000)
+
+
+def run_actor(game, config, seed, queue_name, queue_capacity, q_name, q_shape, q_dtype, action_axis, epsilon,
+              chunk_size, stop, episodes):
+    # Play the game with an epsilon greedy policy on the latest published Q matrix and stream the transitions to
+    # the learner in chunks of chunk_size. Runs until stop is set.
+    env = make_env(game, config, seed)
+    rng = np.random.default_rng(seed)
+    queue = TransitionQueue(queue_capacity, queue_name)
+    shared_Q = SharedQ(q_shape, q_dtype, q_name)
+
+    # Local copy of Q, and a view of it with a row of action values per flat state.
+    Q = np.zeros(q_shape, dtype=q_dtype)
+    values = np.moveaxis(Q, action_axis, -1).reshape(-1, Q.shape[action_axis])
+    version = -1
+
+    chunk = [np.zeros(chunk_size, dtype=dtype) for _, dtype in TRANSITION_FIELDS]
+    count = 0
+    observation = env.reset()
+    while not stop.value:
+        version = shared_Q.read(Q, version)
+        for _ in range(chunk_size):
+            action_values = values[observation]
+            if rng.random() < epsilon:
+                action = int(rng.integers(0, len(action_values)))
+            else:
+                action = int(rng.choice(np.flatnonzero(action_values == action_values.max())))
+            next_observation, reward, done = env.step(action)
+            for column, value in zip(chunk, (observation, action, reward, next_observation, done)):
+                column[count] = value
+            count += 1
+            observation = next_observation
+            if done:
+                observation = env.reset()
+                episodes.value += 1
+
+        # Wait for room in the queue rather than dropping transitions.
+        sent = 0
+        while sent < count and not stop.value:
+            sent += queue.put(*[column[sent:] for column in chunk], count=count - sent)
+            if sent < count:
+                time.sleep(0.0005)
+        count = 0
+
+    queue.close()
+    shared_Q.close()
+
+
+def train_async(learner, num_actors=4, total_steps=1000000, epsilon=0.1, publish_every=10, chunk_size=256,
+                queue_capacity=65536, seed=0):
+    # Train the Q matrix of a headless GridMove or FlappyBird with num_actors actor processes that play their own
+    # copy of the game and one learner, this process, that applies all transitions the actors sent since the last
+    # update in one batched Bellman update, with the gamma and learning rate of the learner. Every publish_every
+    # updates the Q matrix is published to the actors. Stops after total_steps transitions.
+    # Returns the number of transitions, updates and episodes, and the wall time.
+    if not isinstance(learner.q_storage, DenseQ):
+        raise ValueError('The actors read a dense Q matrix, so the learner needs a DenseQ, not a {}'.format(
+            type(learner.q_storage).__name__))
+    game, config = game_config(learner)
+    action_axis = -1 if game == 'grid_move' else 0
+    q_table = QTable(learner.q_storage, learner.gamma, learner.learning_rate, rng=learner.rng)
+
+    shared_Q = SharedQ(learner.Q.shape, learner.Q.dtype)
+    shared_Q.publish(learner.Q)
+    queues = [TransitionQueue(queue_capacity) for _ in range(num_actors)]
+    stop = multiprocessing.Value('b', 0, lock=False)
+    episodes = [multiprocessing.Value('q', 0, lock=False) for _ in range(num_actors)]
+
+    actors = [multiprocessing.Process(target=run_actor, daemon=True,
+                                      args=(game, config, seed + i, queues[i].name, queue_capacity, shared_Q.name,
+                                            learner.Q.shape, learner.Q.dtype, action_axis, epsilon, chunk_size, stop,
+                                            episodes[i]))
+              for i in range(num_actors)]
+
+    start = time.perf_counter()
+    for actor in actors:
+        actor.start()
+
+    transitions = updates = 0
+    try:
+        while transitions < total_steps:
+            batches = [queue.get() for queue in queues if len(queue)]
+            if not batches:
+                time.sleep(0.0005)
+                continue
+            states, actions, rewards, next_states, dones = [np.concatenate(columns) for columns in zip(*batches)]
+
+            learner.tracker.change(*q_table.update(states, actions, rewards, next_states, dones))
+            learner.norm_diff = learner.tracker.step()
+            learner.step_counter += len(states)
+            transitions += len(states)
+            updates += 1
+
+            if updates % publish_every == 0:
+                shared_Q.publish(learner.Q)
+    finally:
+        stop.value = 1
+        for actor in actors:
+            actor.join()
+        for queue in queues:
+            queue.close(unlink=True)
+        shared_Q.close(unlink=True)
+
+    return dict(transitions=transitions, updates=updates, episodes=sum(value.value for value in episodes),
+                wall_time=time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a headless learner with parallel actor processes and one '
+                                                 'batched learner.')
+    parser.add_argument('game', choices=GAMES)
+    parser.add_argument('--actors', type=int, nargs='+', default=[multiprocessing.cpu_count()],
+                        help='Numbers of actors to run with, one training run each.')
+    parser.add_argument('--steps', type=int, default=1000000)
+    parser.add_argument('--epsilon', type=float, default=0.1)
+    parser.add_argument('--publish-every', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='Save a checkpoint of the last run here.')
+    args = parser.parse_args()
+
+    print('{:>8}{:>12}{:>10}{:>10}{:>10}{:>16}'.format('actors', 'steps', 'updates', 'episodes', 'time (s)',
+                                                       'steps/sec'))
+    for num_actors in args.actors:
+        if args.game == 'grid_move':
+            from grid_move import GridMove
+            learner = GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=1, gamma=0.5, learning_rate=0.1,
+                               random_factor=args.epsilon, headless=True, rng=args.seed)
+        else:
+            from flappybird import FlappyBird
+            learner = FlappyBird(max_gens=1, random_factor=args.epsilon, headless=True, rng=args.seed)
+
+        result = train_async(learner, num_actors, args.steps, args.epsilon, args.publish_every, seed=args.seed)
+        print('{actors:>8}{transitions:>12}{updates:>10}{episodes:>10}{wall_time:>10.2f}{rate:>16.0f}'.format(
+            actors=num_actors, rate=result['transitions'] / result['wall_time'], **result))
+
+    if args.out is not None:
+        learner.save(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import hashlib
+
+import pygame
+
+# Width of a sprite atlas. Sprites are packed in rows, and the atlas grows downwards.
+ATLAS_WIDTH = 512
+
+# Process-wide caches. Images are keyed by a hash of the file contents, so the identical files the games ship in
+# their own folders are only loaded and converted once.
+_file_keys = {}
+_images = {}
+_atlases = {}
+
+
+def file_key(path):
+    if path not in _file_keys:
+        with open(path, 'rb') as f:
+            _file_keys[path] = hashlib.sha1(f.read()).hexdigest()
+    return _file_keys[path]
+
+
+def load_image(path, alpha=True):
+    # Load an image once and convert it to the display format, with per pixel alpha if alpha is True. A display mode
+    # has to be set first.
+    key = (file_key(path), alpha)
+    if key not in _images:
+        image = pygame.image.load(path)
+        _images[key] = image.convert_alpha() if alpha else image.convert()
+    return _images[key]
+
+
+def load_atlas(paths):
+    # Pack the images at paths into one atlas surface with per pixel alpha and return a subsurface of it for every
+    # image, in the same order. The same set of images always gives the same atlas.
+    key = tuple(file_key(path) for path in paths)
+    if key not in _atlases:
+        _atlases[key] = pack_atlas([pygame.image.load(path) for path in paths])
+    return _atlases[key]
+
+
+def pack_atlas(images):
+    # Shelf packing: place the images from tallest to shortest in rows of at most ATLAS_WIDTH pixels.
+    width = max([ATLAS_WIDTH] + [image.get_width() for image in images])
+    order = sorted(range(len(images)), key=lambda i: -images[i].get_height())
+
+    positions = [None] * len(images)
+    x = y = row_height = 0
+    for i in order:
+        image_width, image_height = images[i].get_size()
+        if x + image_width > width:
+            x, y, row_height = 0, y + row_height, 0
+        positions[i] = (x, y)
+        x += image_width
+        row_height = max(row_height, image_height)
+
+    atlas = pygame.Surface((width, y + row_height), pygame.SRCALPHA).convert_alpha()
+    atlas.fill((0, 0, 0, 0))
+    rects = []
+    for image, position in zip(images, positions):
+        # Adding onto the transparent atlas copies the pixels and their alpha exactly.
+        atlas.blit(image.convert_alpha(), position, special_flags=pygame.BLEND_RGBA_ADD)
+        rects.append(pygame.Rect(position, image.get_size()))
+
+    return [atlas.subsurface(rect) for rect in rects]
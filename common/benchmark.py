@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'grid_move'))
+sys.path.append(os.path.join(ROOT, 'FlappyBird-master'))
+from grid_move import GridMove  # noqa: E402
+from flappybird import FlappyBird  # noqa: E402
+from flappybird_batch import FlappyBirdBatch  # noqa: E402
+
+
+def grid_move_train_run(seed, max_gens):
+    gm = GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=max_gens, gamma=0.5, learning_rate=0.1,
+                  random_factor=0.1, headless=True, rng=seed)
+    gm.train_run()
+    return gm, int(gm.performance_array.sum()) + gm.step_counter
+
+
+def grid_move_train_batch_run(seed, max_gens):
+    gm = GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=max_gens, gamma=0.5, learning_rate=0.1,
+                  random_factor=0.1, headless=True, rng=seed)
+    gm.train_batch_run(batch_size=64)
+    return gm, int(gm.history_array.sum())
+
+
+def flappybird_train_run(seed, max_gens):
+    fb = FlappyBird(max_gens=max_gens, random_factor=0.1, headless=True, rng=seed)
+    fb.train_run()
+    return fb, fb.step_counter
+
+
+def flappybird_batch_train_run(seed, max_gens):
+    fb = FlappyBird(max_gens=max_gens, random_factor=0.1, headless=True, rng=seed)
+    FlappyBirdBatch(num_birds=256).train_run(fb)
+    return fb, fb.step_counter
+
+
+BENCHMARKS = {
+    'grid_move.train_run': grid_move_train_run,
+    'grid_move.train_batch_run': grid_move_train_batch_run,
+    'flappybird.train_run': flappybird_train_run,
+    'flappybird_batch.train_run': flappybird_batch_train_run,
+}
+
+
+def gens_to_convergence(norm_diff_array, tolerance, generations=None):
+    # The first generation after which the norm diff stays below tolerance, or None if training has not converged:
+    # the last recorded generation is still above tolerance, or no generation was recorded at all. Only the first
+    # generations rows of norm_diff_array are recorded, all of them if None; the rest are unused zeros.
+    norm_diffs = np.asarray(norm_diff_array).ravel()[:generations]
+    if len(norm_diffs) == 0:
+        return None
+    above = np.flatnonzero(norm_diffs >= tolerance)
+    if len(above) and above[-1] + 1 >= len(norm_diffs):
+        return None
+    return int(above[-1] + 1) if len(above) else 0
+
+
+def run_benchmark(name, seed, max_gens, repeat=3, tolerance=0.01):
+    # Run a benchmark repeat times with the same seed. Returns the median wall time and steps per second, the
+    # generations to convergence and whether all repeats gave the same Q matrix.
+    benchmark = BENCHMARKS[name]
+    wall_times = []
+    Qs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        learner, steps = benchmark(seed, max_gens)
+        wall_times.append(time.perf_counter() - start)
+        Qs.append(learner.Q)
+
+    wall_time = float(np.median(wall_times))
+    return dict(name=name, seed=seed, steps=steps, wall_time=wall_time, steps_per_sec=steps / wall_time,
+                gens_to_convergence=gens_to_convergence(learner.norm_diff_array, tolerance,
+                                                        min(learner.gen_counter, learner.max_gens)),
+                reproducible=all(np.array_equal(Qs[0], Q) for Q in Qs[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the headless training loops with fixed seeds.')
+    parser.add_argument('benchmarks', nargs='*', help='The benchmarks to run, all of them if none are given. '
+                                                      'One of: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--max-gens', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: ' + name)
+
+    print('{:<28}{:>6}{:>10}{:>10}{:>14}{:>8}{:>14}'.format('benchmark', 'seed', 'steps', 'time (s)', 'steps/sec',
+                                                           'conv', 'reproducible'))
+    for name in args.benchmarks or BENCHMARKS:
+        for seed in args.seeds:
+            result = run_benchmark(name, seed, args.max_gens, args.repeat, args.tolerance)
+            print('{name:<28}{seed:>6}{steps:>10}{wall_time:>10.3f}{steps_per_sec:>14.0f}{conv:>8}'
+                  '{reproducible!s:>14}'.format(conv=str(result['gens_to_convergence']), **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import numpy as np
+
+# Values a jump starts with, and how much gravity grows per tick while falling.
+JUMP_SPEED = 10
+JUMP_GRAVITY = 5
+GRAVITY_STEP = 0.2
+
+# The state of a bird is (y, jump, jump_speed, gravity): its height (growing downwards), the jump ticks left, the
+# speed the jump still has and the gravity pull of the next falling tick. Every tick with jump ticks left lowers
+# jump_speed by 1 and moves the bird up by the new jump_speed, and every other tick moves it down by gravity and
+# raises gravity by GRAVITY_STEP. This is FlappyBird.birdUpdate and update_bird of the khaume game.
+#
+# All functions take scalars or arrays of birds and do not know about collisions or resets. advance and
+# ticks_until_below work in closed form, in O(1) whatever the number of ticks, and match stepping the simulation up
+# to float rounding. simulate and trajectory build a table of the displacement of every tick and add it up in the
+# same order as the simulation, so their heights are exactly the ones of stepping tick by tick, also after
+# truncating them to pixels.
+
+
+def jump_state(y, jump_ticks):
+    # The state of a bird at y that starts a jump of jump_ticks ticks (17 in training, 15 when playing).
+    return y, jump_ticks, JUMP_SPEED, JUMP_GRAVITY
+
+
+def advance(y, jump, jump_speed, gravity, ticks):
+    # The state after the given number of ticks.
+    y, jump, jump_speed, gravity, ticks = np.broadcast_arrays(*[np.asarray(v) for v in
+                                                                (y, jump, jump_speed, gravity, ticks)])
+    # First the jump ticks, then the falling ticks.
+    j = np.minimum(ticks, jump)
+    m = ticks - j
+    y = y - (j * jump_speed - j * (j + 1) / 2) + (m * gravity + GRAVITY_STEP * m * (m - 1) / 2)
+    state = (y, jump - j, jump_speed - j, gravity + GRAVITY_STEP * m)
+    return tuple(v[()] for v in state)
+
+
+def simulate(y, jump, jump_speed, gravity, ticks):
+    # The height after 1, 2, ..., ticks ticks, shape (..., ticks) for arrays of birds, and the state after the last
+    # tick.
+    y, jump, jump_speed, gravity = np.broadcast_arrays(*[np.asarray(v) for v in (y, jump, jump_speed, gravity)])
+    t = np.arange(1, ticks + 1)
+
+    # Gravity after 0, 1, ..., ticks falling ticks, raised one step at a time like in the simulation.
+    steps = np.full(y.shape + (ticks + 1,), GRAVITY_STEP)
+    steps[..., 0] = gravity
+    gravities = np.add.accumulate(steps, axis=-1)
+
+    # Tick t moves the bird up by the jump speed left if it is a jump tick, and down by the gravity after the falling
+    # ticks before it otherwise.
+    falls_before = np.maximum(t - jump[..., None] - 1, 0)
+    displacement = np.where(t <= jump[..., None], -(jump_speed[..., None] - t),
+                            np.take_along_axis(gravities, falls_before, axis=-1))
+    heights = np.add.accumulate(np.concatenate([y[..., None].astype(np.float64), displacement], axis=-1),
+                                axis=-1)
+
+    j = np.minimum(ticks, jump)
+    falls = ticks - j
+    gravity = np.take_along_axis(gravities, falls[..., None], axis=-1)[..., 0]
+    state = (heights[..., -1], jump - j, jump_speed - j, gravity)
+    return heights[..., 1:], tuple(v[()] for v in state)
+
+
+def trajectory(y, jump, jump_speed, gravity, ticks):
+    # The height after 1, 2, ..., ticks ticks, shape (..., ticks) for arrays of birds.
+    return simulate(y, jump, jump_speed, gravity, ticks)[0]
+
+
+def ticks_until_below(y, jump, jump_speed, gravity, level):
+    # The first tick after which the bird is at level or lower on the screen (y >= level), e.g. to know when it
+    # hits the ground or the bottom wall if it does not jump again. The jump ticks are checked one by one, at most
+    # jump of them, and the falling part is solved as a quadratic.
+    # jump and jump_speed stay integers, as simulate indexes with them.
+    y, jump, jump_speed, gravity, level = np.broadcast_arrays(
+        np.asarray(y, dtype=np.float64), np.asarray(jump, dtype=np.int64), np.asarray(jump_speed, dtype=np.int64),
+        np.asarray(gravity, dtype=np.float64), np.asarray(level, dtype=np.float64))
+    result = np.full(y.shape, np.inf)
+    result[y >= level] = 0
+
+    # During the jump the bird moves by -(jump_speed - 1), -(jump_speed - 2), ..., which turns downwards once
+    # jump_speed is below 0.
+    max_jump = int(jump.max()) if jump.size else 0
+    if max_jump:
+        during_jump = trajectory(y, jump, jump_speed, gravity, max_jump)
+        in_jump = np.arange(1, max_jump + 1) <= jump[..., None]
+        reached = (during_jump >= level[..., None]) & in_jump
+        first = np.where(reached.any(axis=-1), reached.argmax(axis=-1) + 1, np.inf)
+        result = np.minimum(result, first)
+
+    # After the jump: y_end + m * gravity + GRAVITY_STEP * m * (m - 1) / 2 >= level, solved for the smallest m.
+    y_end = advance(y, jump, jump_speed, gravity, jump)[0]
+    a = GRAVITY_STEP / 2
+    b = gravity - GRAVITY_STEP / 2
+    c = y_end - level
+    with np.errstate(invalid='ignore'):
+        m = np.ceil((-b + np.sqrt(b * b - 4 * a * c)) / (2 * a))
+    m = np.where(c >= 0, 0, np.maximum(m, 1))
+    # Guard against rounding in the square root.
+    m = np.where((m > 1) & (advance(y_end, 0, 0, gravity, np.maximum(m - 1, 0))[0] >= level), m - 1, m)
+    m = np.where(advance(y_end, 0, 0, gravity, m)[0] < level, m + 1, m)
+    result = np.where(np.isinf(result), np.where(jump > 0, jump + np.maximum(m, 1), m), result)
+    return result[()]
@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy as np
+
+from metrics import to_builtin
+
+META_FILE = 'meta.json'
+
+
+def save_checkpoint(path, arrays, meta):
+    # Save a checkpoint as a directory with one .npy file per array and the other values in meta.json.
+    # Every save is a new generation: its arrays are written to files named after it, and meta.json, which names the
+    # generation, is replaced in one atomic step at the end. Only then are the files of the previous generation
+    # removed. A crash at any point leaves meta.json and all the arrays it names from the same save.
+    os.makedirs(path, exist_ok=True)
+    previous = load_checkpoint_meta(path) if os.path.exists(os.path.join(path, META_FILE)) else None
+    generation = previous.get('generation', 0) + 1 if previous is not None else 1
+
+    # Files of this generation left by a save that crashed before replacing meta.json are simply overwritten.
+    for name, array in arrays.items():
+        np.save(array_path(path, name, generation), np.ascontiguousarray(array))
+
+    meta = dict(meta, arrays=sorted(arrays), generation=generation)
+    temp_path = os.path.join(path, META_FILE + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(meta, f, default=to_builtin, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(path, META_FILE))
+
+    if previous is not None:
+        for name in previous['arrays']:
+            old_path = array_path(path, name, previous.get('generation'))
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+
+def array_path(path, name, generation):
+    # The file of an array of a checkpoint. Checkpoints saved before generations were added have none.
+    if generation is None:
+        return os.path.join(path, name + '.npy')
+    return os.path.join(path, '{}.{}.npy'.format(name, generation))
+
+
+def load_checkpoint_meta(path):
+    # Only the meta dict of a checkpoint, e.g. to create a learner with the right size before loading it.
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+
+def load_checkpoint(path, mmap_mode=None):
+    # Load a checkpoint saved by save_checkpoint. Returns a dict of arrays and the meta dict.
+    # With mmap_mode='r' the arrays are memory-mapped read-only: they open instantly whatever their size, and
+    # several processes loading the same checkpoint share one copy in the page cache. Use mmap_mode='c' for a
+    # private copy-on-write view that can be trained further.
+    # If another process saves a new generation between reading meta.json and the arrays, the arrays named by it are
+    # removed, and the new meta.json is read again.
+    while True:
+        meta = load_checkpoint_meta(path)
+        try:
+            arrays = {name: np.load(array_path(path, name, meta.get('generation')), mmap_mode=mmap_mode)
+                      for name in meta['arrays']}
+        except FileNotFoundError:
+            if load_checkpoint_meta(path).get('generation') == meta.get('generation'):
+                raise
+            continue
+        return arrays, meta
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class ConvergenceTracker:
+    """
+    Keeps track of the norm of a Q matrix while single entries change, without going over the whole matrix. The
+    squared norm is adjusted by new ** 2 - old ** 2 for every changed entry, so a step costs O(1) instead of O(|Q|).
+
+    Training can stop early when the norm diff at the end of an episode has stayed below stop_threshold for
+    stop_patience episodes in a row.
+
+    :param Q:               The Q matrix to track.
+    :param stop_threshold:  Norm diff below which an episode counts as converged. None never stops.
+    :param stop_patience:   Number of converged episodes in a row before training should stop.
+    """
+
+    def __init__(self, Q, stop_threshold=None, stop_patience=1):
+        self.stop_threshold = stop_threshold
+        self.stop_patience = stop_patience
+
+        self.squared_norm = 0.0
+        self.previous_norm = 0.0
+        self.current_norm = 0.0
+        self.norm_diff = 0.0
+        self.recompute(Q)
+
+        # Largest absolute change of a single entry since the last episode ended.
+        self.max_delta = 0.0
+        self.converged_episodes = 0
+
+    def recompute(self, Q):
+        # Compute the squared norm from scratch, e.g. after Q was replaced as a whole.
+        self.squared_norm = float(np.sum(np.square(Q, dtype=np.float64)))
+        self.current_norm = np.sqrt(self.squared_norm)
+
+    def change(self, old_value, new_value):
+        # Register that one entry, or an array of entries, changed from old_value to new_value.
+        if np.ndim(new_value) == 0:
+            old_value, new_value = float(old_value), float(new_value)
+            self.squared_norm += new_value * new_value - old_value * old_value
+            self.max_delta = max(self.max_delta, abs(new_value - old_value))
+            return
+
+        old_value = np.asarray(old_value, dtype=np.float64)
+        new_value = np.asarray(new_value, dtype=np.float64)
+        self.squared_norm += float(np.sum(new_value * new_value - old_value * old_value))
+        if old_value.size:
+            self.max_delta = max(self.max_delta, float(np.max(np.abs(new_value - old_value))))
+
+    def step(self):
+        # Update the previous and current norm values and return the norm diff of this step.
+        self.previous_norm = self.current_norm
+        self.current_norm = np.sqrt(max(self.squared_norm, 0.0))
+        self.norm_diff = abs(self.previous_norm - self.current_norm)
+        return self.norm_diff
+
+    def end_episode(self, norm_diff):
+        # Count the episode towards the stopping criterion and reset the max delta statistic.
+        if self.stop_threshold is not None and norm_diff < self.stop_threshold:
+            self.converged_episodes += 1
+        else:
+            self.converged_episodes = 0
+        self.max_delta = 0.0
+
+    @property
+    def converged(self):
+        return self.stop_threshold is not None and self.converged_episodes >= self.stop_patience
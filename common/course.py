@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class Course:
+    """
+    Infinite sequence of wall gap positions, generated lazily in chunks. Position i is an integer drawn uniformly
+    from [low, high]. Every chunk is generated from its own generator, seeded with (seed, chunk number), so any
+    position is found in O(1) without generating the ones before it, and a course with the same seed is always the
+    same, however it is traversed.
+
+    :param low:         The lowest gap position.
+    :param high:        The highest gap position.
+    :param seed:        Seed of the course, a number or a numpy Generator to draw one from. None picks a random one.
+    :param chunk_size:  The number of positions generated at once.
+    :param max_chunks:  The number of generated chunks kept in memory.
+    """
+
+    def __init__(self, low, high, seed=None, chunk_size=256, max_chunks=4):
+        self.low = low
+        self.high = high
+        if seed is None or isinstance(seed, np.random.Generator):
+            seed = int(np.random.default_rng(seed).integers(2 ** 63))
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.chunks = {}
+
+    def config(self):
+        # The arguments to create the same course again, e.g. for a checkpoint.
+        return dict(low=self.low, high=self.high, seed=self.seed, chunk_size=self.chunk_size)
+
+    def chunk(self, number):
+        if number not in self.chunks:
+            if len(self.chunks) >= self.max_chunks:
+                del self.chunks[next(iter(self.chunks))]
+            rng = np.random.default_rng([self.seed, number])
+            self.chunks[number] = rng.integers(self.low, self.high + 1, self.chunk_size).tolist()
+        return self.chunks[number]
+
+    def gap(self, i):
+        # The gap position of wall i.
+        return self.chunk(i // self.chunk_size)[i % self.chunk_size]
+
+    def gaps(self, start, stop):
+        # The gap positions of walls start up to stop.
+        return [self.gap(i) for i in range(start, stop)]
@@ -0,0 +1,76 @@
+import pygame
+
+
+class TextCache:
+    """
+    Renders text once per value and reuses the surface, e.g. for a score that changes only now and then.
+
+    :param font:    The pygame font to render with.
+    :param color:   The text color.
+    """
+
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.surfaces = {}
+
+    def render(self, value):
+        if value not in self.surfaces:
+            self.surfaces[value] = self.font.render(str(value), -1, self.color)
+        return self.surfaces[value]
+
+
+class DirtyRenderer:
+    """
+    Draws named sprites on top of a static background and only redraws and updates the parts of the screen that
+    changed since the last frame.
+
+    Every frame, call draw for each sprite in back to front order and then update. Sprites that kept their surface
+    and position are left alone unless they overlap a sprite that changed. For the changed ones the background is
+    restored where they were, they are blitted where they are now, and only those rectangles are passed to
+    pygame.display.update.
+
+    :param screen:      The display surface.
+    :param background:  The background surface, drawn at (0, 0).
+    """
+
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.background = background
+
+        # Name -> (surface, rect) of the sprites on the screen, and of the sprites drawn for the next frame.
+        self.shown = {}
+        self.queued = {}
+
+        self.screen.blit(self.background, (0, 0))
+        pygame.display.update()
+
+    def draw(self, name, surface, position):
+        self.queued[name] = (surface, surface.get_rect(topleft=(int(position[0]), int(position[1]))))
+
+    def update(self):
+        changed = {name for name in self.shown.keys() | self.queued.keys()
+                   if self.shown.get(name) != self.queued.get(name)}
+
+        # Sprites that did not change still need to be redrawn if a changed sprite overlaps them.
+        dirty = [sprite[1] for name in changed for sprite in (self.shown.get(name), self.queued.get(name)) if sprite]
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for name, (surface, rect) in self.queued.items():
+                if name not in changed and rect.collidelist(dirty) != -1:
+                    changed.add(name)
+                    dirty.append(rect)
+                    overlapping = True
+
+        for name in changed:
+            if name in self.shown:
+                rect = self.shown[name][1].clip(self.screen.get_rect())
+                self.screen.blit(self.background, rect, rect)
+        for name, (surface, rect) in self.queued.items():
+            if name in changed:
+                self.screen.blit(surface, rect)
+
+        pygame.display.update([rect.clip(self.screen.get_rect()) for rect in dirty])
+        self.shown = self.queued
+        self.queued = {}
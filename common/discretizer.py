@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class Discretizer:
+    """
+    Maps continuous values to bin indices, e.g. a distance to an index along one axis of a Q matrix. Bin i holds the
+    values from edges[i] up to edges[i + 1]. Values below the first edge go to bin 0 and values above the last edge
+    to the last bin, so an index is always valid for an axis of num_bins entries.
+
+    For integer values from table_range a lookup table is precomputed, so mapping them is a single list or array
+    access.
+
+    :param edges:       The increasing bin edges, one more than the number of bins.
+    :param table_range: (lowest, highest) integer value to precompute the indices for, or None for no table.
+    """
+
+    def __init__(self, edges, table_range=None):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        if self.edges.ndim != 1 or len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0):
+            raise ValueError('edges must be a strictly increasing sequence of at least two values')
+        self.num_bins = len(self.edges) - 1
+
+        # Equally spaced edges are mapped with one division instead of a search.
+        steps = np.diff(self.edges)
+        self.low = float(self.edges[0])
+        self.bin_size = float(steps[0]) if np.allclose(steps, steps[0]) else None
+
+        self.table_range = table_range
+        if table_range is not None:
+            self.table_low = table_range[0]
+            self.table_array = self.indices(np.arange(table_range[0], table_range[1] + 1, dtype=np.float64))
+            self.table = self.table_array.tolist()
+
+    @classmethod
+    def uniform(cls, low, bin_size, num_bins, table_range=None):
+        # num_bins bins of bin_size each, starting at low.
+        return cls(low + bin_size * np.arange(num_bins + 1), table_range)
+
+    def index(self, value):
+        # Bin index of a single value.
+        if self.table_range is not None and type(value) is int and \
+                self.table_range[0] <= value <= self.table_range[1]:
+            return self.table[value - self.table_low]
+        if self.bin_size is not None:
+            i = int((value - self.low) // self.bin_size)
+        else:
+            i = int(np.searchsorted(self.edges, value, side='right')) - 1
+        return min(max(i, 0), self.num_bins - 1)
+
+    def indices(self, values):
+        # Bin indices of an array of values, in one vectorized call.
+        values = np.asarray(values)
+        if self.table_range is not None and np.issubdtype(values.dtype, np.integer) and values.size and \
+                self.table_range[0] <= values.min() and values.max() <= self.table_range[1]:
+            return self.table_array[values - self.table_low]
+        if self.bin_size is not None:
+            i = np.floor_divide(values - self.low, self.bin_size).astype(np.int64)
+        else:
+            i = np.searchsorted(self.edges, values, side='right') - 1
+        return np.clip(i, 0, self.num_bins - 1)
@@ -0,0 +1,155 @@
+import numpy as np
+import pygame
+
+
+class GridMoveEnv:
+    """
+    Environment with reset and step over a GridMove game, for agents that bring their own learning loop.
+
+    Observations are the state numbers of the player, the same row indices as in GridMove.Q. A step moves the player
+    with GridMove.move and returns the reward of GridMove.R for the move. Reaching a goal or an obstacle ends the
+    episode, and the player stays there until reset is called.
+
+    :param game:        The GridMove to play in. It has to be created with headless=False to render.
+    :param render:      If True, the board is drawn after every step.
+    :param max_steps:   End an episode after this many steps. None never cuts episodes off.
+    """
+
+    def __init__(self, game, render=False, max_steps=None):
+        self.game = game
+        self.render = render
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def reset(self):
+        self.game.player_position = self.game.location_from_state(0)
+        self.steps = 0
+        if self.render:
+            self.draw()
+        return 0
+
+    def step(self, action):
+        state = self.game.state_from_position(self.game.player_position)
+        reward = float(self.game.R[state, action])
+        self.game.move(action)
+        self.steps += 1
+
+        state = self.game.state_from_position(self.game.player_position)
+        done = bool(self.game.goal_mask.flat[state] or self.game.obstacle_mask.flat[state])
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            done = True
+
+        if self.render:
+            self.draw()
+        return state, reward, done
+
+    def draw(self):
+        pygame.event.pump()
+        self.game.draw()
+
+
+class FlappyBirdEnv:
+    """
+    Environment with reset and step over a FlappyBird game, for agents that bring their own learning loop.
+
+    Observations are the flat state indices of the bird on the state grid of the game, so the Q values of the
+    actions for observation s are FlappyBird.Q[:, s // dx_bins.num_bins, s % dx_bins.num_bins]. Action 1 jumps and
+    action 0 does nothing. A step runs one tick of FlappyBird.updateWalls and FlappyBird.birdUpdate. Hitting a wall or
+    leaving the screen ends the episode with a reward of -100, and otherwise the reward is the one of FlappyBird.R for
+    the state the action moves the bird to, as in FlappyBird.train_step. Every episode is recorded by the game as a
+    generation.
+
+    With features=True the observations are instead arrays of the raw height above the gap center, distance to the
+    wall and velocity of the bird, for Q stores that work on continuous or finer states (see q_storage).
+
+    :param game:        The FlappyBird to play in. It has to be created with headless=False to render.
+    :param render:      If True, the game is drawn after every step.
+    :param max_steps:   End an episode after this many steps. None never cuts episodes off.
+    :param features:    If True, observe the raw state features instead of the flat state index.
+    """
+
+    def __init__(self, game, render=False, max_steps=None, features=False):
+        self.game = game
+        self.render = render
+        self.max_steps = max_steps
+        self.features = features
+        self.steps = 0
+        # Whether the game is in the middle of an episode, which reset has to end first.
+        self.running = False
+        if self.render:
+            pygame.font.init()
+            self.font = pygame.font.SysFont("Arial", 50)
+
+    def observation(self):
+        game = self.game
+        if self.features:
+            return np.array([game.delta_y(), game.bird_wall_dist(), game.velocity()], dtype=np.float64)
+        return game.state_index(game.dy_to_index(game.delta_y()), game.dx_to_index(game.bird_wall_dist()))
+
+    def reset(self):
+        # A bird that hit a wall or was cut off ends its generation here instead of when it leaves the screen.
+        if self.running:
+            self.game.end_generation()
+            self.running = False
+        self.steps = 0
+        if self.render:
+            self.draw()
+        return self.observation()
+
+    def step(self, action):
+        game = self.game
+        # As in FlappyBird.train_step, the reward is the one of the state the action moves the bird to.
+        x_index = game.dx_to_index(game.bird_wall_dist())
+        game.take_action(action)
+        reward = float(game.R[action, game.dy_to_index(game.delta_y()), x_index])
+
+        gen_counter = game.gen_counter
+        game.updateWalls()
+        game.birdUpdate()
+        game.step_counter += 1
+        self.steps += 1
+
+        # If the bird left the screen, the game already ended the generation and reset the bird. Leaving the screen
+        # is punished like hitting a wall.
+        self.running = game.gen_counter == gen_counter
+        done = game.dead or not self.running
+        if done:
+            reward = -100.0
+        elif self.max_steps is not None and self.steps >= self.max_steps:
+            done = True
+
+        if self.render:
+            self.draw()
+        return self.observation(), reward, done
+
+    def draw(self):
+        pygame.event.pump()
+        self.game.draw_train(self.font)
+        pygame.display.update()
+
+
+class VectorEnv:
+    """
+    Runs several environments side by side with one call. reset and step take and return arrays with one entry per
+    environment, and an environment whose episode ended is reset straight away, so the observation returned for it
+    is the first one of its next episode.
+
+    :param envs:    The environments, e.g. a FlappyBirdEnv for each of several headless games.
+    """
+
+    def __init__(self, envs):
+        self.envs = list(envs)
+        self.num_envs = len(self.envs)
+
+    def reset(self):
+        return np.array([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        # Observations are stacked like in reset, so flat state indices and feature arrays both work.
+        observations = []
+        rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, rewards[i], dones[i] = env.step(int(action))
+            observations.append(env.reset() if dones[i] else observation)
+        return np.array(observations), rewards, dones
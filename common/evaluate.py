@@ -0,0 +1,177 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from checkpoint import load_checkpoint_meta
+from envs import GridMoveEnv, FlappyBirdEnv
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'grid_move'))
+sys.path.append(os.path.join(ROOT, 'FlappyBird-master'))
+
+# Per episode results, in the order of the columns returned by run_episodes.
+FIELDS = ('seed', 'steps', 'score', 'died', 'goal', 'truncated')
+
+
+def checkpoint_game(path):
+    # The game a checkpoint was saved by. Only GridMove checkpoints have a board size.
+    return 'grid_move' if 'rows' in load_checkpoint_meta(path) else 'flappybird'
+
+
+def load_policy(path):
+    # Load a checkpoint headless with a read-only memory-mapped Q matrix, and wrap it in an environment. Returns the
+    # environment and a function from an observation to the Q values of its actions.
+    if checkpoint_game(path) == 'grid_move':
+        from grid_move import GridMove
+        game = GridMove.from_checkpoint(path, mmap_mode='r', headless=True)
+        Q = game.Q
+        return GridMoveEnv(game), lambda observation: Q[observation]
+
+    from flappybird import FlappyBird
+    game = FlappyBird.from_checkpoint(path, mmap_mode='r', headless=True)
+    Q = game.Q.reshape(game.Q.shape[0], -1)
+    # Start from a new bird instead of the one that was in flight when the checkpoint was saved.
+    game.end_generation()
+    return FlappyBirdEnv(game), lambda observation: Q[:, observation]
+
+
+def run_episodes(task):
+    # Roll out the greedy policy of one checkpoint for one episode per seed. The seed drives the tie-breaking between
+    # equal Q values and the random moves taken with probability epsilon, so every episode can be repeated exactly.
+    # Returns an array with a row per episode and the columns of FIELDS.
+    path, seeds, max_steps, epsilon = task
+    env, q_values = load_policy(path)
+    game = env.game
+
+    results = np.zeros((len(seeds), len(FIELDS)))
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        observation = env.reset()
+        steps = score = 0
+        done = False
+        while not done and steps < max_steps:
+            values = q_values(observation)
+            if rng.random() < epsilon:
+                action = int(rng.integers(0, len(values)))
+            else:
+                action = int(rng.choice(np.flatnonzero(values == values.max())))
+            observation, reward, done = env.step(action)
+            steps += 1
+            if isinstance(env, GridMoveEnv):
+                score += reward
+            else:
+                # The score is the number of pipes passed, which the game resets when the bird leaves the screen.
+                score = max(score, game.counter)
+
+        if isinstance(env, GridMoveEnv):
+            goal = bool(done and game.goal_mask.flat[observation])
+            died = bool(done and game.obstacle_mask.flat[observation])
+        else:
+            goal = False
+            died = done
+        results[i] = (seed, steps, score, died, goal, not done)
+    return results
+
+
+def evaluate(paths, seeds, max_steps=10000, epsilon=0.0, processes=None):
+    # Evaluate every checkpoint on the same seeds, with the episodes spread over a process pool. Returns a dict with
+    # the per episode columns of FIELDS for every path, and the wall time of the whole evaluation.
+    processes = processes or multiprocessing.cpu_count()
+    chunks = [chunk.tolist() for chunk in np.array_split(np.asarray(seeds), min(processes, len(seeds)))]
+    tasks = [(path, chunk, max_steps, epsilon) for path in paths for chunk in chunks]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(run_episodes, tasks)
+    wall_time = time.perf_counter() - start
+
+    episodes = {}
+    for i, path in enumerate(paths):
+        rows = np.concatenate(results[i * len(chunks):(i + 1) * len(chunks)])
+        episodes[path] = {name: rows[:, j] for j, name in enumerate(FIELDS)}
+    return episodes, wall_time
+
+
+def summarize(episodes):
+    # Score distribution, episode length percentiles and end of episode rates of one checkpoint.
+    steps = episodes['steps']
+    goal_steps = steps[episodes['goal'] == 1]
+    return dict(episodes=len(steps),
+                mean_score=float(np.mean(episodes['score'])),
+                std_score=float(np.std(episodes['score'])),
+                min_score=float(np.min(episodes['score'])),
+                max_score=float(np.max(episodes['score'])),
+                p50_steps=float(np.percentile(steps, 50)),
+                p99_steps=float(np.percentile(steps, 99)),
+                steps_to_goal=float(np.mean(goal_steps)) if len(goal_steps) else None,
+                death_rate=float(np.mean(episodes['died'])),
+                goal_rate=float(np.mean(episodes['goal'])),
+                truncated_rate=float(np.mean(episodes['truncated'])),
+                total_steps=int(np.sum(steps)))
+
+
+def win_rates(episodes):
+    # For every pair of checkpoints, the fraction of seeds on which the first scored higher than the second. Ties
+    # count as half a win.
+    paths = list(episodes)
+    rates = np.full((len(paths), len(paths)), np.nan)
+    for (i, a), (j, b) in itertools.permutations(enumerate(paths), 2):
+        rates[i, j] = np.mean((episodes[a]['score'] > episodes[b]['score']) +
+                              0.5 * (episodes[a]['score'] == episodes[b]['score']))
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the greedy policies of saved checkpoints over many seeded '
+                                                 'episodes in parallel, and compare them head to head.')
+    parser.add_argument('checkpoints', nargs='+')
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--max-steps', type=int, default=10000,
+                        help='Cut episodes off after this many steps.')
+    parser.add_argument('--epsilon', type=float, default=0.0,
+                        help='Probability of a random move instead of the greedy one.')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--out', default=None, help='Save the per episode results to this .npz file.')
+    args = parser.parse_args()
+    if len({checkpoint_game(path) for path in args.checkpoints}) > 1:
+        parser.error('all checkpoints must be of the same game')
+
+    seeds = range(args.first_seed, args.first_seed + args.episodes)
+    episodes, wall_time = evaluate(args.checkpoints, seeds, args.max_steps, args.epsilon, args.processes)
+
+    summaries = {path: summarize(episodes[path]) for path in args.checkpoints}
+    total_steps = sum(summary['total_steps'] for summary in summaries.values())
+    print('{:<30}{:>12}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('checkpoint', 'score', 'p50 len', 'p99 len',
+                                                                    'to goal', 'death', 'goal', 'cut off'))
+    for path in sorted(args.checkpoints, key=lambda path: -summaries[path]['mean_score']):
+        summary = summaries[path]
+        steps_to_goal = summary['steps_to_goal']
+        print('{path:<30}{score:>12}{p50_steps:>10.0f}{p99_steps:>10.0f}{to_goal:>10}{death_rate:>10.1%}'
+              '{goal_rate:>10.1%}{truncated_rate:>10.1%}'.format(
+                  path=path[-30:], score='{:.2f}±{:.2f}'.format(summary['mean_score'], summary['std_score']),
+                  to_goal='-' if steps_to_goal is None else '{:.1f}'.format(steps_to_goal), **summary))
+    print('{} episodes, {} steps in {:.2f}s: {:.0f} episodes/sec, {:.0f} steps/sec'.format(
+        len(seeds) * len(args.checkpoints), total_steps, wall_time,
+        len(seeds) * len(args.checkpoints) / wall_time, total_steps / wall_time))
+
+    if len(args.checkpoints) > 1:
+        print('\nWin rate of the row against the column, on the same seeds:')
+        rates = win_rates(episodes)
+        print(' ' * 30 + ''.join('{:>10}'.format(j) for j in range(len(args.checkpoints))))
+        for i, path in enumerate(args.checkpoints):
+            print('{:<26}{:>4}'.format(path[-26:], i) +
+                  ''.join('{:>10}'.format('-' if i == j else '{:.1%}'.format(rate)) for j, rate in enumerate(rates[i])))
+
+    if args.out is not None:
+        np.savez(args.out, checkpoint=np.repeat(args.checkpoints, len(seeds)),
+                 **{name: np.concatenate([episodes[path][name] for path in args.checkpoints]) for name in FIELDS})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import time
+
+
+class FixedTimestep:
+    """
+    Accumulator for running a simulation at a fixed tick rate, independent of how fast frames are drawn.
+
+    Call advance once per rendered frame. It adds the real time since the previous call, scaled by speed, to the
+    accumulator and returns the number of whole simulation ticks to run this frame. What is left in the accumulator
+    is available as alpha, the fraction of a tick between the last two simulated states, for interpolating the
+    drawing.
+
+    :param tick_rate:           Simulation ticks per second of game time.
+    :param speed:               How many times faster than real time the game runs.
+    :param max_ticks_per_frame: Upper limit on the ticks run in one frame. If the simulation can not keep up, the
+                                game slows down instead of falling further and further behind.
+    """
+
+    def __init__(self, tick_rate=60, speed=1.0, max_ticks_per_frame=100):
+        self.tick_duration = 1.0 / tick_rate
+        self.speed = speed
+        self.max_ticks_per_frame = max_ticks_per_frame
+
+        self.accumulator = 0.0
+        self.last_time = time.perf_counter()
+
+    def advance(self):
+        now = time.perf_counter()
+        self.accumulator += (now - self.last_time) * self.speed
+        self.last_time = now
+
+        ticks = int(self.accumulator / self.tick_duration)
+        if ticks > self.max_ticks_per_frame:
+            ticks = self.max_ticks_per_frame
+        self.accumulator = min(self.accumulator - ticks * self.tick_duration, self.tick_duration)
+        return ticks
+
+    @property
+    def alpha(self):
+        return self.accumulator / self.tick_duration
+
+
+def interpolate(previous, current, alpha, max_jump=None):
+    # Position between the previous and current tick. If the value jumped by more than max_jump, e.g. when a wall
+    # wraps around or the bird is reset, the current value is used as is.
+    if max_jump is not None and abs(current - previous) > max_jump:
+        return current
+    return previous + (current - previous) * alpha
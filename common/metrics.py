@@ -0,0 +1,75 @@
+import json
+from logging import DEBUG, INFO, WARNING  # noqa: F401
+
+import numpy as np
+
+
+def to_builtin(value):
+    # Make numpy values JSON serializable.
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+class MetricsSink:
+    """
+    Collects step and episode records from the training loops in memory and writes them to a JSON lines file in one
+    go at the end of every episode, so no I/O happens inside a step.
+
+    Records below level are dropped straight away, and of the step records only every sample_every-th one is kept.
+    Levels are the ones from the logging module (DEBUG, INFO, WARNING, ...). Step records default to DEBUG and
+    episode records to INFO.
+
+    :param path:            The file the records are appended to. None drops all records.
+    :param level:           The lowest level of records to keep.
+    :param sample_every:    Keep every n-th step record.
+    :param echo:            Also print episode records to stdout.
+    :param buffer_size:     Flush before an episode ends if this many records are waiting.
+    """
+
+    def __init__(self, path=None, level=INFO, sample_every=1, echo=False, buffer_size=100000):
+        self.path = path
+        self.level = level
+        self.sample_every = sample_every
+        self.echo = echo
+        self.buffer_size = buffer_size
+
+        self.records = []
+        self.step_count = 0
+
+    def enabled(self, level=DEBUG):
+        # Whether step records of this level are kept, to skip collecting their fields in hot loops.
+        return self.path is not None and level >= self.level
+
+    def step(self, level=DEBUG, **fields):
+        # Record a step. Cheap to call when the level is filtered out.
+        if level < self.level or self.path is None:
+            return
+        self.step_count += 1
+        if self.step_count % self.sample_every:
+            return
+        fields['kind'] = 'step'
+        self.records.append(fields)
+        if len(self.records) >= self.buffer_size:
+            self.flush()
+
+    def episode(self, level=INFO, **fields):
+        # Record the end of an episode and flush all waiting records.
+        if level < self.level:
+            return
+        fields['kind'] = 'episode'
+        if self.echo:
+            print(' '.join('{}: {}'.format(key, value) for key, value in fields.items() if key != 'kind'))
+        if self.path is None:
+            return
+        self.records.append(fields)
+        self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(record, default=to_builtin) + '\n' for record in self.records))
+        self.records = []
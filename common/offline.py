@@ -0,0 +1,265 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from q_storage import QStorage, DenseQ, HashedQ, TileCodedQ, state_features
+from trajectory import TrajectoryRecorder, load_trajectory, episode_starts, RECORD_DTYPES, NO_ACTION
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'grid_move'))
+sys.path.append(os.path.join(ROOT, 'FlappyBird-master'))
+
+TRANSITION_DTYPE = RECORD_DTYPES['transitions']
+
+
+def dataset_config(learner, gamma=None):
+    # The header of a dataset for the Q matrix of a GridMove or FlappyBird: the shape and action axis of Q, which is
+    # the shape of R, and what is needed to create a learner it fits. gamma is the discount multi-step rewards were
+    # summed with, if any.
+    if hasattr(learner, 'goal_mask'):
+        return dict(game='grid_move', q_shape=learner.R.shape, action_axis=-1, gamma=gamma,
+                    learner=dict(obstacle_states=learner.obstacle_states, goal_state=learner.goal_state,
+                                 rows=learner.rows, columns=learner.columns))
+    return dict(game='flappybird', q_shape=learner.R.shape, action_axis=0, gamma=gamma,
+                learner=dict(dx_edges=learner.dx_bins.edges, dx_table_range=learner.dx_bins.table_range,
+                             dy_edges=learner.dy_bins.edges, dy_table_range=learner.dy_bins.table_range))
+
+
+def make_learner(config, gamma, learning_rate, q_storage=None):
+    # A headless learner with empty Q values that fits a dataset, kept in q_storage if given.
+    if config['game'] == 'grid_move':
+        from grid_move import GridMove
+        return GridMove(max_gens=1, gamma=gamma, learning_rate=learning_rate, random_factor=0, headless=True,
+                        q_storage=q_storage, **config['learner'])
+    from flappybird import FlappyBird
+    from discretizer import Discretizer
+    bins = config['learner']
+    return FlappyBird(max_gens=1, gamma=gamma, learning_rate=learning_rate, headless=True,
+                      dx_bins=Discretizer(bins['dx_edges'], bins['dx_table_range']),
+                      dy_bins=Discretizer(bins['dy_edges'], bins['dy_table_range']), q_storage=q_storage)
+
+
+def transitions_from_trajectory(path, dx_bins=None, dy_bins=None):
+    # The dataset config and the transitions of every move in a GridMove or FlappyBird trajectory file. FlappyBird
+    # states are binned with dx_bins and dy_bins, by default the ones of FlappyBird.
+    game, config, records = load_trajectory(path)
+    if game == 'grid_move':
+        from grid_move import GridMove
+        learner = GridMove(max_gens=1, gamma=0, learning_rate=0, random_factor=0, headless=True, **config)
+        states = records['state'].astype(np.int64)
+        actions = records['action'].astype(np.int64)
+        next_states = learner.next_states[states, actions]
+
+        transitions = np.zeros(len(records), dtype=TRANSITION_DTYPE)
+        transitions['state'] = states
+        transitions['action'] = actions
+        transitions['reward'] = learner.R[states, actions]
+        transitions['next_state'] = next_states
+        transitions['done'] = learner.goal_mask.flat[next_states] | learner.obstacle_mask.flat[next_states]
+        transitions['steps'] = 1
+        return dataset_config(learner), transitions
+
+    if game != 'flappybird':
+        raise ValueError('{} holds {}, which has no Q matrix'.format(path, game))
+    from flappybird import FlappyBird, Y_CHANGE_FROM_ACTION, DX_BINS, DY_BINS
+    learner = FlappyBird(max_gens=1, headless=True, dx_bins=dx_bins if dx_bins is not None else DX_BINS,
+                         dy_bins=dy_bins if dy_bins is not None else DY_BINS)
+
+    # Every record with an action is a move. The records hold the bird after the action, and only action 1 of
+    # take_action moved it, while FLAP and JUMP_IN_PLACE are jumps in place.
+    episodes = np.cumsum(episode_starts(records))
+    moves = np.flatnonzero(records['action'] != NO_ACTION)
+    move = np.array(records[moves])
+    actions = np.minimum(move['action'], 1).astype(np.int64)
+    birdY_before = move['birdY'] - np.where(move['action'] == 1, Y_CHANGE_FROM_ACTION[1], 0)
+
+    # The state the move starts from and the reward of the state it moves the bird to, as in train_step and
+    # finish_move, so the transitions update the same Q entries as training online.
+    gap_center = 0 - learner.gap / 2 + 500 - move['offset']
+    x_index = learner.dx_bins.indices(move['wallx'] - learner.birdX - 44)
+    y_index = learner.dy_bins.indices(gap_center - birdY_before)
+    new_y_index = learner.dy_bins.indices(gap_center - move['birdY'])
+    states = learner.state_index(y_index, x_index)
+    rewards = learner.R[actions, new_y_index, x_index]
+
+    # A move leads to the next move of its episode. If the bird is dead in the record after it, the move killed it,
+    # and if the next record starts a new episode the bird left the screen. Both end the episode with the death
+    # penalty, as in FlappyBird.punish_death. A last move the recording stopped after has no next state and is dropped.
+    move_episodes = episodes[moves]
+    has_next = np.append(move_episodes[1:] == move_episodes[:-1], False)
+    following = np.minimum(moves + 1, len(records) - 1)
+    in_file = moves + 1 < len(records)
+    died = in_file & (episodes[following] == move_episodes) & (records['action'][following] == NO_ACTION)
+    left = in_file & (episodes[following] != move_episodes)
+    keep = has_next | died | left
+
+    transitions = np.zeros(len(moves), dtype=TRANSITION_DTYPE)
+    transitions['state'] = states
+    transitions['action'] = actions
+    transitions['reward'] = np.where(died | left, -100, rewards)
+    transitions['next_state'] = np.where(has_next, np.append(states[1:], 0), states)
+    transitions['done'] = ~has_next
+    transitions['steps'] = 1
+    return dataset_config(learner), transitions[keep]
+
+
+def transitions_from_checkpoint(path):
+    # The dataset config and the transitions in the replay buffer of a FlappyBird checkpoint. Its multi-step
+    # rewards were summed with the gamma of the checkpoint, which the dataset only records if there are any.
+    from flappybird import FlappyBird
+    learner = FlappyBird.from_checkpoint(path, mmap_mode='r', headless=True)
+    arrays = learner.replay_buffer.arrays()
+    transitions = np.zeros(len(arrays['states']), dtype=TRANSITION_DTYPE)
+    for field, name in (('state', 'states'), ('action', 'actions'), ('reward', 'rewards'),
+                        ('next_state', 'next_states'), ('done', 'dones')):
+        transitions[field] = arrays[name]
+    transitions['steps'] = arrays['steps']
+    gamma = learner.gamma if np.any(transitions['steps'] > 1) else None
+    return dataset_config(learner, gamma), transitions
+
+
+def write_dataset(path, config, transitions):
+    # Append transitions to a dataset file, which is created if it does not exist yet.
+    recorder = TrajectoryRecorder(path)
+    recorder.start('transitions', config)
+    recorder.extend(transitions)
+    recorder.close()
+
+
+def load_dataset(path):
+    # The config and the memory-mapped transitions of a dataset file.
+    game, config, transitions = load_trajectory(path)
+    if game != 'transitions':
+        raise ValueError('{} holds {}, not transitions'.format(path, game))
+    return config, transitions
+
+
+def train_offline(path, Q, gamma, learning_rate, epochs=10, chunk_size=65536, tolerance=None, shuffle=True,
+                  rng=None):
+    # Train Q in place on a dataset file with epochs of batched Bellman updates. Q is the Q matrix the dataset is for,
+    # or a QStorage whose state features are the indices along the state axes of that matrix. The dataset is
+    # memory-mapped and read in chunks of chunk_size transitions, so it can be larger than memory, and every chunk is
+    # one vectorized update with its targets from Q before the chunk. With shuffle the chunks are visited in a new
+    # random order every epoch. Training stops early after an epoch in which no entry of Q moved more than tolerance.
+    # Returns per epoch the mean absolute TD error, the largest change of an entry and the wall time.
+    config, transitions = load_dataset(path)
+    q_shape = tuple(config['q_shape'])
+    action_axis = config['action_axis'] % len(q_shape)
+    if isinstance(Q, QStorage):
+        storage = Q
+        if storage.num_actions != q_shape[action_axis]:
+            raise ValueError('Dataset is for {} actions, got {}'.format(q_shape[action_axis], storage.num_actions))
+    elif q_shape != Q.shape:
+        raise ValueError('Dataset is for a Q matrix of shape {}, got {}'.format(q_shape, Q.shape))
+    else:
+        storage = DenseQ.from_array(Q, action_axis)
+    state_shape = q_shape[:action_axis] + q_shape[action_axis + 1:]
+    rng = np.random.default_rng(rng)
+
+    # Multi-step rewards were summed with the gamma of the dataset, so they only fit Q values of the same gamma.
+    if config['gamma'] is not None and config['gamma'] != gamma:
+        raise ValueError('Dataset holds multi-step returns for gamma {}, got {}'.format(config['gamma'], gamma))
+
+    starts = np.arange(0, len(transitions), chunk_size)
+    history = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        total_td = max_delta = 0.0
+        for chunk_start in (rng.permutation(starts) if shuffle else starts):
+            chunk = np.array(transitions[chunk_start:chunk_start + chunk_size])
+            states = state_features(chunk['state'], state_shape)
+            next_states = state_features(chunk['next_state'], state_shape)
+            actions = chunk['action'].astype(np.int64)
+            pairs = np.arange(len(chunk))
+            old_values = storage.values(states)[pairs, actions]
+            td_errors = storage.update(states, actions, chunk['reward'], next_states, chunk['done'],
+                                       learning_rate=learning_rate, discounts=gamma ** chunk['steps'])
+            total_td += float(np.abs(td_errors).sum())
+            max_delta = max(max_delta, float(np.max(np.abs(storage.values(states)[pairs, actions] - old_values),
+                                                    initial=0)))
+
+        history.append(dict(epoch=epoch + 1, mean_abs_td=total_td / max(len(transitions), 1), max_delta=max_delta,
+                            wall_time=time.perf_counter() - start))
+        if tolerance is not None and max_delta < tolerance:
+            break
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build transition datasets from recordings and train Q matrices on '
+                                                 'them offline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='Append the transitions of trajectory files and FlappyBird '
+                                                  'checkpoints to a dataset.')
+    convert.add_argument('sources', nargs='+', help='Trajectory files, or checkpoint directories.')
+    convert.add_argument('--out', required=True, help='The dataset file.')
+
+    train = commands.add_parser('train', help='Train a Q matrix on a dataset and save it as a checkpoint.')
+    train.add_argument('dataset')
+    train.add_argument('--gamma', type=float, default=None,
+                       help='Defaults to the gamma of the multi-step returns of the dataset, or 0.5.')
+    train.add_argument('--learning-rate', type=float, default=0.5)
+    train.add_argument('--epochs', type=int, default=20)
+    train.add_argument('--chunk-size', type=int, default=65536)
+    train.add_argument('--tolerance', type=float, default=None)
+    train.add_argument('--seed', type=int, default=0)
+    train.add_argument('--storage', choices=('dense', 'hashed', 'tiles'), default='dense',
+                       help='Keep the Q values in a dense matrix, a HashedQ of the visited states only, or a '
+                            'TileCodedQ over the state indices with tiles of two indices.')
+    train.add_argument('--out', default=None, help='Save a checkpoint of a learner with the trained Q values here.')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for source in args.sources:
+            if not os.path.exists(source):
+                parser.error('{} does not exist'.format(source))
+        for source in args.sources:
+            if os.path.isdir(source):
+                config, transitions = transitions_from_checkpoint(source)
+            else:
+                config, transitions = transitions_from_trajectory(source)
+            try:
+                write_dataset(args.out, config, transitions)
+            except ValueError:
+                parser.error('The transitions of {} do not fit {}, which is for another Q matrix or holds multi-step '
+                             'returns of another gamma'.format(source, args.out))
+            print('{}: {} transitions'.format(source, len(transitions)))
+        return
+
+    if not os.path.exists(args.dataset):
+        parser.error('{} does not exist'.format(args.dataset))
+    config, transitions = load_dataset(args.dataset)
+    if args.gamma is None:
+        args.gamma = config['gamma'] if config['gamma'] is not None else 0.5
+    elif config['gamma'] is not None and config['gamma'] != args.gamma:
+        parser.error('{} holds multi-step returns for gamma {}, not {}'.format(args.dataset, config['gamma'],
+                                                                               args.gamma))
+    q_shape = tuple(config['q_shape'])
+    action_axis = config['action_axis'] % len(q_shape)
+    state_shape = q_shape[:action_axis] + q_shape[action_axis + 1:]
+    if args.storage == 'hashed':
+        q_storage = HashedQ(len(state_shape), q_shape[action_axis])
+    elif args.storage == 'tiles':
+        q_storage = TileCodedQ(np.zeros(len(state_shape)), np.array(state_shape) - 1,
+                               np.maximum(np.array(state_shape) // 2, 1), 4, q_shape[action_axis])
+    else:
+        q_storage = None
+    learner = make_learner(config, args.gamma, args.learning_rate, q_storage)
+    print('{} transitions for {}'.format(len(transitions), config['game']))
+    print('{:>8}{:>16}{:>14}{:>12}'.format('epoch', 'mean |td|', 'max delta', 'time (s)'))
+    for epoch in train_offline(args.dataset, learner.q_storage, args.gamma, args.learning_rate, args.epochs,
+                               args.chunk_size, args.tolerance, rng=args.seed):
+        print('{epoch:>8}{mean_abs_td:>16.4f}{max_delta:>14.4f}{wall_time:>12.3f}'.format(**epoch))
+    if args.storage == 'hashed':
+        print('{} states visited, {} bytes'.format(learner.q_storage.size, learner.q_storage.nbytes))
+
+    if args.out is not None:
+        learner.tracker.recompute(learner.q_storage.weights)
+        learner.save(args.out)
+
+
+if __name__ == '__main__':
+    main()
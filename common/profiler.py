@@ -0,0 +1,134 @@
+import cProfile
+import time
+
+import numpy as np
+
+# Histogram bin edges for phase durations in nanoseconds, 8 bins per factor of 10 from 100 ns to 100 s.
+DURATION_EDGES = np.logspace(2, 11, 73)
+
+# Phases the training loops are split into.
+SIMULATE = 'simulate'
+LEARN = 'learn'
+RENDER = 'render'
+IO = 'io'
+
+
+class PhaseProfiler:
+    """
+    Times the phases of a training loop, such as simulate, learn, render and io, and aggregates the durations into a
+    histogram per phase. Phases can be nested, and the time of every chain of nested phases is kept as well, so it
+    can be written out as a flame graph.
+
+    Wrap a phase in start(name) and stop(). Both return straight away while the profiler is disabled, so the calls
+    can stay in hot loops, and it can be switched on and off at any time with enable and disable. If cprofile is
+    True, a cProfile profiler runs while the profiler is enabled, for a per function view of the same time.
+
+    :param enabled:     Whether to start timing straight away.
+    :param cprofile:    Also run cProfile while enabled.
+    """
+
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = False
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+        # Durations not yet added to the histograms, per phase.
+        self.durations = {}
+        # Per phase: histogram counts over DURATION_EDGES, number of calls, total and largest duration.
+        self.counts = {}
+        self.calls = {}
+        self.totals = {}
+        self.maxima = {}
+        # Time spent in every chain of nested phases, without the time of the phases nested in it.
+        self.folded = {}
+
+        # Running phases as [name, start time, time of nested phases].
+        self.stack = []
+
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        self.enabled = True
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def disable(self):
+        self.enabled = False
+        self.stack = []
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        self.stack.append([name, time.perf_counter_ns(), 0])
+
+    def stop(self):
+        if not self.enabled or not self.stack:
+            return
+        now = time.perf_counter_ns()
+        path = ';'.join(phase[0] for phase in self.stack)
+        name, start, nested = self.stack.pop()
+        duration = now - start
+        if self.stack:
+            self.stack[-1][2] += duration
+
+        durations = self.durations.setdefault(name, [])
+        durations.append(duration)
+        if len(durations) >= 100000:
+            self.aggregate()
+        self.folded[path] = self.folded.get(path, 0) + duration - nested
+
+    def aggregate(self):
+        # Add the waiting durations to the histograms.
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            durations = np.array(durations)
+            counts = np.bincount(np.searchsorted(DURATION_EDGES, durations), minlength=len(DURATION_EDGES) + 1)
+            self.counts[name] = self.counts.get(name, 0) + counts
+            self.calls[name] = self.calls.get(name, 0) + len(durations)
+            self.totals[name] = self.totals.get(name, 0) + int(durations.sum())
+            self.maxima[name] = max(self.maxima.get(name, 0), int(durations.max()))
+            self.durations[name] = []
+
+    def percentile(self, name, q):
+        # Duration in seconds below which q percent of the calls of a phase took, to the resolution of the histogram.
+        counts = self.counts[name]
+        rank = np.searchsorted(np.cumsum(counts), q / 100 * counts.sum())
+        edges = np.concatenate([[0], DURATION_EDGES, [self.maxima[name]]])
+        return min(edges[rank + 1], self.maxima[name]) / 1e9
+
+    def summary(self):
+        # Calls, total, mean, P50, P99 and largest duration in seconds of every phase.
+        self.aggregate()
+        return {name: dict(calls=self.calls[name],
+                           total=self.totals[name] / 1e9,
+                           mean=self.totals[name] / self.calls[name] / 1e9,
+                           p50=self.percentile(name, 50),
+                           p99=self.percentile(name, 99),
+                           max=self.maxima[name] / 1e9)
+                for name in self.calls}
+
+    def report(self):
+        # The summary as a table, slowest phase first.
+        summary = self.summary()
+        lines = ['{:<12}{:>10}{:>12}{:>12}{:>12}{:>12}{:>12}'.format('phase', 'calls', 'total (s)', 'mean (us)',
+                                                                     'p50 (us)', 'p99 (us)', 'max (us)')]
+        for name, phase in sorted(summary.items(), key=lambda item: -item[1]['total']):
+            lines.append('{name:<12}{calls:>10}{total:>12.3f}{mean:>12.1f}{p50:>12.1f}{p99:>12.1f}{max:>12.1f}'.format(
+                name=name, calls=phase['calls'], total=phase['total'],
+                **{key: phase[key] * 1e6 for key in ('mean', 'p50', 'p99', 'max')}))
+        return '\n'.join(lines)
+
+    def dump_folded(self, path):
+        # Write the time of every chain of nested phases in microseconds, in the folded format read by flamegraph.pl
+        # and speedscope.
+        with open(path, 'w') as f:
+            f.write(''.join('{} {}\n'.format(stack, duration // 1000) for stack, duration in sorted(self.folded.items())))
+
+    def dump_cprofile(self, path):
+        # Write the cProfile statistics, to be read with pstats or snakeviz.
+        if self.cprofile is None:
+            raise ValueError('The profiler was created without cprofile=True')
+        self.cprofile.dump_stats(path)
@@ -0,0 +1,330 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class QStorage(ABC):
+    """
+    Base class of the Q value stores. States are given as arrays of shape (n, num_features), one row of features per
+    state, and all methods handle a whole batch of states in one call. Subclasses implement values and add, and keep
+    the numbers they learn in an array called weights, which the norm of ConvergenceTracker is taken over.
+
+    The learners look up and set single states in their inner loop, so row and set_value take one state as a tuple of
+    features, and subclasses can make them cheaper than a batch of one.
+
+    :param num_actions: The number of actions of every state.
+    """
+
+    def __init__(self, num_actions):
+        self.num_actions = num_actions
+
+    @abstractmethod
+    def values(self, states):
+        # Q values of every action for each state, shape (n, num_actions).
+        pass
+
+    @abstractmethod
+    def add(self, states, actions, deltas):
+        # Move the Q value of each (state, action) pair by delta. Returns the weights that changed, before and after,
+        # so a ConvergenceTracker can follow the norm of the weights.
+        pass
+
+    def row(self, state):
+        # Q values of every action of one state.
+        return self.values(np.array([state]))[0]
+
+    def set_value(self, state, action, value):
+        # Set the Q value of one (state, action) pair. Returns the weights that changed, before and after.
+        return self.add(np.array([state]), np.array([action]), np.array([value - self.row(state)[action]]))
+
+    def set_values(self, states, values):
+        # Set the Q values of every action of each state, e.g. to a solution found by value iteration. Returns the
+        # weights that changed, before and after.
+        states = np.asarray(states)
+        deltas = np.asarray(values, dtype=np.float64) - self.values(states)
+        return self.add(np.repeat(states, self.num_actions, axis=0), np.tile(np.arange(self.num_actions), len(states)),
+                        deltas.ravel())
+
+    def argmax(self, states, rng=None):
+        # The best action for each state. With rng, ties between actions are broken at random instead of taking the
+        # lowest action.
+        values = self.values(states)
+        if rng is not None:
+            values = np.where(values == values.max(axis=1, keepdims=True), rng.random(values.shape), -np.inf)
+        return np.argmax(values, axis=1)
+
+    def td_errors(self, states, actions, rewards, next_states, dones=None, gamma=0.5, discounts=None):
+        # The TD error of every transition, with targets from the current Q values. discounts replaces gamma per
+        # transition.
+        max_Q = self.values(next_states).max(axis=1)
+        if dones is not None:
+            max_Q = np.where(dones, 0, max_Q)
+        discounts = gamma if discounts is None else discounts
+        actions = np.asarray(actions)
+        return np.asarray(rewards) + discounts * max_Q - self.values(states)[np.arange(len(actions)), actions]
+
+    def update(self, states, actions, rewards, next_states, dones=None, gamma=0.5, learning_rate=0.1, discounts=None):
+        # Apply the Bellman update for a batch of transitions, with targets computed before the update. discounts
+        # replaces gamma per transition. Returns the TD errors.
+        td_errors = self.td_errors(states, actions, rewards, next_states, dones, gamma, discounts)
+        self.add(states, actions, learning_rate * td_errors)
+        return td_errors
+
+    def config(self):
+        # The constructor arguments of an empty store like this one, for storage_from_config.
+        return dict(num_actions=self.num_actions)
+
+    def arrays(self):
+        # The learned state of the store, e.g. for saving it in a checkpoint.
+        return dict(weights=self.weights)
+
+    def restore(self, arrays):
+        # Take over the learned state returned by arrays.
+        self.weights[...] = arrays['weights']
+
+
+def state_features(states, state_shape):
+    # Flat state indices over state_shape as rows of indices along the state axes, the states of a QStorage.
+    return np.stack(np.unravel_index(np.asarray(states, dtype=np.int64), state_shape), axis=1)
+
+
+def mean_deltas(keys, deltas):
+    # The unique keys and the mean delta of each, so a pair that appears several times in a batch is moved once,
+    # by the mean of its deltas, like in QTable.update.
+    unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return unique_keys, np.bincount(inverse, weights=deltas, minlength=len(unique_keys)) / counts
+
+
+class DenseQ(QStorage):
+    """
+    Q values in a dense array with an axis per state feature and the actions on the last axis. Features are the
+    indices along the state axes. Memory is the product of all axis lengths, whether the states are visited or not.
+
+    :param state_shape: The number of values of every state feature.
+    :param num_actions: The number of actions of every state.
+    :param dtype:       The dtype of the array.
+    """
+
+    def __init__(self, state_shape, num_actions, dtype=np.float64):
+        super().__init__(num_actions)
+        self.Q = np.zeros(tuple(state_shape) + (num_actions,), dtype=dtype)
+
+    @classmethod
+    def from_array(cls, Q, action_axis=-1):
+        # Use an existing Q matrix, such as GridMove.Q (state, action) or FlappyBird.Q (action, dy, dx), without
+        # copying it. Updates are written to Q.
+        storage = cls.__new__(cls)
+        QStorage.__init__(storage, Q.shape[action_axis])
+        storage.Q = np.moveaxis(Q, action_axis, -1)
+        return storage
+
+    @property
+    def nbytes(self):
+        return self.Q.nbytes
+
+    @property
+    def weights(self):
+        return self.Q
+
+    def values(self, states):
+        return self.Q[tuple(np.asarray(states).T)]
+
+    def add(self, states, actions, deltas):
+        index = np.ravel_multi_index(tuple(np.asarray(states).T) + (np.asarray(actions),), self.Q.shape)
+        index, deltas = mean_deltas(index, deltas)
+        index = np.unravel_index(index, self.Q.shape)
+        old_values = self.Q[index]
+        new_values = (old_values + deltas).astype(self.Q.dtype)
+        self.Q[index] = new_values
+        return old_values, new_values
+
+    def row(self, state):
+        return self.Q[state]
+
+    def set_value(self, state, action, value):
+        row = self.Q[state]
+        old_value = row[action]
+        row[action] = value
+        return old_value, row[action]
+
+    def set_values(self, states, values):
+        index = tuple(np.asarray(states).T)
+        old_values = self.Q[index]
+        self.Q[index] = values
+        return old_values, self.Q[index]
+
+    def config(self):
+        return dict(state_shape=self.Q.shape[:-1], num_actions=self.num_actions, dtype=self.Q.dtype.name)
+
+
+class HashedQ(QStorage):
+    """
+    Q values of the visited states only. Every state is packed into one integer key, bits bits per feature, and a
+    dict maps the keys to rows of a table that grows as new states are updated. States that were never updated have
+    Q values of 0. Memory grows with the number of visited states, not with the range of the features.
+
+    :param num_features:    The number of features of a state.
+    :param num_actions:     The number of actions of every state.
+    :param bits:            Bits per feature in the packed key. Features must lie in [-2 ** (bits - 1),
+                            2 ** (bits - 1)), and num_features * bits must not exceed 63.
+    :param capacity:        The number of rows to allocate at first.
+    """
+
+    def __init__(self, num_features, num_actions, bits=16, capacity=1024):
+        super().__init__(num_actions)
+        if num_features * bits > 63:
+            raise ValueError('{} features of {} bits do not fit in a 63 bit key'.format(num_features, bits))
+        self.num_features = num_features
+        self.bits = bits
+        self.shifts = np.arange(num_features, dtype=np.int64) * bits
+        self.offset = 1 << (bits - 1)
+
+        self.rows = {}
+        self.table = np.zeros((capacity, num_actions))
+        self.size = 0
+
+    @property
+    def nbytes(self):
+        return self.table[:self.size].nbytes
+
+    @property
+    def weights(self):
+        return self.table[:self.size]
+
+    def pack(self, states):
+        # One integer key for each state.
+        states = np.asarray(states, dtype=np.int64) + self.offset
+        if np.any(states < 0) or np.any(states >= 1 << self.bits):
+            raise ValueError('state features must lie in [{}, {})'.format(-self.offset, self.offset))
+        return np.bitwise_or.reduce(states << self.shifts, axis=1)
+
+    def lookup(self, states, insert=False):
+        # The table row of each state. States without a row get -1, or a new row if insert is True.
+        keys, inverse = np.unique(self.pack(states), return_inverse=True)
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys.tolist()):
+            row = self.rows.get(key, -1)
+            if row < 0 and insert:
+                row = self.rows[key] = self.new_row()
+            rows[i] = row
+        return rows[inverse]
+
+    def new_row(self):
+        if self.size == len(self.table):
+            table = np.zeros((2 * len(self.table), self.num_actions))
+            table[:self.size] = self.table
+            self.table = table
+        self.size += 1
+        return self.size - 1
+
+    def values(self, states):
+        rows = self.lookup(states)
+        return np.where(rows[:, None] >= 0, self.table[rows], 0)
+
+    def add(self, states, actions, deltas):
+        index = self.lookup(states, insert=True) * self.num_actions + np.asarray(actions)
+        index, deltas = mean_deltas(index, deltas)
+        flat = self.table.reshape(-1)
+        old_values = flat[index]
+        flat[index] = old_values + deltas
+        return old_values, flat[index]
+
+    def config(self):
+        return dict(num_features=self.num_features, num_actions=self.num_actions, bits=self.bits)
+
+    def arrays(self):
+        # The keys of the rows in row order, and the rows.
+        keys = np.zeros(self.size, dtype=np.int64)
+        keys[list(self.rows.values())] = list(self.rows.keys())
+        return dict(keys=keys, weights=self.weights)
+
+    def restore(self, arrays):
+        self.rows = {key: row for row, key in enumerate(arrays['keys'].tolist())}
+        self.size = len(self.rows)
+        self.table = np.zeros((max(self.size, 1), self.num_actions))
+        self.table[:self.size] = arrays['weights']
+
+
+class TileCodedQ(QStorage):
+    """
+    Q values of continuous states as the sum of the weights of one tile in each of num_tilings overlapping grids.
+    Every grid splits each feature range into tiles_per_feature tiles and is shifted by a different fraction of a
+    tile, so nearby states share most of their tiles and learn from each other. Features outside [low, high] are
+    clamped to the edges.
+
+    With size None every tile of every grid has a weight. Otherwise the tiles are hashed into size weights, which
+    bounds memory no matter how many features there are, at the cost of occasional collisions.
+
+    :param low:                 The lowest value of every feature.
+    :param high:                The highest value of every feature.
+    :param tiles_per_feature:   The number of tiles along every feature, a single number or one per feature.
+    :param num_tilings:         The number of overlapping grids.
+    :param num_actions:         The number of actions of every state.
+    :param size:                The number of weights to hash the tiles into, or None for one weight per tile.
+    """
+
+    def __init__(self, low, high, tiles_per_feature, num_tilings, num_actions, size=None):
+        super().__init__(num_actions)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.tiles = np.broadcast_to(np.asarray(tiles_per_feature, dtype=np.int64), self.low.shape)
+        self.num_tilings = num_tilings
+
+        # Every grid has one tile more than tiles_per_feature along each feature, to cover its shift. The shifts of
+        # the grids are spread with different strides per feature, so the grids do not all move along the diagonal.
+        self.grid_shape = tuple(self.tiles + 1)
+        self.grid_size = int(np.prod(self.grid_shape))
+        strides = 2 * np.arange(len(self.low)) + 1
+        self.shifts = (np.arange(num_tilings)[:, None] * strides[None, :] % num_tilings) / num_tilings
+
+        self.size = size
+        self.weights = np.zeros((num_tilings * self.grid_size if size is None else size, num_actions))
+
+    @property
+    def nbytes(self):
+        return self.weights.nbytes
+
+    def active_tiles(self, states):
+        # The weight index of the tile each state falls in, in every grid, shape (n, num_tilings).
+        scaled = (np.clip(np.asarray(states, dtype=np.float64), self.low, self.high) - self.low) / \
+                 (self.high - self.low) * self.tiles
+        coords = np.floor(scaled[:, None, :] + self.shifts[None, :, :]).astype(np.int64)
+        tiles = np.ravel_multi_index(tuple(np.moveaxis(coords, -1, 0)), self.grid_shape)
+        tiles += np.arange(self.num_tilings) * self.grid_size
+        if self.size is not None:
+            tiles = (tiles * 2654435761) % self.size
+        return tiles
+
+    def values(self, states):
+        return self.weights[self.active_tiles(states)].sum(axis=1)
+
+    def add(self, states, actions, deltas):
+        # Every grid takes an equal part of the delta, so the value of the state moves by delta. A weight that
+        # several pairs of the batch share is moved by the mean of their parts, as pairs are in the other stores.
+        tiles = self.active_tiles(states)
+        actions = np.broadcast_to(np.asarray(actions)[:, None], tiles.shape)
+        deltas = np.broadcast_to(np.asarray(deltas)[:, None] / self.num_tilings, tiles.shape)
+        index, deltas = mean_deltas(np.ravel_multi_index((tiles.ravel(), actions.ravel()), self.weights.shape),
+                                    deltas.ravel())
+        flat = self.weights.reshape(-1)
+        old_values = flat[index]
+        flat[index] = old_values + deltas
+        return old_values, flat[index]
+
+    def config(self):
+        return dict(low=self.low, high=self.high, tiles_per_feature=self.tiles, num_tilings=self.num_tilings,
+                    num_actions=self.num_actions, size=self.size)
+
+
+STORAGES = {storage.__name__: storage for storage in (DenseQ, HashedQ, TileCodedQ)}
+
+
+def storage_config(storage):
+    # The class and constructor arguments of a store, to save with a checkpoint.
+    return dict(storage.config(), type=type(storage).__name__)
+
+
+def storage_from_config(config):
+    # An empty store of the class and with the constructor arguments of storage_config.
+    config = dict(config)
+    return STORAGES[config.pop('type')](**config)
@@ -0,0 +1,86 @@
+import numpy as np
+
+from q_storage import QStorage, DenseQ, state_features
+
+
+class QTable:
+    """
+    Batched tabular Q learning on top of a Q matrix or a QStorage. States are given as flat indices over the state
+    axes of the matrix (all axes except the action axis), so both GridMove.Q with shape (state, action) and
+    FlappyBird.Q with shape (action, dy, dx) can be used. A QStorage is given the indices along the state axes as
+    its state features. All methods take arrays and handle a whole batch of transitions in one call.
+
+    :param Q:               The Q matrix or QStorage. It is updated in place.
+    :param gamma:           Bellman equation value for gamma.
+    :param learning_rate:   Bellman equation value for learning rate (alpha).
+    :param action_axis:     The axis of the Q matrix which holds the actions. Not used for a QStorage.
+    :param rng:             A numpy.random.Generator used for exploration and tie-breaking.
+    :param state_shape:     The number of values along every state axis. Only needed for a QStorage other than DenseQ.
+    """
+
+    def __init__(self, Q, gamma, learning_rate, action_axis=-1, rng=None, state_shape=None):
+        self.storage = Q if isinstance(Q, QStorage) else DenseQ.from_array(Q, action_axis)
+        if state_shape is None:
+            if not isinstance(self.storage, DenseQ):
+                raise ValueError('state_shape is needed for a {}'.format(type(self.storage).__name__))
+            state_shape = self.storage.Q.shape[:-1]
+
+        self.gamma = gamma
+        self.learning_rate = learning_rate
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.num_actions = self.storage.num_actions
+        self.state_shape = tuple(state_shape)
+        self.num_states = int(np.prod(self.state_shape))
+
+    def state_index(self, *indices):
+        # Flat state index from the indices of each state axis. Example for FlappyBird: state_index(dy, dx).
+        return np.ravel_multi_index(indices, self.state_shape)
+
+    def features(self, states):
+        # The flat state indices as the states of the storage.
+        return state_features(states, self.state_shape)
+
+    def values(self, states):
+        # Q values of every action for each state, shape (len(states), num_actions).
+        return self.storage.values(self.features(states))
+
+    def select_actions(self, states, random_factor, allowed=None, random_allowed=None):
+        # Epsilon-greedy actions for a batch of states. Ties between the best actions are broken at random.
+        # allowed is an optional (len(states), num_actions) boolean mask of the actions that may be picked,
+        # random_allowed the same for random moves (defaults to allowed).
+        states = np.asarray(states)
+        values = self.values(states)
+        if allowed is None:
+            allowed = np.ones(values.shape, dtype=bool)
+        if random_allowed is None:
+            random_allowed = allowed
+
+        masked = np.where(allowed, values, -np.inf)
+        best = allowed & (masked == masked.max(axis=1, keepdims=True))
+
+        explore = self.rng.random(len(states)) < random_factor
+        candidates = np.where(explore[:, None] & random_allowed.any(axis=1, keepdims=True), random_allowed, best)
+
+        # Pick uniformly among the candidates by giving each a random key and taking the largest.
+        keys = self.rng.random(candidates.shape) * candidates
+        return keys.argmax(axis=1)
+
+    def td_errors(self, states, actions, rewards, next_states, dones=None, discounts=None):
+        # The TD error of every transition, computed from the current Q. discounts replaces gamma per transition,
+        # e.g. gamma ** n for n-step returns.
+        return self.storage.td_errors(self.features(states), actions, rewards, self.features(next_states), dones,
+                                      self.gamma, discounts)
+
+    def apply_td_errors(self, states, actions, td_error):
+        # Move the Q values of the (state, action) pairs by learning_rate times their TD error. Pairs that appear more
+        # than once are moved by the mean of their TD errors, so a pair is moved towards the mean of its targets by
+        # learning_rate, no matter how often it appears in the batch.
+        # Returns the weights of the storage that changed, before and after the update.
+        return self.storage.add(self.features(states), actions, self.learning_rate * np.asarray(td_error))
+
+    def update(self, states, actions, rewards, next_states, dones=None, discounts=None):
+        # Apply the Bellman update for a batch of transitions. All targets are computed from Q before the update.
+        # Returns the weights of the storage that changed, before and after the update.
+        td_error = self.td_errors(states, actions, rewards, next_states, dones, discounts)
+        return self.apply_td_errors(states, actions, td_error)
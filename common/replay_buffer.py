@@ -0,0 +1,231 @@
+import numpy as np
+
+# Added to the priority of every transition, so transitions with a TD error of 0 can still be sampled.
+PRIORITY_EPSILON = 1e-3
+
+
+class SumTree:
+    """
+    Binary tree over an array of non-negative weights, in which every node holds the sum of the two below it and the
+    root the total. Setting k weights and drawing k indices with probability proportional to their weight both take
+    O(k log n) instead of a pass over all n weights.
+
+    :param size:    The number of weights. They start at 0.
+    """
+
+    def __init__(self, size):
+        self.depth = max(int(size) - 1, 0).bit_length()
+        self.leaves = 1 << self.depth
+        self.tree = np.zeros(2 * self.leaves)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def get(self, index):
+        return self.tree[self.leaves + np.asarray(index)]
+
+    def set(self, index, weights):
+        # Set the weights at an array of indices, then the sums above them one level at a time. A node above several
+        # of the indices is summed more than once, to the same value, which is cheaper than deduplicating them.
+        nodes = self.leaves + np.asarray(index)
+        self.tree[nodes] = weights
+        for _ in range(self.depth):
+            nodes >>= 1
+            children = nodes << 1
+            self.tree[nodes] = self.tree[children] + self.tree[children + 1]
+
+    def build(self, weights):
+        # Set the first len(weights) weights and zero the rest, computing every sum once.
+        self.tree[self.leaves:] = 0
+        self.tree[self.leaves:self.leaves + len(weights)] = weights
+        for level in range(self.depth - 1, -1, -1):
+            start = 1 << level
+            self.tree[start:2 * start] = self.tree[2 * start:4 * start:2] + self.tree[2 * start + 1:4 * start:2]
+
+    def find(self, values):
+        # The index of the weight each value in [0, total) falls into, when the weights are laid end to end.
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            nodes <<= 1
+            left = self.tree[nodes]
+            right = values >= left
+            values -= left * right
+            nodes += right
+        return nodes - self.leaves
+
+
+class ReplayBuffer:
+    """
+    Experience replay memory for Q learning, kept in preallocated arrays used as a ring buffer.
+
+    Every transition is a flat state index, an action, a reward, a flat next state index, a done flag, the discount to
+    apply to the value of the next state and the number of steps its reward was summed over. Adding a transition writes
+    one slot of each array, and once the buffer is full the oldest transition is overwritten. Minibatches are sampled
+    uniformly, or with probability proportional to priority ** alpha, and can be passed straight to QTable.update.
+    Prioritized sampling draws from a SumTree of the priorities, so it does not slow down as the buffer fills.
+
+    With n_step > 1 the last transitions are held back until n_step of them are known, and stored with the discounted
+    sum of their n_step rewards, the state n_step steps later and a discount of gamma ** n_step. At the end of an
+    episode the held back transitions are stored with the shorter returns that are left.
+
+    :param capacity:    The number of transitions kept.
+    :param n_step:      The number of rewards summed into every stored transition.
+    :param gamma:       The discount factor for the n-step returns.
+    :param alpha:       How strongly sampling prefers transitions with a large TD error. 0 samples uniformly.
+    :param rng:         Seed or numpy Generator for sampling.
+    """
+
+    def __init__(self, capacity, n_step=1, gamma=0.5, alpha=0.0, rng=None):
+        self.capacity = capacity
+        self.n_step = n_step
+        self.alpha = alpha
+        self.rng = np.random.default_rng(rng)
+
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.discounts = np.zeros(capacity)
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        self.priorities = np.zeros(capacity)
+
+        # priorities ** alpha for prioritized sampling. Slots stored or given new priorities since the last sample are
+        # only marked dirty, and written to the tree in one batch when sampling, so storing a transition stays O(1).
+        self.tree = SumTree(capacity) if alpha else None
+        self.dirty = []
+
+        # Slot the next transition is written to, and the number of slots in use.
+        self.index = 0
+        self.size = 0
+        # New transitions get the highest priority seen so far, so they are sampled at least once soon.
+        self.max_priority = 1.0
+
+        # The last transitions that are not stored yet, as rows of (state, action, reward, next_state, done), with
+        # gamma ** i for the i-th of them.
+        self.pending = np.zeros((n_step, 5))
+        self.pending_count = 0
+        self.set_gamma(gamma)
+
+    def set_gamma(self, gamma):
+        # Change the discount factor of the n-step returns stored from now on.
+        self.gamma = gamma
+        self.powers = gamma ** np.arange(self.n_step + 1)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done=False):
+        self.pending[self.pending_count] = (state, action, reward, next_state, done)
+        self.pending_count += 1
+        if done:
+            self.end_episode()
+        elif self.pending_count == self.n_step:
+            self.store_pending()
+
+    def end_episode(self):
+        # Store all held back transitions, e.g. when an episode is cut off without a terminal transition.
+        while self.pending_count:
+            self.store_pending()
+
+    def store_pending(self):
+        # Store the oldest held back transition with the return of all rewards held back from it on.
+        count = self.pending_count
+        pending = self.pending[:count]
+        ret = np.dot(self.powers[:count], pending[:, 2])
+        self.store(pending[0, 0], pending[0, 1], ret, pending[-1, 3], pending[-1, 4], self.powers[count], count)
+
+        self.pending[:count - 1] = pending[1:]
+        self.pending_count -= 1
+
+    def store(self, state, action, reward, next_state, done, discount, steps=1):
+        i = self.index
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.discounts[i] = discount
+        self.steps[i] = steps
+        self.priorities[i] = self.max_priority
+
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        if self.tree is not None:
+            self.dirty.append(i)
+            if len(self.dirty) >= self.capacity:
+                self.sync_tree()
+
+    def sample(self, batch_size, beta=0.4):
+        # Draw a minibatch of slots. Returns the slots, the transitions as arrays of (states, actions, rewards,
+        # next_states, dones, discounts), and importance sampling weights that undo the bias of prioritized sampling
+        # to the power beta. The weights are all 1 when sampling uniformly.
+        if self.alpha == 0:
+            index = self.rng.integers(0, self.size, batch_size)
+            weights = np.ones(batch_size)
+        else:
+            self.sync_tree()
+            total = self.tree.total
+            # Rounding can leave a value on a slot past the filled part, which has a weight of 0.
+            index = np.minimum(self.tree.find(self.rng.random(batch_size) * total), self.size - 1)
+            probabilities = self.tree.get(index) / total
+            weights = (self.size * probabilities) ** -beta
+            weights /= weights.max()
+
+        batch = (self.states[index], self.actions[index], self.rewards[index], self.next_states[index],
+                 self.dones[index], self.discounts[index])
+        return index, batch, weights
+
+    def update_priorities(self, index, td_errors):
+        # Set the priorities of sampled slots from the TD errors they had in the update.
+        priorities = np.abs(td_errors) + PRIORITY_EPSILON
+        self.priorities[index] = priorities
+        self.max_priority = max(self.max_priority, priorities.max())
+        if self.tree is not None:
+            self.dirty.extend(np.asarray(index).tolist())
+
+    def sync_tree(self):
+        # Copy the priorities of the dirty slots to the sum tree, or all of them if most slots are dirty.
+        if len(self.dirty) >= self.size:
+            self.tree.build(self.priorities[:self.size] ** self.alpha)
+        elif self.dirty:
+            index = np.array(self.dirty)
+            self.tree.set(index, self.priorities[index] ** self.alpha)
+        self.dirty = []
+
+    def arrays(self):
+        # The filled part of the buffer, in insertion order, e.g. for saving it in a checkpoint.
+        order = (np.arange(self.size) + self.index - self.size) % self.capacity
+        return dict(states=self.states[order], actions=self.actions[order], rewards=self.rewards[order],
+                    next_states=self.next_states[order], dones=self.dones[order], discounts=self.discounts[order],
+                    steps=self.steps[order], priorities=self.priorities[order],
+                    pending=self.pending[:self.pending_count])
+
+    def steps_from_discounts(self, discounts):
+        # The step counts of transitions saved before they were stored, which only the discount tells. That is
+        # gamma ** steps, so the count is only known for certain with one step, or with a gamma between 0 and 1.
+        if self.n_step == 1:
+            return 1
+        if not 0 < self.gamma < 1:
+            raise ValueError('The step counts of the replay buffer cannot be recovered for gamma {}'.format(self.gamma))
+        return np.rint(np.log(discounts) / np.log(self.gamma))
+
+    def restore(self, arrays):
+        # Refill the buffer from arrays returned by arrays. If there are more transitions than fit, the newest are kept.
+        size = min(len(arrays['states']), self.capacity)
+        for name in ('states', 'actions', 'rewards', 'next_states', 'dones', 'discounts', 'priorities'):
+            getattr(self, name)[:size] = arrays[name][len(arrays[name]) - size:]
+        if 'steps' in arrays:
+            self.steps[:size] = arrays['steps'][len(arrays['steps']) - size:]
+        else:
+            self.steps[:size] = self.steps_from_discounts(self.discounts[:size])
+        self.size = size
+        self.index = size % self.capacity
+        self.max_priority = float(np.max(self.priorities[:size], initial=1.0))
+        if self.tree is not None:
+            self.dirty = []
+            self.tree.build(self.priorities[:size] ** self.alpha)
+        self.pending_count = len(arrays['pending'])
+        self.pending[:self.pending_count] = arrays['pending']
@@ -0,0 +1,112 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'grid_move'))
+sys.path.append(os.path.join(ROOT, 'FlappyBird-master'))
+
+GAMES = ('grid_move', 'flappybird')
+
+
+def grid_configs(game, gammas, learning_rates, random_factors, seeds, max_gens):
+    # Every combination of the given hyperparameters and seeds.
+    return [dict(game=game, gamma=gamma, learning_rate=learning_rate, random_factor=random_factor, seed=seed,
+                 max_gens=max_gens)
+            for gamma, learning_rate, random_factor, seed in itertools.product(gammas, learning_rates,
+                                                                                random_factors, seeds)]
+
+
+def random_configs(game, num_samples, gamma_range, learning_rate_range, random_factor_range, seeds, max_gens,
+                   rng=None):
+    # num_samples hyperparameter settings drawn uniformly from the given (low, high) ranges, each run with every seed.
+    rng = rng if rng is not None else np.random.default_rng()
+    configs = []
+    for _ in range(num_samples):
+        gamma = float(rng.uniform(*gamma_range))
+        learning_rate = float(rng.uniform(*learning_rate_range))
+        random_factor = float(rng.uniform(*random_factor_range))
+        configs += grid_configs(game, [gamma], [learning_rate], [random_factor], seeds, max_gens)
+    return configs
+
+
+def run_config(config):
+    # Train one headless learner with the given configuration and return its per generation metrics.
+    if config['game'] == 'grid_move':
+        from grid_move import GridMove
+        learner = GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=config['max_gens'],
+                           gamma=config['gamma'], learning_rate=config['learning_rate'],
+                           random_factor=config['random_factor'], headless=True, rng=config['seed'])
+    else:
+        from flappybird import FlappyBird
+        learner = FlappyBird(max_gens=config['max_gens'], gamma=config['gamma'],
+                             learning_rate=config['learning_rate'], random_factor=config['random_factor'],
+                             headless=True, rng=config['seed'])
+
+    start = time.perf_counter()
+    learner.train_run()
+    wall_time = time.perf_counter() - start
+
+    return dict(config, performance=learner.performance_array[:, 0], norm_diff=learner.norm_diff_array[:, 0],
+                wall_time=wall_time)
+
+
+def run_sweep(configs, path, processes=None):
+    # Run all configurations in a process pool and save the results to path as one .npz file with a column per
+    # field and a row per generation of every run.
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(run_config, configs)
+
+    columns = {name: [] for name in ('run', 'game', 'gamma', 'learning_rate', 'random_factor', 'seed', 'wall_time',
+                                     'generation', 'performance', 'norm_diff')}
+    for run, result in enumerate(results):
+        num_gens = len(result['performance'])
+        columns['run'].append(np.full(num_gens, run))
+        for name in ('game', 'gamma', 'learning_rate', 'random_factor', 'seed', 'wall_time'):
+            columns[name].append(np.full(num_gens, result[name]))
+        columns['generation'].append(np.arange(num_gens))
+        columns['performance'].append(result['performance'])
+        columns['norm_diff'].append(result['norm_diff'])
+
+    np.savez(path, **{name: np.concatenate(values) for name, values in columns.items()})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train headless learners for many hyperparameters in parallel.')
+    parser.add_argument('game', choices=GAMES)
+    parser.add_argument('--gammas', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--learning-rates', type=float, nargs='+', default=[0.1])
+    parser.add_argument('--random-factors', type=float, nargs='+', default=[0.1])
+    parser.add_argument('--samples', type=int, default=0,
+                        help='Draw this many random settings between the min and max of each hyperparameter list '
+                             'instead of using every combination.')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--max-gens', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--out', default='sweep_results.npz')
+    args = parser.parse_args()
+
+    if args.samples:
+        configs = random_configs(args.game, args.samples,
+                                 (min(args.gammas), max(args.gammas)),
+                                 (min(args.learning_rates), max(args.learning_rates)),
+                                 (min(args.random_factors), max(args.random_factors)),
+                                 args.seeds, args.max_gens)
+    else:
+        configs = grid_configs(args.game, args.gammas, args.learning_rates, args.random_factors, args.seeds,
+                               args.max_gens)
+
+    results = run_sweep(configs, args.out, args.processes)
+    for result in results:
+        print('{game} gamma={gamma} learning_rate={learning_rate} random_factor={random_factor} seed={seed}: '
+              'mean performance {mean:.2f} in {wall_time:.2f}s'.format(mean=np.mean(result['performance']), **result))
+
+
+if __name__ == '__main__':
+    main()
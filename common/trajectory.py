@@ -0,0 +1,274 @@
+import argparse
+import atexit
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from metrics import to_builtin
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'grid_move'))
+sys.path.append(os.path.join(ROOT, 'FlappyBird-master'))
+sys.path.append(os.path.join(ROOT, 'flappy_bird_khaume'))
+
+# A trajectory file starts with MAGIC, the format version and the length of a JSON header with the game, its config
+# and the record layout, followed by fixed-width records, one per step, in the order they were recorded.
+MAGIC = b'TRAJ'
+VERSION = 1
+PREFIX = struct.Struct('<4sHI')
+
+# The record layout of every game, packed without padding.
+# grid_move: the state of the player before the move and the move.
+# flappybird: the state of the bird and the wall after the action of a tick and before the walls and the bird move.
+# The action is 0 or 1 as in training, FLAP for a key press in run, or NO_ACTION while the bird is dead.
+# flappy_bird_khaume: the same for the other game, which has no episodes and scrolls its walls by distance.
+# transitions: not a game but a dataset of Q learning transitions for offline.py, with the number of steps the reward
+# was summed over, so the discount of the next state is gamma ** steps.
+RECORD_DTYPES = {
+    'grid_move': np.dtype([('episode', '<u4'), ('state', '<u4'), ('action', 'i1')]),
+    'flappybird': np.dtype([('episode', '<u4'), ('action', 'i1'), ('dead', '?'), ('birdY', '<f8'), ('jump', 'u1'),
+                            ('jumpSpeed', 'i1'), ('gravity', '<f8'), ('wallx', '<i2'), ('offset', '<i2'),
+                            ('counter', '<u4')]),
+    'flappy_bird_khaume': np.dtype([('action', 'i1'), ('birdy', '<f8'), ('jump', 'u1'), ('jumpspeed', 'i1'),
+                                    ('gravity', '<f8'), ('distance', '<u4')]),
+    'transitions': np.dtype([('state', '<i8'), ('action', 'i1'), ('reward', '<f8'), ('next_state', '<i8'),
+                             ('done', '?'), ('steps', 'u1')]),
+}
+
+# Actions of flappybird records besides 0 and 1 of take_action: FLAP for the jump of a key press in run,
+# JUMP_IN_PLACE for the jump train_step starts without moving the bird up when every action is punished, and
+# NO_ACTION while the bird is dead.
+FLAP = 2
+JUMP_IN_PLACE = 3
+NO_ACTION = -1
+
+
+def encode_header(game, config):
+    header = json.dumps(dict(game=game, config=config, fields=RECORD_DTYPES[game].descr),
+                        default=to_builtin, sort_keys=True).encode()
+    return PREFIX.pack(MAGIC, VERSION, len(header)) + header
+
+
+def read_header(f):
+    # The game, config, record layout and header size of an open trajectory file.
+    magic, version, length = PREFIX.unpack(f.read(PREFIX.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a trajectory file of version {}'.format(VERSION))
+    header = json.loads(f.read(length))
+    dtype = np.dtype([tuple(field) for field in header['fields']])
+    return header['game'], header['config'], dtype, PREFIX.size + length
+
+
+class TrajectoryRecorder:
+    """
+    Appends the steps of a game to a trajectory file. Give it to a game as recorder, and the game starts it with
+    its name and everything needed to play it again, like the board or the course seed. The random generator of the
+    learner is not stored: the actions are recorded, so replaying does not need it.
+
+    A step costs one tuple appended to a list. The steps are packed into fixed-width records and written every
+    buffer_size steps, at the end of train_run and when the process exits. Recording into an existing file of the
+    same game and config appends to it, after dropping a record left half written by a crash.
+
+    :param path:        The trajectory file.
+    :param buffer_size: The number of steps kept in memory before they are written.
+    """
+
+    def __init__(self, path, buffer_size=65536):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.file = None
+        self.dtype = None
+        self.game = None
+
+    def start(self, game, config):
+        if self.file is not None:
+            raise ValueError('The recorder is already recording {}'.format(self.game))
+        self.game = game
+        self.dtype = RECORD_DTYPES[game]
+        header = encode_header(game, config)
+
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, 'rb') as f:
+                existing = f.read(len(header))
+            if existing != header:
+                raise ValueError('{} was recorded from another game or config'.format(self.path))
+            records = (os.path.getsize(self.path) - len(header)) // self.dtype.itemsize
+            os.truncate(self.path, len(header) + records * self.dtype.itemsize)
+            self.file = open(self.path, 'ab')
+        else:
+            self.file = open(self.path, 'wb')
+            self.file.write(header)
+        atexit.register(self.close)
+
+    def append(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, records):
+        # Append an array of records with the layout of the game at once.
+        self.flush()
+        self.file.write(np.asarray(records, dtype=self.dtype).tobytes())
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(np.array(self.buffer, dtype=self.dtype).tobytes())
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+            atexit.unregister(self.close)
+
+
+def load_trajectory(path):
+    # The game, config and records of a trajectory file. The records are memory-mapped, so files of any size open
+    # instantly. They are read with the layout in the header, so files written with an older layout still load.
+    with open(path, 'rb') as f:
+        game, config, dtype, header_size = read_header(f)
+    count = (os.path.getsize(path) - header_size) // dtype.itemsize
+    if count == 0:
+        return game, config, np.zeros(0, dtype=dtype)
+    return game, config, np.memmap(path, dtype=dtype, mode='r', offset=header_size, shape=count)
+
+
+def episode_starts(records):
+    # Whether every record is the first of an episode.
+    starts = np.ones(len(records), dtype=bool)
+    if 'episode' in records.dtype.names:
+        starts[1:] = records['episode'][1:] != records['episode'][:-1]
+    else:
+        starts[1:] = False
+    return starts
+
+
+def replay_grid_move(records, config, render, fps):
+    from grid_move import GridMove
+    import pygame
+    gm = GridMove(config['obstacle_states'], config['goal_state'], max_gens=1, gamma=0, learning_rate=0,
+                  random_factor=0, rows=config['rows'], columns=config['columns'], headless=not render)
+    clock = pygame.time.Clock() if render else None
+
+    mismatches = 0
+    starts = episode_starts(records)
+    replayed = 0
+    for i, (_, state, action) in enumerate(records.tolist()):
+        if replayed != state:
+            mismatches += not starts[i]
+        replayed = gm.step(state, action)
+        if render:
+            gm.player_position = gm.location_from_state(replayed)
+            gm.draw()
+            clock.tick(fps)
+    return mismatches
+
+
+def replay_flappybird(records, config, render, fps):
+    from flappybird import FlappyBird
+    from course import Course
+    import pygame
+    fb = FlappyBird(max_gens=1, headless=not render,
+                    course=Course(**config['course']) if config['course'] is not None else None)
+    if render:
+        pygame.font.init()
+        font = pygame.font.SysFont("Arial", 50)
+        clock = pygame.time.Clock()
+
+    fields = ('birdY', 'jump', 'jumpSpeed', 'gravity', 'wallx', 'offset', 'counter', 'dead')
+    mismatches = 0
+    starts = episode_starts(records)
+    for i, (_, action, dead, birdY, jump, jumpSpeed, gravity, wallx, offset, counter) in enumerate(
+            records.tolist()):
+        recorded = (birdY, jump, jumpSpeed, gravity, wallx, offset, counter, dead)
+        if not starts[i]:
+            fb.updateWalls()
+            fb.birdUpdate()
+            if action == FLAP:
+                fb.flap()
+            elif action == JUMP_IN_PLACE:
+                birdY = fb.birdY
+                fb.take_action(1)
+                fb.birdY = birdY
+            elif action != NO_ACTION:
+                fb.take_action(action)
+        if tuple(getattr(fb, name) for name in fields) != recorded:
+            mismatches += not starts[i]
+            for name, value in zip(fields, recorded):
+                setattr(fb, name, value)
+            fb.bird[1] = int(fb.birdY)
+        if render:
+            fb.draw_train(font)
+            pygame.display.update()
+            clock.tick(fps)
+    return mismatches
+
+
+def replay_flappy_bird_khaume(records, config, render, fps):
+    from flappy_bird import FlappyBird
+    from course import Course
+    from dirty_renderer import DirtyRenderer
+    import pygame
+    fb = FlappyBird(course=Course(**config['course']), wall_spacing=config['wall_spacing'], headless=not render)
+    if render:
+        renderer = DirtyRenderer(fb.screen, fb.background)
+        clock = pygame.time.Clock()
+
+    fields = ('birdy', 'jump', 'jumpspeed', 'gravity', 'distance')
+    mismatches = 0
+    for i, (action, birdy, jump, jumpspeed, gravity, distance) in enumerate(records.tolist()):
+        recorded = (birdy, jump, jumpspeed, gravity, distance)
+        if i:
+            fb.update_bird()
+            fb.update_walls()
+            if action:
+                fb.flap()
+        if tuple(getattr(fb, name) for name in fields) != recorded:
+            mismatches += i > 0
+            for name, value in zip(fields, recorded):
+                setattr(fb, name, value)
+        if render:
+            fb.draw(renderer, fb.distance, fb.birdy)
+            clock.tick(fps)
+    return mismatches
+
+
+REPLAYS = dict(grid_move=replay_grid_move, flappybird=replay_flappybird, flappy_bird_khaume=replay_flappy_bird_khaume)
+
+
+def replay(path, render=False, fps=60):
+    # Play a trajectory file again through the physics of its game, headless as fast as possible or drawn at fps
+    # frames per second (0 for no limit). Every recorded state is compared with the replayed one, and replaying
+    # continues from the recorded state where they differ.
+    # Returns the number of steps, episodes and mismatching steps, and the wall time.
+    game, config, records = load_trajectory(path)
+    if game not in REPLAYS:
+        raise ValueError('{} holds {}, which can not be replayed'.format(path, game))
+    start = time.perf_counter()
+    mismatches = REPLAYS[game](records, config, render, fps)
+    return dict(game=game, steps=len(records), episodes=int(episode_starts(records).sum()) if len(records) else 0,
+                mismatches=mismatches, wall_time=time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded trajectory file.')
+    parser.add_argument('path')
+    parser.add_argument('--render', action='store_true', help='Draw the replay instead of running it headless.')
+    parser.add_argument('--fps', type=int, default=60, help='Frames per second when drawing, 0 for no limit.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        parser.error('{} does not exist'.format(args.path))
+    result = replay(args.path, args.render, args.fps)
+    print('{game}: {steps} steps, {episodes} episodes, {mismatches} mismatches in {wall_time:.2f}s'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 import pygame
+import os
 import sys
-import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from dirty_renderer import DirtyRenderer  # noqa: E402
+from asset_cache import load_image, load_atlas  # noqa: E402
+from fixed_timestep import FixedTimestep, interpolate  # noqa: E402
+from course import Course  # noqa: E402
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
 
 
 black = 0, 0, 0
@@ -9,53 +17,90 @@ blue = 0, 20, 200
 green = 0, 200, 0
 
 class FlappyBird:
-    def __init__(self):
-
-        pygame.init()
-        pygame.font.init()
+    def __init__(self, rng=None, course=None, wall_spacing=250, headless=False, recorder=None):
 
         self.size = self.width, self.height = 400, 708
-        self.screen = pygame.display.set_mode(self.size)
-        self.background = pygame.image.load("assets/background.png").convert()
 
-        self.birdsprites = [pygame.image.load("assets/1.png"),
-                            pygame.image.load("assets/2.png"),
-                            pygame.image.load("assets/dead.png")]
+        # In headless mode no window is opened and no assets are loaded, e.g. to replay a recording at full speed.
+        self.headless = headless
+        if not self.headless:
+            pygame.init()
+            pygame.font.init()
 
-        self.wallsprites = [pygame.image.load("assets/bottom.png"),
-                            pygame.image.load("assets/top.png")]
+            self.screen = pygame.display.set_mode(self.size)
+            self.background = load_image(os.path.join(ASSET_DIR, "background.png"), alpha=False)
 
-        self.bird = pygame.Surface((30, 30))
-        self.bird.fill(green)
+            # The sprites are converted to the display format and share one atlas.
+            sprites = load_atlas([os.path.join(ASSET_DIR, name)
+                                  for name in ("1.png", "2.png", "dead.png", "bottom.png", "top.png")])
 
-        self.gap = 120
-        self.wallheight = 500
+            self.birdsprites = sprites[:3]
 
-        self.wallx = self.width-100
+            self.wallsprites = sprites[3:]
 
-        self.birdy = self.height/2
+            self.bird = pygame.Surface((30, 30))
+            self.bird.fill(green)
 
-        self.center = self.height / 2
+        self.gap = 120
+        self.wallheight = 500
+        self.wallwidth = 100
 
-        self.walltopup = self.center - self.gap / 2 - self.wallheight
-        self.walltopdown = self.center + self.gap/2
+        self.birdx = self.width/2
+        self.birdy = self.height/2
 
         self.gravity = 5
         self.jump = 17
         self.jumpspeed = 10
 
+        # The gap centers of the walls come from a course, created from a seed or given directly, so the same
+        # course can be played again. Wall i is at firstwallx + i * wall_spacing - distance, where distance is how
+        # far the walls have scrolled, so the walls never have to be stored, scanned or moved one by one.
+        self.course = course if course is not None else Course(250, 550, seed=rng)
+        self.wall_spacing = wall_spacing
+        self.firstwallx = self.width-100
+        self.distance = 0
+
+        # If a TrajectoryRecorder is given, every tick of run is appended to it, to be replayed with
+        # trajectory.replay.
+        self.recorder = recorder
+        if self.recorder is not None:
+            self.recorder.start('flappy_bird_khaume', dict(course=self.course.config(), wall_spacing=wall_spacing))
+
     def update_walls(self):
-        self.wallx -= 2
-        if self.wallx < - 100:
-            self.wallx = self.width
+        self.distance += 2
+
+    def wall_x(self, i, distance=None):
+        distance = self.distance if distance is None else distance
+        return self.firstwallx + i * self.wall_spacing - distance
+
+    def wall_tops(self, i):
+        # The y positions of the top and bottom wall of wall i.
+        center = self.course.gap(i)
+        return center - self.gap / 2 - self.wallheight, center + self.gap / 2
 
-            self.center = random.randint(250, 550)
+    def visible_walls(self, distance=None):
+        # The indices of the walls on the screen.
+        distance = self.distance if distance is None else distance
+        first = max(0, -((self.firstwallx + self.wallwidth - distance) // self.wall_spacing))
+        last = (distance + self.width - self.firstwallx) // self.wall_spacing
+        return range(int(first), int(last) + 1)
 
-            self.walltopup = self.center - self.gap / 2 - self.wallheight
-            self.walltopdown = self.center + self.gap / 2
+    def next_wall(self):
+        # The index of the first wall whose right edge is not yet past the bird.
+        return max(0, -int((self.firstwallx + self.wallwidth - self.distance - self.birdx) // self.wall_spacing))
 
+    def state(self):
+        # Horizontal distance from the bird to the next wall, and height of the bird above its gap center.
+        i = self.next_wall()
+        return self.wall_x(i) - self.birdx, self.course.gap(i) - self.birdy
 
 
+
+    def flap(self):
+        self.jump = 17
+        self.gravity = 5
+        self.jumpspeed = 10
+
     def update_bird(self):
         if self.jump:
             self.jumpspeed -= 1
@@ -70,35 +115,54 @@ class FlappyBird:
             self.gravity = 0.5
 
 
-    def run(self):
+    def run(self, frame_rate=60, tick_rate=60, speed=1.0):
+        # The physics run at tick_rate ticks per second of game time, speed times faster than real time, and frames
+        # are drawn at most frame_rate times per second, interpolated between the last two ticks.
         clock = pygame.time.Clock()
+
+        # Only the walls and the bird are redrawn every frame.
+        renderer = DirtyRenderer(self.screen, self.background)
+
+        timestep = FixedTimestep(tick_rate, speed)
+        previous_distance, previous_birdy = self.distance, self.birdy
+        # Whether the bird jumped since the last tick, for the recorder.
+        flapped = False
         while True:
-            clock.tick(60)
+            clock.tick(frame_rate)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     sys.exit()
 
                 if event.type == pygame.KEYDOWN:
-                    self.jump = 17
-                    self.gravity = 5
-                    self.jumpspeed = 10
+                    self.flap()
+                    flapped = True
+
+            for _ in range(timestep.advance()):
+                if self.recorder is not None:
+                    self.recorder.append((flapped, self.birdy, self.jump, self.jumpspeed, self.gravity,
+                                          self.distance))
+                flapped = False
+                previous_distance, previous_birdy = self.distance, self.birdy
+                self.update_bird()
+                self.update_walls()
+
+            # The bird being reset is not interpolated.
+            distance = interpolate(previous_distance, self.distance, timestep.alpha)
+            birdy = interpolate(previous_birdy, self.birdy, timestep.alpha, max_jump=100)
+            self.draw(renderer, distance, birdy)
+
+    def draw(self, renderer, distance, birdy):
+        for i in self.visible_walls(distance):
+            walltopup, walltopdown = self.wall_tops(i)
+            renderer.draw('walltop {}'.format(i), self.wallsprites[1], (self.wall_x(i, distance), walltopup))
+            renderer.draw('wallbottom {}'.format(i), self.wallsprites[0], (self.wall_x(i, distance), walltopdown))
 
+        if self.jump:
+            renderer.draw('bird', self.birdsprites[1], (self.birdx, birdy))
+        else:
+            renderer.draw('bird', self.birdsprites[0], (self.birdx, birdy))
 
-            self.screen.fill(black)
-            self.screen.blit(self.background, (0, 0))
-
-            self.screen.blit(self.wallsprites[1], (self.wallx, self.walltopup))
-            self.screen.blit(self.wallsprites[0], (self.wallx, self.walltopdown))
-
-            if self.jump:
-                self.screen.blit(self.birdsprites[1], (self.width/2, self.birdy))
-            else:
-                self.screen.blit(self.birdsprites[0], (self.width/2, self.birdy))
-
-            self.update_bird()
-            self.update_walls()
-
-            pygame.display.update()
+        renderer.update()
 
 if __name__ == '__main__':
     FlappyBird().run()
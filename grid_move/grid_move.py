@@ -1,9 +1,20 @@
 import numpy as np
 import pygame
-import random
+import os
 import sys
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from q_table import QTable  # noqa: E402
+from q_storage import DenseQ, storage_config, storage_from_config  # noqa: E402
+from convergence import ConvergenceTracker  # noqa: E402
+from metrics import MetricsSink  # noqa: E402
+from checkpoint import save_checkpoint, load_checkpoint, load_checkpoint_meta  # noqa: E402
+from asset_cache import load_image  # noqa: E402
+from profiler import PhaseProfiler, SIMULATE, LEARN, RENDER, IO  # noqa: E402
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # Global colors
 BLACK = 0, 0, 0
 WHITE = 255, 255, 255
@@ -11,33 +22,59 @@ RED = 255, 0, 0
 BLUE = 0, 0, 255
 GREEN = 0, 255, 0
 
-STATE_CHANGE_FROM_ACTION = {0: -5,  # Move up
-                            1: 5,  # Move down
-                            2: -1,  # Move left
-                            3: 1}  # Move right
+# Actions: 0 moves up, 1 down, 2 left and 3 right.
+NUM_ACTIONS = 4
 
-STATE_NUM = 25  # Number of states
+# Size in pixels of a field on the board, and the offset of the player inside a field.
+FIELD_SIZE = 100
+PLAYER_OFFSET = 30
 
 
 class GridMove:
     """
-    Class for a small game of moving around on a board while trying to reach a goal field (state).
+    Class for a game of moving around on a board while trying to reach a goal field (state).
     The game is mainly intended for applying a Q learning algorithm, which trains itself using the Bellman equation.
 
-    :param obs_1_state:     The state on the board with the first obstacle.
-    :param obs_2_state:     The state on the board with the second obstacle.
-    :param goal_state:      The state on the board with the goal state.
+    States are numbered row by row, so the state of the field in row r and column c is r * columns + c. Obstacles
+    and goals are kept as boolean masks over the board, and the reward matrix as a float32 array with shape
+    (rows * columns, NUM_ACTIONS). The Q values are kept in a QStorage with the state number as the only feature,
+    by default a DenseQ whose float32 array of the same shape is GridMove.Q.
+
+    :param obstacle_states: The states on the board with an obstacle.
+    :param goal_state:      The state on the board with the goal state, or a list of goal states.
     :param max_gens:        The maximum number of generations to run during training.
     :param gamma:           Bellman equation value for gamma.
     :param learning_rate:   Bellman equation value for learning rate (alpha).
     :param random_factor:   Bellman equation value for the probability of taking a random move (not the best move)
                             during training.
+    :param rows:            The number of rows on the board.
+    :param columns:         The number of columns on the board.
+    :param headless:        If True, no window is opened and nothing is drawn.
+    :param rng:             Seed or numpy.random.Generator for all random choices, so runs can be repeated exactly.
+    :param stop_threshold:  Stop training early when the norm diff of stop_patience generations in a row is below
+                            this value. None always trains for max_gens generations.
+    :param stop_patience:   The number of generations used by stop_threshold.
+    :param metrics:         MetricsSink that receives a record for every generation.
+    :param profiler:        PhaseProfiler that times the phases of train_run. None creates a disabled one.
+    :param recorder:        TrajectoryRecorder that every move is appended to, to be replayed with trajectory.replay.
+    :param q_storage:       QStorage for the Q values, e.g. a HashedQ(1, NUM_ACTIONS). None creates a DenseQ.
     """
 
-    def __init__(self, obs_1_state, obs_2_state, goal_state, max_gens, gamma, learning_rate, random_factor):
+    def __init__(self, obstacle_states, goal_state, max_gens, gamma, learning_rate, random_factor, rows=5, columns=5,
+                 headless=False, rng=None, stop_threshold=None, stop_patience=1, metrics=None, profiler=None,
+                 recorder=None, q_storage=None):
+        # Set the board.
+        self.rows = rows
+        self.columns = columns
+        self.state_num = rows * columns
+        self.state_change = np.array([-columns, columns, -1, 1])
+
         # Set obstacles and goal.
-        self.obs_1_state = obs_1_state
-        self.obs_2_state = obs_2_state
+        self.obstacle_mask = np.zeros((rows, columns), dtype=bool)
+        self.obstacle_mask.flat[obstacle_states] = True
+        self.goal_mask = np.zeros((rows, columns), dtype=bool)
+        self.goal_mask.flat[goal_state] = True
+        self.obstacle_states = np.flatnonzero(self.obstacle_mask)
         self.goal_state = goal_state
 
         # Set training variables. max_gens is the number of generations to train on.
@@ -48,6 +85,17 @@ class GridMove:
         self.gamma = gamma
         self.learning_rate = learning_rate
         self.random_factor = random_factor
+        self.rng = np.random.default_rng(rng)
+
+        # Generation records are buffered here instead of printed.
+        self.metrics = metrics if metrics is not None else MetricsSink()
+        self.profiler = profiler if profiler is not None else PhaseProfiler()
+
+        # Every move is recorded with the state it starts from, together with the board it is replayed on.
+        self.recorder = recorder
+        if self.recorder is not None:
+            self.recorder.start('grid_move', dict(obstacle_states=self.obstacle_states, goal_state=goal_state,
+                                                  rows=rows, columns=columns))
 
         # Counters to keep track of generation and number of steps taken.
         self.gen_counter = 0
@@ -58,116 +106,130 @@ class GridMove:
 
         # Array for recording performance for each generation.
         self.performance_array = np.zeros((self.max_gens, 1))
-        self.history_array = np.zeros((STATE_NUM, 1))
+        self.history_array = np.zeros((self.state_num, 1))
         self.norm_diff_array = np.zeros((self.max_gens, 1))
 
-        # Set screen.
-        self.width, self.height = 500, 500
-        self.screen = pygame.display.set_mode((self.width, self.height))
-        self.background = pygame.image.load('background.png')
-
         # Set player.
-        self.player = pygame.image.load('0.png')
-        self.player_position = [30, 30]
-
-        # Set obstacles.
-        self.obstacle = [pygame.Surface((100, 100)),
-                         pygame.Surface((100, 100))]
-        self.obstacle[0].fill(RED)
-        self.obstacle[1].fill(BLUE)
-        self.obstacle_positions = [self.location_from_state(obs_1_state, field=True),
-                                   self.location_from_state(obs_2_state, field=True)]
-
-        # Set goal.
-        self.goal = pygame.Surface((100, 100))
-        self.goal.fill(GREEN)
-        self.goal_position = self.location_from_state(goal_state, field=True)
-
-        # Initialize reward and Q matrices.
-        self.Q = np.zeros((25, 4))
-        self.R = np.zeros((25, 4))
+        self.player_position = [PLAYER_OFFSET, PLAYER_OFFSET]
+
+        # Set screen, player, obstacles and goal.
+        self.headless = headless
+        if not self.headless:
+            self.width, self.height = columns * FIELD_SIZE, rows * FIELD_SIZE
+            self.screen = pygame.display.set_mode((self.width, self.height))
+            self.background = load_image(os.path.join(ASSET_DIR, 'background.png'), alpha=False)
+            if self.background.get_size() != (self.width, self.height):
+                self.background = pygame.transform.scale(self.background, (self.width, self.height))
+
+            self.player = load_image(os.path.join(ASSET_DIR, '0.png'))
+
+            self.obstacle = [pygame.Surface((FIELD_SIZE, FIELD_SIZE)),
+                             pygame.Surface((FIELD_SIZE, FIELD_SIZE))]
+            self.obstacle[0].fill(RED)
+            self.obstacle[1].fill(BLUE)
+            self.obstacle_positions = [self.location_from_state(obs_state, field=True)
+                                       for obs_state in self.obstacle_states]
+
+            self.goal = pygame.Surface((FIELD_SIZE, FIELD_SIZE))
+            self.goal.fill(GREEN)
+            self.goal_positions = [self.location_from_state(state, field=True)
+                                   for state in np.flatnonzero(self.goal_mask)]
+
+        # Initialize reward matrix and Q values.
+        self.q_storage = q_storage if q_storage is not None else DenseQ((self.state_num,), NUM_ACTIONS, np.float32)
+        if self.q_storage.num_actions != NUM_ACTIONS:
+            raise ValueError('q_storage has {} actions, expected {}'.format(self.q_storage.num_actions, NUM_ACTIONS))
+        self.R = np.zeros((self.state_num, NUM_ACTIONS), dtype=np.float32)
+
+        # Find which actions stay on the board, and the state each action leads to.
+        row, column = np.divmod(np.arange(self.state_num), columns)
+        on_board = np.stack([row > 0, row < rows - 1, column > 0, column < columns - 1], axis=1)
+        states = np.arange(self.state_num)[:, None]
+        self.next_states = np.where(on_board, states + self.state_change, states)
 
         # Adding rewards for goal and obstacles.
-        for key in STATE_CHANGE_FROM_ACTION.keys():
+        # Actions that lead to the goal give 100 reward, actions that lead to an obstacle -100.
+        self.R[on_board & self.goal_mask.ravel()[self.next_states]] = 100
+        self.R[on_board & self.obstacle_mask.ravel()[self.next_states]] = -100
 
-            # For goal.
-            # Make all the states around the goal give 100 reward for actions that lead to the goal state, but only
-            # if they are inside the board (between [0 ; STATE_NUM[
-            if (0 <= goal_state - STATE_CHANGE_FROM_ACTION[key]) and \
-                    (goal_state - STATE_CHANGE_FROM_ACTION[key] < STATE_NUM):
-                self.R[goal_state - STATE_CHANGE_FROM_ACTION[key], key] = 100
+        # Set reward of -1 for actions that lead outside the board.
+        self.R[~on_board] = -1
 
-            # For obstacles.
-            # Like for goal but -100 for states around the obstacles.
-            for obs_state in [obs_1_state, obs_2_state]:
+        # Keep track of the norm of Q as single entries change, and decide when training has converged.
+        self.tracker = ConvergenceTracker(self.q_storage.weights, stop_threshold, stop_patience)
 
-                if (0 <= obs_state - STATE_CHANGE_FROM_ACTION[key]) and \
-                        (obs_state - STATE_CHANGE_FROM_ACTION[key] < STATE_NUM):
-                    self.R[obs_state - STATE_CHANGE_FROM_ACTION[key], key] = -100
+    @property
+    def Q(self):
+        # The Q matrix, shape (state_num, NUM_ACTIONS). For a DenseQ this is its array, for other stores a copy of
+        # the values of every state.
+        if isinstance(self.q_storage, DenseQ):
+            return self.q_storage.Q
+        return self.q_storage.values(np.arange(self.state_num)[:, None])
 
-        # Set reward of -1 for actions that lead outside the board.
-        # Top.
-        for i in range(5):
-            self.R[i, 0] = -1
-        # Left.
-        for i in range(0, 25, 5):
-            self.R[i, 2] = -1
-        # Right.
-        for i in range(4, 25, 5):
-            self.R[i, 3] = -1
-        # Bottom.
-        for i in range(20, 25):
-            self.R[i, 1] = -1
-
-    @staticmethod
-    def state_from_position(position):
+    def state_from_position(self, position):
         # Get the state from a position.
         # First find the matrix indices on the board. Example: 230, 330 --> 2, 3
-        player_index = [(position[0] - 30) // 100,
-                        (position[1] - 30) // 100]
+        player_index = [(position[0] - PLAYER_OFFSET) // FIELD_SIZE,
+                        (position[1] - PLAYER_OFFSET) // FIELD_SIZE]
 
-        # Then find the state number from the indices. Example 2, 3 --> 17
-        player_state = player_index[1] * 5 + player_index[0]
+        # Then find the state number from the indices. Example on a 5x5 board: 2, 3 --> 17
+        player_state = player_index[1] * self.columns + player_index[0]
 
         return player_state
 
-    @staticmethod
-    def location_from_state(state, field=False):
+    def location_from_state(self, state, field=False):
         # Find the location from a state.
-        # Example: 17 --> 2, 3
-        player_index = [state % 5,
-                        state // 5]
+        # Example on a 5x5 board: 17 --> 2, 3
+        player_index = [state % self.columns,
+                        state // self.columns]
 
         # Example: 2, 3 --> 230, 330
-        position = [player_index[0] * 100 + 30,
-                    player_index[1] * 100 + 30]
+        position = [player_index[0] * FIELD_SIZE + PLAYER_OFFSET,
+                    player_index[1] * FIELD_SIZE + PLAYER_OFFSET]
 
         # If field=True, then we are finding the position for an obstacle or the goal, and we want the upper
         # left corner of the state, so we subtract 30, 30
         if field:
-            position[0] -= 30
-            position[1] -= 30
+            position[0] -= PLAYER_OFFSET
+            position[1] -= PLAYER_OFFSET
 
         return position
 
     def move(self, direction):
         # Adjust the player_position after making a move, if that will not move the player outside the board.
+        if self.recorder is not None:
+            self.recorder.append((self.gen_counter, self.state_from_position(self.player_position), direction))
+        self.player_position = self.moved_position(self.player_position, direction)
+
+    def moved_position(self, position, direction):
+        # The position after a move from position, which stays the same if the move would leave the board.
+        position = list(position)
 
         # Keypress w, up
-        if direction == 0 and self.player_position[1] > 100:
-            self.player_position[1] -= 100
+        if direction == 0 and position[1] > FIELD_SIZE:
+            position[1] -= FIELD_SIZE
 
         # Keypress s, down
-        elif direction == 1 and self.player_position[1] < 400:
-            self.player_position[1] += 100
+        elif direction == 1 and position[1] < (self.rows - 1) * FIELD_SIZE:
+            position[1] += FIELD_SIZE
 
         # Keypress a, left
-        elif direction == 2 and self.player_position[0] > 100:
-            self.player_position[0] -= 100
+        elif direction == 2 and position[0] > FIELD_SIZE:
+            position[0] -= FIELD_SIZE
 
         # Keypress d, right
-        elif direction == 3 and self.player_position[0] < 400:
-            self.player_position[0] += 100
+        elif direction == 3 and position[0] < (self.columns - 1) * FIELD_SIZE:
+            position[0] += FIELD_SIZE
+
+        return position
+
+    def step(self, state, direction):
+        # The state a move from state leaves the player in after move and check_win_loss, so 0 if it reaches a goal
+        # or an obstacle. Unlike them it changes nothing in the game: nothing is recorded or counted as a generation.
+        next_state = self.state_from_position(self.moved_position(self.location_from_state(state), direction))
+        if self.goal_mask.flat[next_state] or self.obstacle_mask.flat[next_state]:
+            return 0
+        return next_state
 
     def record_state(self):
         # Record number of visits to each possible state.
@@ -176,8 +238,10 @@ class GridMove:
     def check_win_loss(self):
         # Check if the player is on a goal or obstacle and update performance and norm diff arrays.
 
+        player_state = self.state_from_position(self.player_position)
+
         # If on goal.
-        if self.state_from_position(self.player_position) == self.goal_state:
+        if self.goal_mask.flat[player_state]:
             self.norm_diff = abs(self.previous_norm - self.current_norm)
 
             # Reset player position and increment the counter and update performance array
@@ -185,55 +249,59 @@ class GridMove:
             self.gen_counter += 1
             self.performance_array[self.gen_counter - 1] = self.step_counter
             self.norm_diff_array[self.gen_counter - 1] = self.norm_diff
-
-            print('norm diff: ', self.norm_diff, ' at generation: ', self.gen_counter, ' after steps: ',
-                  self.step_counter)
-            print(np.array_str(self.Q, precision=3, suppress_small=True))
+            self.metrics.episode(generation=self.gen_counter, steps=self.step_counter, norm_diff=self.norm_diff,
+                                 max_delta=self.tracker.max_delta)
+            self.tracker.end_episode(self.norm_diff)
 
             # Reset step_counter.
             self.step_counter = 0
 
         # If on obstacles.
-        for obstacle_state in [self.obs_1_state, self.obs_2_state]:
-            if self.player_position == self.location_from_state(obstacle_state):
-                # Reset player position.
-                self.player_position = self.location_from_state(0)
+        if self.obstacle_mask.flat[player_state]:
+            # Reset player position.
+            self.player_position = self.location_from_state(0)
 
-    def train_run(self):
+    def train_run(self, checkpoint_path=None, checkpoint_every=100):
         # In this method, the Q learning algorithm will update the Q matrix while the player moves around in a
         # greedy manner. To begin with it is random, but quickly the Q matrix will provide a preference in the
         # direction. self.random_factor provides a fraction of the moves that is random, to help escaping local
         # minima.
+        # If checkpoint_path is given, a checkpoint is saved there every checkpoint_every generations and at the end.
 
-        clock = pygame.time.Clock()
+        if not self.headless:
+            clock = pygame.time.Clock()
+        last_checkpoint = self.gen_counter
 
-        while self.gen_counter < self.max_gens:
+        while self.gen_counter < self.max_gens and not self.tracker.converged:
             # while self.norm_diff > 0.51:
             # Set the FPS of the game.
-            clock.tick(80)
+            if not self.headless:
+                clock.tick(80)
 
             self.step_counter += 1
 
+            self.profiler.start(LEARN)
             player_state = self.state_from_position(self.player_position)
 
             # Chance to pick random move, otherwise pick based on max Q.
-            if random.uniform(0, 1) < self.random_factor:
+            if self.rng.random() < self.random_factor:
                 # Take random action from the currently possible moves.
                 action_list = np.argwhere(self.R[player_state] >= 0).flatten().tolist()
 
                 # Shuffle the list to avoid always picking the lowest action.
-                action_list = random.sample(action_list, len(action_list))
+                action_list = self.rng.permutation(action_list).tolist()
 
             else:
                 # Find the max Q value, meaning for the current state, what is the maximum
                 # value possible taking any action.
-                max_Q = np.max(self.Q[player_state])
+                Q_values = self.q_storage.row((player_state,))
+                max_Q = np.max(Q_values)
 
                 # Find the moves which have this value. We make a list of these moves, because there may be more
                 # than one move which has same max Q value.
                 # This is especially the case in the beginning when max Q is zero almost everywhere.
-                action_list = np.argwhere(self.Q[player_state] == max_Q).flatten().tolist()
-                action_list = random.sample(action_list, len(action_list))
+                action_list = np.argwhere(Q_values == max_Q).flatten().tolist()
+                action_list = self.rng.permutation(action_list).tolist()
 
             # Evaluate the potential moves from the action_list.
             state_change = None
@@ -242,35 +310,219 @@ class GridMove:
 
                 # In case of bad move, update Q and continue.
                 if self.R[player_state][action] == -1:
-                    self.Q[player_state][action] = -1
+                    self.set_Q(player_state, action, -1)
                     continue
 
                 else:
-                    state_change = STATE_CHANGE_FROM_ACTION[action]
+                    state_change = self.state_change[action]
                     break
 
+            # All best moves lead off the board, e.g. when the others lead onto obstacles, or a store that shares
+            # values between states moved them below -1. Take the best move that stays on the board.
+            if state_change is None:
+                on_board = np.flatnonzero(self.R[player_state] != -1)
+                action = int(on_board[np.argmax(self.q_storage.row((player_state,))[on_board])])
+                state_change = self.state_change[action]
+
             # Update the next_state and update the Q matrix according to the Bellman equation.
             next_state = player_state + state_change
-            max_Q = np.max(self.Q[next_state])
-            self.Q[player_state][action] = (1 - self.learning_rate) * self.Q[player_state][action] + \
-                                           self.learning_rate * (self.R[player_state][action] + self.gamma * max_Q)
+            max_Q = np.max(self.q_storage.row((next_state,)))
+            self.set_Q(player_state, action, (1 - self.learning_rate) * self.q_storage.row((player_state,))[action] +
+                       self.learning_rate * (self.R[player_state][action] + self.gamma * max_Q))
 
             # Update the previous and current norm values.
-            self.previous_norm = self.current_norm
-            self.current_norm = np.linalg.norm(self.Q)
+            self.tracker.step()
+            self.previous_norm = self.tracker.previous_norm
+            self.current_norm = self.tracker.current_norm
+            self.profiler.stop()
 
+            self.profiler.start(SIMULATE)
             self.move(action)
             self.record_state()
             self.check_win_loss()
-
-            self.screen.blit(self.background, (0, 0))
-            self.screen.blit(self.obstacle[0], (self.obstacle_positions[0]))
-            self.screen.blit(self.obstacle[1], (self.obstacle_positions[1]))
-            self.screen.blit(self.goal, self.goal_position)
-            self.screen.blit(self.player, (self.player_position[0], self.player_position[1],))
-
-            pygame.display.update()
-
+            self.profiler.stop()
+
+            if not self.headless:
+                self.profiler.start(RENDER)
+                self.draw()
+                self.profiler.stop()
+
+            if checkpoint_path is not None and self.gen_counter >= last_checkpoint + checkpoint_every:
+                self.profiler.start(IO)
+                self.save(checkpoint_path)
+                self.profiler.stop()
+                last_checkpoint = self.gen_counter
+
+        self.trim_arrays()
+        self.profiler.start(IO)
+        if self.recorder is not None:
+            self.recorder.flush()
+        if checkpoint_path is not None:
+            self.save(checkpoint_path)
+        self.profiler.stop()
+
+    def train_batch_run(self, batch_size):
+        # Train with batch_size players moving around at the same time. Every step the transitions of all players
+        # are applied to the Q matrix in one batched update, and nothing is drawn. As in train_run, random moves
+        # avoid all negative rewards while greedy moves only avoid leaving the board.
+        q_table = QTable(self.q_storage, self.gamma, self.learning_rate, rng=self.rng, state_shape=(self.state_num,))
+
+        player_states = np.zeros(batch_size, dtype=int)
+        step_counters = np.zeros(batch_size, dtype=int)
+
+        while self.gen_counter < self.max_gens and not self.tracker.converged:
+            rewards = self.R[player_states]
+            actions = q_table.select_actions(player_states, self.random_factor,
+                                             allowed=rewards != -1, random_allowed=rewards >= 0)
+            next_states = self.next_states[player_states, actions]
+            old_values, new_values = q_table.update(player_states, actions, rewards[np.arange(batch_size), actions],
+                                                    next_states)
+
+            self.tracker.change(old_values, new_values)
+            self.norm_diff = self.tracker.step()
+            self.previous_norm = self.tracker.previous_norm
+            self.current_norm = self.tracker.current_norm
+
+            np.add.at(self.history_array[:, 0], next_states, 1)
+            step_counters += 1
+
+            # Record the players that reached the goal, as many as there are generations left.
+            won = self.goal_mask.ravel()[next_states]
+            won_steps = step_counters[won][:self.max_gens - self.gen_counter]
+            self.performance_array[self.gen_counter:self.gen_counter + len(won_steps), 0] = won_steps
+            self.norm_diff_array[self.gen_counter:self.gen_counter + len(won_steps), 0] = self.norm_diff
+            for steps in won_steps:
+                self.gen_counter += 1
+                self.metrics.episode(generation=self.gen_counter, steps=steps, norm_diff=self.norm_diff,
+                                     max_delta=self.tracker.max_delta)
+                self.tracker.end_episode(self.norm_diff)
+
+            # Players on the goal or an obstacle start over.
+            step_counters[won] = 0
+            player_states = np.where(won | self.obstacle_mask.ravel()[next_states], 0, next_states)
+
+        self.trim_arrays()
+
+    def set_Q(self, state, action, value):
+        # Set an entry of the Q matrix and keep the norm tracker up to date.
+        self.tracker.change(*self.q_storage.set_value((state,), action, value))
+
+    def transition_table(self):
+        # The state reached by every action from every state, shape (state_num, NUM_ACTIONS). Actions that lead
+        # outside the board (reward -1) keep the player in place.
+        return self.next_states
+
+    def solve(self, tolerance=1e-6, max_iterations=10000):
+        # Find the Q matrix that train_run converges to directly with value iteration over the full reward model,
+        # using the same gamma. Like in training, actions leading outside the board are worth -1 and the value of a
+        # move is its reward plus gamma times the best Q value of the state it leads to. The player starts over on
+        # a goal or an obstacle, so their Q rows stay 0 in training and moves onto them are worth only their reward.
+        # Returns the number of iterations and the largest change in the last iteration.
+        next_states = self.transition_table()
+        valid = self.R != -1
+        terminal_states = (self.goal_mask | self.obstacle_mask).ravel()
+        terminal = terminal_states[next_states]
+
+        Q = np.zeros_like(self.R)
+        residual = np.inf
+        iteration = 0
+        while residual > tolerance and iteration < max_iterations:
+            iteration += 1
+            new_Q = np.where(valid & ~terminal, self.R + self.gamma * Q.max(axis=1)[next_states], self.R)
+            new_Q[terminal_states] = 0
+            residual = np.max(np.abs(new_Q - Q))
+            Q = new_Q
+
+        self.q_storage.set_values(np.arange(self.state_num)[:, None], Q)
+        self.tracker.recompute(self.q_storage.weights)
+        return iteration, residual
+
+    def policy(self):
+        # The greedy action for every state according to the Q matrix.
+        return np.argmax(self.Q, axis=1)
+
+    def save(self, path):
+        # Save the Q matrix, hyperparameters, counters and random generator state to a checkpoint directory. A store
+        # other than DenseQ is saved as well, and Q is only a copy of its values for tools that read the matrix.
+        dense = isinstance(self.q_storage, DenseQ)
+        save_checkpoint(path,
+                        dict(Q=self.Q,
+                             history_array=self.history_array,
+                             performance_array=self.performance_array,
+                             norm_diff_array=self.norm_diff_array,
+                             **({} if dense else {'q_storage_' + name: array
+                                                  for name, array in self.q_storage.arrays().items()})),
+                        dict(obstacle_states=self.obstacle_states,
+                             goal_state=self.goal_state,
+                             rows=self.rows,
+                             columns=self.columns,
+                             max_gens=self.max_gens,
+                             gamma=self.gamma,
+                             learning_rate=self.learning_rate,
+                             random_factor=self.random_factor,
+                             stop_threshold=self.tracker.stop_threshold,
+                             stop_patience=self.tracker.stop_patience,
+                             gen_counter=self.gen_counter,
+                             step_counter=self.step_counter,
+                             player_position=self.player_position,
+                             norm_diff=self.norm_diff,
+                             previous_norm=self.previous_norm,
+                             current_norm=self.current_norm,
+                             squared_norm=self.tracker.squared_norm,
+                             converged_episodes=self.tracker.converged_episodes,
+                             rng_state=self.rng.bit_generator.state,
+                             q_storage=None if dense else storage_config(self.q_storage)))
+
+    def load(self, path, mmap_mode=None):
+        # Resume from a checkpoint saved with save. The board must have the same size as the one of the checkpoint.
+        # With mmap_mode='r' the Q matrix of a DenseQ is memory-mapped read-only, so large tables open instantly and
+        # can be shared by several processes, but can not be trained further. Other stores are read into memory.
+        arrays, meta = load_checkpoint(path, mmap_mode)
+        if arrays['Q'].shape != self.R.shape:
+            raise ValueError('Checkpoint Q matrix has shape {}, expected {}'.format(arrays['Q'].shape, self.R.shape))
+
+        if meta.get('q_storage') is None:
+            self.q_storage = DenseQ.from_array(arrays['Q'])
+        else:
+            self.q_storage = storage_from_config(meta['q_storage'])
+            self.q_storage.restore({name[len('q_storage_'):]: np.array(array) for name, array in arrays.items()
+                                    if name.startswith('q_storage_')})
+        self.history_array = np.array(arrays['history_array'])
+        self.max_gens = meta['max_gens']
+        self.performance_array = np.zeros((self.max_gens, 1))
+        self.performance_array[:len(arrays['performance_array'])] = arrays['performance_array']
+        self.norm_diff_array = np.zeros((self.max_gens, 1))
+        self.norm_diff_array[:len(arrays['norm_diff_array'])] = arrays['norm_diff_array']
+
+        self.gamma = meta['gamma']
+        self.learning_rate = meta['learning_rate']
+        self.random_factor = meta['random_factor']
+        self.gen_counter = meta['gen_counter']
+        self.step_counter = meta['step_counter']
+        self.player_position = meta['player_position']
+        self.norm_diff = meta['norm_diff']
+        self.previous_norm = meta['previous_norm']
+        self.current_norm = meta['current_norm']
+        self.rng.bit_generator.state = meta['rng_state']
+
+        self.tracker.stop_threshold = meta['stop_threshold']
+        self.tracker.stop_patience = meta['stop_patience']
+        self.tracker.squared_norm = meta['squared_norm']
+        self.tracker.previous_norm = self.previous_norm
+        self.tracker.current_norm = self.current_norm
+        self.tracker.converged_episodes = meta['converged_episodes']
+
+    @classmethod
+    def from_checkpoint(cls, path, mmap_mode=None, headless=False, metrics=None):
+        # Create a GridMove with the board and hyperparameters of a checkpoint, and load it.
+        meta = load_checkpoint_meta(path)
+        gm = cls(meta['obstacle_states'], meta['goal_state'], meta['max_gens'], meta['gamma'], meta['learning_rate'],
+                 meta['random_factor'], rows=meta['rows'], columns=meta['columns'], headless=headless,
+                 metrics=metrics)
+        gm.load(path, mmap_mode)
+        return gm
+
+    def trim_arrays(self):
         # Cut off last part of array, if it was too long (if there are zeros in the array)
         if np.argwhere(self.performance_array == 0).any():
             self.performance_array = self.performance_array[:np.argwhere(self.performance_array == 0)[0][0]]
@@ -302,27 +554,37 @@ class GridMove:
                     if event.key == pygame.K_d:
                         self.move(3)
 
+                    # Keypress space, let the Q matrix pick the move.
+                    if event.key == pygame.K_SPACE:
+                        self.move(int(np.argmax(self.q_storage.row((self.state_from_position(self.player_position),)))))
+
                     self.check_win_loss()
+                    self.draw()
 
-                    self.screen.blit(self.background, (0, 0))
-                    self.screen.blit(self.obstacle[0], (self.obstacle_positions[0]))
-                    self.screen.blit(self.obstacle[1], (self.obstacle_positions[1]))
-                    self.screen.blit(self.goal, self.goal_position)
-                    self.screen.blit(self.player, (self.player_position[0], self.player_position[1],))
+    def draw(self):
+        self.screen.blit(self.background, (0, 0))
+        for i, obstacle_position in enumerate(self.obstacle_positions):
+            self.screen.blit(self.obstacle[i % 2], obstacle_position)
+        for goal_position in self.goal_positions:
+            self.screen.blit(self.goal, goal_position)
+        self.screen.blit(self.player, (self.player_position[0], self.player_position[1],))
 
-                    pygame.display.update()
+        pygame.display.update()
 
 
 if __name__ == '__main__':
-    gm = GridMove(obs_1_state=12,
-                  obs_2_state=16,
+    gm = GridMove(obstacle_states=[12, 16],
                   goal_state=22,
                   max_gens=100,
                   gamma=0.5,
                   learning_rate=0.1,
-                  random_factor=0.1)
+                  random_factor=0.1,
+                  metrics=MetricsSink(echo=True),
+                  profiler=PhaseProfiler(enabled='--profile' in sys.argv))
 
     gm.train_run()
+    if gm.profiler.enabled:
+        print(gm.profiler.report())
     plt.subplot(2, 2, 1)
     plt.plot(range(len(gm.performance_array)), gm.performance_array)
 
@@ -330,8 +592,9 @@ if __name__ == '__main__':
     plt.plot(range(len(gm.norm_diff_array)), gm.norm_diff_array)
 
     plt.subplot(2, 2, 2)
-    plt.imshow(gm.history_array.reshape((5, 5)), cmap='hot', interpolation='nearest')
+    plt.imshow(gm.history_array.reshape((gm.rows, gm.columns)), cmap='hot', interpolation='nearest')
     plt.show()
+    # print(gm.solve())
     # gm.play()
 
     # print(np.around(gm.Q, 3))
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The games run without a window, and the plots without a display.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for directory in ('common', 'FlappyBird-master', 'grid_move'):
+    sys.path.append(os.path.join(ROOT, directory))
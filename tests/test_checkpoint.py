@@ -0,0 +1,76 @@
+import numpy as np
+
+from flappybird import FlappyBird
+from grid_move import GridMove
+from course import Course
+from q_storage import HashedQ
+
+
+def grid_move(q_storage=None):
+    return GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=20, gamma=0.5, learning_rate=0.1,
+                    random_factor=0.1, headless=True, rng=0, q_storage=q_storage)
+
+
+def test_grid_move_round_trip(tmp_path):
+    gm = grid_move()
+    gm.max_gens = 10
+    gm.train_run()
+    gm.save(tmp_path / 'gm')
+
+    loaded = GridMove.from_checkpoint(tmp_path / 'gm', headless=True)
+    np.testing.assert_array_equal(loaded.Q, gm.Q)
+    assert (loaded.gen_counter, loaded.step_counter, loaded.player_position) == \
+           (gm.gen_counter, gm.step_counter, gm.player_position)
+
+
+def test_grid_move_resumes_exactly(tmp_path):
+    # The random generator is saved as well, so training on from a checkpoint is the same as not stopping.
+    gm = grid_move()
+    gm.train_run()
+    stopped = grid_move()
+    stopped.max_gens = 10
+    stopped.train_run()
+    stopped.max_gens = 20
+    stopped.save(tmp_path / 'stopped')
+
+    resumed = GridMove.from_checkpoint(tmp_path / 'stopped', headless=True)
+    resumed.train_run()
+    assert resumed.gen_counter == gm.gen_counter
+    np.testing.assert_array_equal(resumed.Q, gm.Q)
+
+
+def test_grid_move_hashed_round_trip(tmp_path):
+    gm = grid_move(HashedQ(1, 4))
+    gm.max_gens = 10
+    gm.train_run()
+    gm.save(tmp_path / 'gm')
+
+    loaded = GridMove.from_checkpoint(tmp_path / 'gm', headless=True)
+    assert isinstance(loaded.q_storage, HashedQ)
+    np.testing.assert_array_equal(loaded.Q, gm.Q)
+
+
+def test_flappybird_round_trip(tmp_path):
+    fb = FlappyBird(max_gens=5, random_factor=0.1, headless=True, rng=0, course=Course(-110, 110, seed=0))
+    fb.train_run()
+    fb.save(tmp_path / 'fb')
+
+    loaded = FlappyBird.from_checkpoint(tmp_path / 'fb', headless=True)
+    np.testing.assert_array_equal(loaded.Q, fb.Q)
+    for name in ('gen_counter', 'step_counter', 'birdY', 'jump', 'jumpSpeed', 'gravity', 'wallx', 'offset',
+                 'counter'):
+        assert getattr(loaded, name) == getattr(fb, name), name
+    assert loaded.course.config() == fb.course.config()
+    assert len(loaded.replay_buffer) == len(fb.replay_buffer)
+    for name, array in fb.replay_buffer.arrays().items():
+        np.testing.assert_array_equal(loaded.replay_buffer.arrays()[name], array, err_msg=name)
+
+
+def test_flappybird_memory_mapped(tmp_path):
+    fb = FlappyBird(max_gens=2, headless=True, rng=0)
+    fb.train_run()
+    fb.save(tmp_path / 'fb')
+
+    loaded = FlappyBird.from_checkpoint(tmp_path / 'fb', mmap_mode='r', headless=True)
+    np.testing.assert_array_equal(loaded.Q, fb.Q)
+    assert not loaded.Q.flags.writeable
@@ -0,0 +1,34 @@
+import numpy as np
+
+from course import Course
+
+
+def test_same_seed_same_course():
+    # The course is the same whatever order its positions are read in, and however few chunks are kept.
+    first = Course(-110, 110, seed=7, chunk_size=16, max_chunks=1)
+    second = Course(-110, 110, seed=7, chunk_size=16, max_chunks=4)
+    forward = first.gaps(0, 200)
+    backward = [second.gap(i) for i in reversed(range(200))][::-1]
+    assert forward == backward
+    assert Course(**first.config()).gaps(0, 200) == forward
+
+
+def test_other_seed_other_course():
+    assert Course(-110, 110, seed=1).gaps(0, 100) != Course(-110, 110, seed=2).gaps(0, 100)
+
+
+def test_gap_matches_gaps():
+    course = Course(-110, 110, seed=3, chunk_size=10)
+    assert [course.gap(i) for i in range(35, 75)] == course.gaps(35, 75)
+
+
+def test_gaps_within_bounds():
+    gaps = np.array(Course(-3, 3, seed=0).gaps(0, 5000))
+    assert gaps.min() == -3 and gaps.max() == 3
+
+
+def test_seed_from_generator():
+    # A course seeded from a generator can be made again from its config.
+    course = Course(0, 10, seed=np.random.default_rng(0))
+    assert Course(**course.config()).gaps(0, 50) == course.gaps(0, 50)
+    assert Course(0, 10, seed=np.random.default_rng(0)).seed == course.seed
@@ -0,0 +1,55 @@
+import numpy as np
+
+from q_table import QTable
+
+
+def scalar_update(Q, states, actions, rewards, next_states, dones, gamma, learning_rate):
+    # The Bellman update one transition at a time, with all targets computed from Q before the update, and a pair
+    # that appears more than once moved by the mean of its TD errors.
+    targets = rewards + gamma * np.array([0.0 if done else Q[s].max() for s, done in zip(next_states, dones)])
+    td = {}
+    for s, a, target in zip(states, actions, targets):
+        td.setdefault((s, a), []).append(target - Q[s, a])
+    Q = Q.copy()
+    for (s, a), errors in td.items():
+        Q[s, a] += learning_rate * np.mean(errors)
+    return Q
+
+
+def test_update_matches_scalar_loop():
+    rng = np.random.default_rng(0)
+    Q = rng.random((25, 4))
+    # Few states, so the batch holds repeated (state, action) pairs.
+    states = rng.integers(0, 6, 200)
+    actions = rng.integers(0, 4, 200)
+    rewards = rng.normal(size=200)
+    next_states = rng.integers(0, 25, 200)
+    dones = rng.random(200) < 0.2
+
+    expected = scalar_update(Q, states, actions, rewards, next_states, dones, 0.5, 0.1)
+    QTable(Q, 0.5, 0.1).update(states, actions, rewards, next_states, dones)
+    np.testing.assert_allclose(Q, expected)
+
+
+def test_update_on_action_axis_0():
+    # FlappyBird keeps the actions on the first axis, as Q[action, dy, dx].
+    rng = np.random.default_rng(1)
+    Q = rng.random((2, 3, 4))
+    states = rng.integers(0, 12, 50)
+    actions = rng.integers(0, 2, 50)
+    rewards = rng.normal(size=50)
+    next_states = rng.integers(0, 12, 50)
+    dones = np.zeros(50, dtype=bool)
+
+    expected = scalar_update(np.moveaxis(Q, 0, -1).reshape(12, 2), states, actions, rewards, next_states, dones, 0.9,
+                             0.5)
+    QTable(Q, 0.9, 0.5, action_axis=0).update(states, actions, rewards, next_states, dones)
+    np.testing.assert_allclose(np.moveaxis(Q, 0, -1).reshape(12, 2), expected)
+
+
+def test_update_returns_changed_values():
+    Q = np.zeros((4, 2))
+    old, new = QTable(Q, 0.5, 1.0).update([0, 0, 1], [1, 1, 0], [1.0, 3.0, -1.0], [2, 2, 3])
+    np.testing.assert_allclose(np.sort(old), [0, 0])
+    np.testing.assert_allclose(np.sort(new), [-1, 2])
+    assert Q[0, 1] == 2 and Q[1, 0] == -1
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from replay_buffer import SumTree, ReplayBuffer
+
+
+@pytest.mark.parametrize('size', [1, 5, 8, 1000])
+def test_find_matches_prefix_sums(size):
+    rng = np.random.default_rng(size)
+    weights = rng.random(size)
+    weights[rng.random(size) < 0.2] = 0
+    weights[0] = 1.0
+    tree = SumTree(size)
+    tree.build(weights)
+
+    # The index a value falls into is the first one whose prefix sum is above it.
+    values = rng.random(500) * weights.sum()
+    np.testing.assert_array_equal(tree.find(values), np.searchsorted(np.cumsum(weights), values, side='right'))
+    assert tree.total == pytest.approx(weights.sum())
+
+
+def test_set_matches_build():
+    rng = np.random.default_rng(0)
+    weights = rng.random(100)
+    built = SumTree(100)
+    built.build(weights)
+
+    tree = SumTree(100)
+    for chunk in np.array_split(rng.permutation(100), 7):
+        tree.set(chunk, weights[chunk])
+    np.testing.assert_allclose(tree.tree, built.tree)
+    np.testing.assert_array_equal(tree.get(np.arange(100)), weights)
+
+    # Setting a repeated index keeps the sums above it right.
+    tree.set([3, 3, 50], [0.0, 0.0, 2.0])
+    weights[[3, 50]] = [0.0, 2.0]
+    assert tree.total == pytest.approx(weights.sum())
+
+
+def test_n_step_returns_store_their_step_count():
+    buffer = ReplayBuffer(100, n_step=3, gamma=0.5)
+    for state in range(4):
+        buffer.add(state, 0, 1.0, state + 1, done=state == 3)
+    arrays = buffer.arrays()
+    np.testing.assert_array_equal(arrays['steps'], [3, 3, 2, 1])
+    np.testing.assert_allclose(arrays['discounts'], 0.5 ** arrays['steps'])
+    np.testing.assert_allclose(arrays['rewards'], [1.75, 1.75, 1.5, 1.0])
+
+    # Older checkpoints have no step counts, which are then told from the discounts.
+    del arrays['steps']
+    restored = ReplayBuffer(100, n_step=3, gamma=0.5)
+    restored.restore(arrays)
+    np.testing.assert_array_equal(restored.arrays()['steps'], [3, 3, 2, 1])
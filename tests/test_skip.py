@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from flappybird import FlappyBird
+from course import Course
+
+FIELDS = ('birdY', 'jump', 'jumpSpeed', 'gravity', 'wallx', 'offset', 'counter', 'dead')
+
+
+def game(rng):
+    # A bird somewhere on the screen, jumping or falling, with the wall anywhere before it wraps.
+    fb = FlappyBird(max_gens=1, headless=True, course=Course(-110, 110, seed=0))
+    fb.birdY = float(rng.uniform(50, 650))
+    fb.bird[1] = int(fb.birdY)
+    fb.jump = int(rng.integers(0, 18))
+    fb.jumpSpeed = 10 - (17 - fb.jump) if fb.jump else int(rng.integers(-7, 10))
+    fb.gravity = 5 + 0.2 * int(rng.integers(0, 30))
+    fb.wallx = int(rng.integers(-40, 200)) * 2
+    return fb
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_skip_matches_stepping(seed):
+    rng = np.random.default_rng(seed)
+    skipped, stepped = game(rng), game(np.random.default_rng(seed))
+    max_ticks = int(rng.integers(1, 200))
+    ticks = skipped.skip(max_ticks)
+
+    for _ in range(ticks):
+        stepped.updateWalls()
+        stepped.birdUpdate()
+    assert tuple(getattr(skipped, name) for name in FIELDS) == tuple(getattr(stepped, name) for name in FIELDS)
+    assert skipped.bird == stepped.bird
+    assert not stepped.dead and stepped.gen_counter == 0
+
+    # skip stops before the tick in which the bird hits a wall or leaves the screen, or the wall wraps around.
+    if ticks < max_ticks:
+        counter, wallx = stepped.counter, stepped.wallx
+        stepped.updateWalls()
+        stepped.birdUpdate()
+        assert stepped.dead or stepped.gen_counter == 1 or stepped.counter != counter or stepped.wallx > wallx
+
+
+def test_skip_does_nothing_when_dead():
+    fb = game(np.random.default_rng(0))
+    fb.dead = True
+    assert fb.skip(100) == 0
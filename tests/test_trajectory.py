@@ -0,0 +1,63 @@
+from flappybird import FlappyBird
+from grid_move import GridMove
+from course import Course
+from trajectory import TrajectoryRecorder, load_trajectory, replay
+
+
+def test_grid_move_replays_without_mismatches(tmp_path):
+    recorder = TrajectoryRecorder(tmp_path / 'gm.traj')
+    gm = GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=20, gamma=0.5, learning_rate=0.1,
+                  random_factor=0.2, headless=True, rng=0, recorder=recorder)
+    gm.train_run()
+    recorder.close()
+
+    result = replay(tmp_path / 'gm.traj')
+    assert result['game'] == 'grid_move'
+    assert result['steps'] > 0
+    assert result['episodes'] == 20
+    assert result['mismatches'] == 0
+
+
+def test_flappybird_replays_without_mismatches(tmp_path):
+    recorder = TrajectoryRecorder(tmp_path / 'fb.traj')
+    fb = FlappyBird(max_gens=5, random_factor=0.1, headless=True, rng=0, course=Course(-110, 110, seed=0),
+                    recorder=recorder)
+    fb.train_run()
+    recorder.close()
+
+    result = replay(tmp_path / 'fb.traj')
+    assert result['game'] == 'flappybird'
+    assert result['steps'] > 0
+    assert result['mismatches'] == 0
+
+
+def test_recording_appends_to_an_existing_file(tmp_path):
+    path = tmp_path / 'gm.traj'
+    for seed in (0, 1):
+        recorder = TrajectoryRecorder(path)
+        GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=5, gamma=0.5, learning_rate=0.1,
+                 random_factor=0.2, headless=True, rng=seed, recorder=recorder).train_run()
+        recorder.close()
+
+    _, _, records = load_trajectory(path)
+    result = replay(path)
+    assert result['steps'] == len(records)
+    assert result['mismatches'] == 0
+
+
+def test_replay_counts_mismatches(tmp_path):
+    path = tmp_path / 'gm.traj'
+    recorder = TrajectoryRecorder(path)
+    GridMove(obstacle_states=[12, 16], goal_state=22, max_gens=5, gamma=0.5, learning_rate=0.1, random_factor=0.2,
+             headless=True, rng=0, recorder=recorder).train_run()
+    recorder.close()
+
+    # Move the player of one step elsewhere, which the step before it does not lead to.
+    _, _, records = load_trajectory(path)
+    records = records.copy()
+    records['state'][3] = (records['state'][3] + 1) % 25
+    edited = TrajectoryRecorder(tmp_path / 'edited.traj')
+    edited.start('grid_move', dict(obstacle_states=[12, 16], goal_state=22, rows=5, columns=5))
+    edited.extend(records)
+    edited.close()
+    assert replay(tmp_path / 'edited.traj')['mismatches'] > 0